@@ -0,0 +1,239 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""vNIC MAC, IB port GUID and DHCP client-id conversions.
+
+The GUID of a vNIC holds the upper three bytes of the MAC, two zero bytes
+and the lower three bytes of the MAC. mlnx4 writes it as 16 hex digits,
+mlnx5 as 8 colon separated bytes. The IB DHCP client-id is the mlnx5 GUID
+behind a fixed prefix.
+
+The conversions work on the 48 bit MAC and 64 bit GUID integers. The bulk
+functions convert whole lists with NumPy when it is installed, and one item
+at a time otherwise. Results are lower case, unless the converted item has
+upper case hex digits.
+"""
+
+from oslo_utils import importutils
+
+numpy = importutils.try_import('numpy')
+
+CLIENT_ID_PREFIX = 'ff:00:00:00:00:00:02:00:00:02:c9:00:'
+
+MLNX4_INVALID_GUID = 0xffffffffffffffff
+
+_MAC_LOW_MASK = 0xffffff
+
+# Smaller lists are converted faster one item at a time
+NUMPY_MIN_ITEMS = 64
+
+
+class _Format(object):
+    """Fixed width text of an integer, hex digits with byte separators."""
+
+    def __init__(self, digits, sep='', prefix=''):
+        self.digits = digits
+        self.sep = sep
+        self.prefix = prefix
+        if sep:
+            text = prefix + sep.join(['xx'] * (digits // 2))
+        else:
+            text = prefix + 'x' * digits
+        self.width = len(text)
+        self.hex_columns = [i for i, c in enumerate(text) if c == 'x']
+        self.fixed_columns = [i for i, c in enumerate(text) if c != 'x']
+        self.template = text.replace('x', '0').encode('ascii')
+
+    def parse(self, text):
+        if self.sep:
+            text = text.replace(self.sep, '')
+        value = int(text, 16)
+        if value >> (4 * self.digits):
+            raise ValueError("%s has more than %d hex digits" %
+                             (text, self.digits))
+        return value
+
+    def format(self, value, upper=False):
+        digits = ('%0*X' if upper else '%0*x') % (self.digits, value)
+        if self.sep:
+            digits = self.sep.join([digits[i:i + 2]
+                                    for i in range(0, self.digits, 2)])
+        return self.prefix + digits
+
+
+MAC = _Format(12, ':')
+MLNX4_GUID = _Format(16)
+MLNX5_GUID = _Format(16, ':')
+CLIENT_ID = _Format(16, ':', CLIENT_ID_PREFIX)
+
+
+def mac_to_guid(mac):
+    """Return the GUID of a MAC integer or of a NumPy array of them."""
+    return ((mac >> 24) << 40) | (mac & _MAC_LOW_MASK)
+
+
+def guid_to_mac(guid):
+    """Return the MAC of a GUID integer or of a NumPy array of them."""
+    return ((guid >> 40) << 24) | (guid & _MAC_LOW_MASK)
+
+
+def _mlnx4_guid_to_mac(guid):
+    # The invalid mlnx4 GUID stands for the all zeros MAC
+    mac = guid_to_mac(guid)
+    if numpy is not None and isinstance(guid, numpy.ndarray):
+        mac[guid == MLNX4_INVALID_GUID] = 0
+    elif guid == MLNX4_INVALID_GUID:
+        mac = 0
+    return mac
+
+
+def _convert_one(item, parse_format, convert, result_format):
+    # Upper case hex digits are kept upper case, as the string slicing
+    # these conversions replaced did
+    return result_format.format(convert(parse_format.parse(item)),
+                                upper=item != item.lower())
+
+
+def mac_to_mlnx4_guid(mac):
+    return _convert_one(mac, MAC, mac_to_guid, MLNX4_GUID)
+
+
+def mac_to_mlnx5_guid(mac):
+    return _convert_one(mac, MAC, mac_to_guid, MLNX5_GUID)
+
+
+def mac_to_client_id(mac):
+    return _convert_one(mac, MAC, mac_to_guid, CLIENT_ID)
+
+
+def mlnx4_guid_to_mac(guid):
+    return _convert_one(guid, MLNX4_GUID, _mlnx4_guid_to_mac, MAC)
+
+
+def mlnx5_guid_to_mac(guid):
+    return _convert_one(guid, MLNX5_GUID, guid_to_mac, MAC)
+
+
+def macs_to_mlnx4_guids(macs):
+    return _convert(macs, MAC, mac_to_guid, MLNX4_GUID)
+
+
+def macs_to_mlnx5_guids(macs):
+    return _convert(macs, MAC, mac_to_guid, MLNX5_GUID)
+
+
+def macs_to_client_ids(macs):
+    return _convert(macs, MAC, mac_to_guid, CLIENT_ID)
+
+
+def mlnx4_guids_to_macs(guids, invalid=None):
+    """Return the MACs of mlnx4 GUIDs.
+
+    Malformed GUIDs give the invalid MAC, or raise ValueError when it is
+    None.
+    """
+    return _convert(guids, MLNX4_GUID, _mlnx4_guid_to_mac, MAC, invalid)
+
+
+def mlnx5_guids_to_macs(guids, invalid=None):
+    """Return the MACs of mlnx5 GUIDs.
+
+    Malformed GUIDs give the invalid MAC, or raise ValueError when it is
+    None.
+    """
+    return _convert(guids, MLNX5_GUID, guid_to_mac, MAC, invalid)
+
+
+def _convert(items, parse_format, convert, result_format, invalid=None):
+    items = list(items)
+    if numpy is not None and len(items) >= NUMPY_MIN_ITEMS:
+        parsed = _parse_array(items, parse_format)
+        if parsed is not None:
+            values, upper, valid = parsed
+            results = _format_array(convert(values), result_format, upper)
+            # Items not in the expected form, such as GUIDs printed without
+            # their leading zeros, are converted one at a time
+            for index in numpy.flatnonzero(~valid):
+                results[index] = _convert_or_invalid(
+                    items[index], parse_format, convert, result_format,
+                    invalid)
+            return results
+    return [_convert_or_invalid(item, parse_format, convert, result_format,
+                                invalid)
+            for item in items]
+
+
+def _convert_or_invalid(item, parse_format, convert, result_format,
+                        invalid):
+    try:
+        return _convert_one(item, parse_format, convert, result_format)
+    except (TypeError, ValueError):
+        if invalid is None:
+            raise
+        return invalid
+
+
+if numpy is not None:
+    # Value of each hex digit character, -1 for the other characters
+    _HEX_VALUES = numpy.full(256, -1, dtype=numpy.int8)
+    for _value, _char in enumerate(bytearray(b'0123456789abcdef')):
+        _HEX_VALUES[_char] = _value
+    for _value, _char in enumerate(bytearray(b'ABCDEF')):
+        _HEX_VALUES[_char] = _value + 10
+    _HEX_DIGITS = numpy.frombuffer(b'0123456789abcdef', dtype=numpy.uint8)
+    _UPPER_HEX_DIGITS = numpy.frombuffer(b'0123456789ABCDEF',
+                                         dtype=numpy.uint8)
+
+
+def _digit_shifts(fmt):
+    return numpy.arange(4 * (fmt.digits - 1), -1, -4, dtype=numpy.uint64)
+
+
+def _parse_array(items, fmt):
+    """Return the integers of the items as an uint64 array.
+
+    Also return whether each item has upper case hex digits and whether it
+    is in the format, the integers of the items which are not are 0. Return
+    None when the items are not all strings of the format width.
+    """
+    try:
+        text = numpy.array(items, dtype=bytes)
+    except (UnicodeError, TypeError, ValueError):
+        return None
+    if text.ndim != 1 or text.itemsize != fmt.width:
+        return None
+    chars = text.view(numpy.uint8).reshape(len(items), fmt.width)
+    template = numpy.frombuffer(fmt.template, dtype=numpy.uint8)
+    hex_chars = chars[:, fmt.hex_columns]
+    digits = _HEX_VALUES[hex_chars]
+    valid = ((chars[:, fmt.fixed_columns] ==
+              template[fmt.fixed_columns]).all(axis=1) &
+             (digits >= 0).all(axis=1))
+    digits[~valid] = 0
+    upper = ((hex_chars >= ord('A')) & (hex_chars <= ord('F'))).any(axis=1)
+    values = numpy.bitwise_or.reduce(
+        digits.astype(numpy.uint64) << _digit_shifts(fmt), axis=1)
+    return values, upper, valid
+
+
+def _format_array(values, fmt, upper):
+    digits = (values[:, numpy.newaxis] >> _digit_shifts(fmt)) & 0xf
+    chars = numpy.tile(numpy.frombuffer(fmt.template, dtype=numpy.uint8),
+                       (len(values), 1))
+    chars[:, fmt.hex_columns] = numpy.where(upper[:, numpy.newaxis],
+                                            _UPPER_HEX_DIGITS[digits],
+                                            _HEX_DIGITS[digits])
+    text = chars.view('S%d' % fmt.width).ravel()
+    return text.astype(str).tolist()
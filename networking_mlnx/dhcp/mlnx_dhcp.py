@@ -17,6 +17,8 @@ from neutron_lib.api.definitions import extra_dhcp_opt as edo_ext
 
 from neutron.agent.linux import dhcp
 
+from networking_mlnx.common import ib_address
+
 
 class DhcpOpt(object):
     def __init__(self, **kwargs):
@@ -28,15 +30,9 @@ class DhcpOpt(object):
 
 
 class MlnxDnsmasq(dhcp.Dnsmasq):
-    _PREFIX = 'ff:00:00:00:00:00:02:00:00:02:c9:00:'
-    _MIDDLE = ':00:00:'
 
     def _gen_client_id(self, port):
-        mac_address = port.mac_address
-        mac_first = mac_address[:8]
-        mac_last = mac_address[9:]
-        client_id = ''.join([self._PREFIX, mac_first, self._MIDDLE, mac_last])
-        return client_id
+        return ib_address.mac_to_client_id(port.mac_address)
 
     def _gen_client_id_opt(self, client_id):
         return DhcpOpt(opt_name=edo_ext.DHCP_OPT_CLIENT_ID,
@@ -100,3 +100,13 @@ class ConnUtil(object):
         recv_msg = self.send_msg(msg)
         tables = recv_msg['tables']
         return tables
+
+    def get_sysfs_stats(self):
+        msg = jsonutils.dumps({'action': 'get_sysfs_stats'})
+        recv_msg = self.send_msg(msg)
+        return recv_msg['stats']
+
+    def get_vf_rebinds(self):
+        msg = jsonutils.dumps({'action': 'get_vf_rebinds'})
+        recv_msg = self.send_msg(msg)
+        return recv_msg['rebinds']
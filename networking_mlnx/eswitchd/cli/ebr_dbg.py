@@ -68,6 +68,26 @@ def main():
             sys.stderr.write(e.message)
             sys.exit(1)
         sys.exit(0)
+    elif action == 'get-sysfs-stats':
+        try:
+            stats = client.get_sysfs_stats()
+        except exceptions.MlxException as e:
+            sys.stderr.write("Error in get-sysfs-stats command")
+            sys.stderr.write(e.message)
+            sys.exit(1)
+        for name, count in sorted(stats.items()):
+            print("%s = %s" % (name, count))
+        sys.exit(0)
+    elif action == 'get-vf-rebinds':
+        try:
+            rebinds = client.get_vf_rebinds()
+        except exceptions.MlxException as e:
+            sys.stderr.write("Error in get-vf-rebinds command")
+            sys.stderr.write(e.message)
+            sys.exit(1)
+        for dev, state in sorted(rebinds.items()):
+            print("%s = %s" % (dev, state))
+        sys.exit(0)
 
 if __name__ == '__main__':
     main()
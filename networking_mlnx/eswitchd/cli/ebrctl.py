@@ -17,6 +17,8 @@
 import argparse
 import sys
 
+from oslo_serialization import jsonutils
+
 from networking_mlnx.eswitchd.cli import conn_utils
 from networking_mlnx.eswitchd.cli import exceptions
 
@@ -27,7 +29,7 @@ def parse():
     """Main method that manages supported CLI commands.
 
     The actions that are supported throught the CLI are:
-    write-sys, del-port, allocate-port and add-port
+    write-sys, write-sys-server, del-port, allocate-port and add-port
     Each action is matched with method that should handle it
     e.g. write-sys action is matched with  write_sys method
     """
@@ -57,6 +59,9 @@ def parse():
     parser_write_sys.add_argument('path')
     parser_write_sys.add_argument('value')
 
+    parser_write_sys_server = subparsers.add_parser('write-sys-server')
+    parser_write_sys_server.set_defaults(func=write_sys_server)
+
     args = parser.parse_args()
     args.func(args)
 
@@ -96,5 +101,31 @@ def write_sys(args):
     sys.exit(0)
 
 
+def write_sys_server(args):
+    """Serve batches of sysfs writes until stdin is closed.
+
+    Each stdin line is a JSON list of [path, value] writes, answered by a
+    stdout line with the JSON list of errors, None for a successful write.
+    Writes following a failed one are not done.
+    """
+    for line in iter(sys.stdin.readline, ''):
+        errors = []
+        failed = False
+        for path, value in jsonutils.loads(line):
+            if failed:
+                errors.append('not written, a previous write failed')
+                continue
+            try:
+                with open(path, 'w') as fd:
+                    fd.write(value)
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e))
+                failed = True
+        sys.stdout.write(jsonutils.dumps(errors) + '\n')
+        sys.stdout.flush()
+    sys.exit(0)
+
+
 def main():
     parse()
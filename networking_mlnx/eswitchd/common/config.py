@@ -34,11 +34,66 @@ mlx_daemon_opts = [
                help=('Default timeout waiting for messages')),
     cfg.IntOpt('max_polling_count',
                default=5,
-               help=('Daemon will do sync after max_polling_count '
-                     '* default_timeout')),
+               help=('With domain_events disabled, daemon will do sync '
+                     'after max_polling_count * default_timeout')),
+    cfg.BoolOpt('domain_events',
+                default=True,
+                help=('Track the devices attached to domains from libvirt '
+                      'domain events. When disabled, the devices are '
+                      'polled every max_polling_count * default_timeout')),
+    cfg.IntOpt('libvirt_workers',
+               default=8,
+               min=1,
+               help=('Number of threads inspecting libvirt domains in '
+                     'parallel during a full devices sync')),
+    cfg.IntOpt('full_sync_interval',
+               default=3600,
+               min=0,
+               help=('Seconds between full resyncs of the devices attached '
+                     'to all the domains, 0 disables them. Only used with '
+                     'domain_events enabled, where it is a safety net; '
+                     'without events devices are synced every '
+                     'max_polling_count * default_timeout')),
+    cfg.StrOpt('sysfs_root',
+               default='/sys',
+               help=('Directory of the sysfs tree, a generated tree stands '
+                     'in for /sys in tests and benchmarks')),
     cfg.StrOpt('rootwrap_conf',
                default='/etc/neutron/rootwrap.conf',
-               help=('rootwrap configuration file'))
+               help=('rootwrap configuration file')),
+    cfg.IntOpt('pkey_cache_ttl',
+               default=60,
+               min=0,
+               help=('Seconds an IB port pkey table is cached before it is '
+                     'read again from sysfs, 0 reads it again on every '
+                     'lookup')),
+    cfg.BoolOpt('persistent_sysfs_writer',
+                default=True,
+                help=('Write sysfs files through a single long-lived '
+                      'privileged ebrctl process instead of running '
+                      'ebrctl through rootwrap for every write')),
+    cfg.BoolOpt('skip_unchanged_sysfs_writes',
+                default=True,
+                help=('Skip sysfs writes of the value eswitchd last wrote '
+                      'to the same file, and the VF driver rebind of a VF '
+                      'already detached')),
+    cfg.IntOpt('rebind_workers',
+               default=4,
+               min=1,
+               help=('Number of threads rebinding the driver of released '
+                     'mlnx5 VFs in the background')),
+    cfg.IntOpt('workers',
+               default=4,
+               min=1,
+               help=('Number of worker threads handling daemon requests. '
+                     'Read requests are served concurrently, requests '
+                     'changing a VF are serialized per VF')),
+    cfg.IntOpt('batch_workers',
+               default=8,
+               min=1,
+               help=('Number of threads running the messages of a batch '
+                     'request. Messages touching different VFs run in '
+                     'parallel'))
 ]
 
 
@@ -29,6 +29,7 @@ INVALID_MAC = '00:00:00:00:00:00'
 MLNX4_ADMIN_GUID_PATH = "/sys/class/infiniband/%s/iov/ports/%s/admin_guids/%s"
 MLNX4_GUID_INDEX_PATH = "/sys/class/infiniband/%s/iov/%s/ports/%s/gid_idx/0"
 MLNX4_PKEY_INDEX_PATH = "/sys/class/infiniband/%s/iov/%s/ports/%s/pkey_idx/%s"
+MLNX4_PKEYS_PATH = "/sys/class/infiniband/%s/ports/%s/pkeys"
 
 # MLNX5
 MLNX5_GUID_NODE_PATH = ('/sys/class/infiniband/%(module)s/device/sriov/'
@@ -54,3 +55,12 @@ MLNX5_VF_DEVICE_TYPE = 'MLNX5'
 SOCKET_OS_PORT = '60001'
 SOCKET_OS_TRANSPORT = 'tcp'
 SOCKET_OS_ADDR = '0.0.0.0'
+SOCKET_REPLIES_URL = 'inproc://eswitchd-replies'
+SOCKET_DOMAINS_URL = 'inproc://eswitchd-domains'
+SOCKET_EVENTS_PORT = '60002'
+
+VNIC_CHANGED_EVENT = 'vnic_changed'
+
+LOCK_PREFIX = 'eswitchd-'
+
+BATCH_ACTION = 'batch'
@@ -20,3 +20,13 @@ class MlxException(Exception):
 
     def __str__(self):
         return 'MlxException: %s' % self.message
+
+
+class SysfsWriteError(MlxException):
+    pass
+
+
+class NetlinkError(MlxException):
+    def __init__(self, message=None, errno=None):
+        super(NetlinkError, self).__init__(message)
+        self.errno = errno
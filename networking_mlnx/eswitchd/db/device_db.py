@@ -23,8 +23,11 @@ LOG = logging.getLogger(__name__)
 class DeviceDB(object):
     def __init__(self):
         self.device_db = {}
+        # VF PCI address to (fabric, pf, vf details)
+        self.vf_index = {}
 
     def add_fabric(self, fabric, pf, hca_port, pf_mlx_dev):
+        self._remove_pf_vfs(fabric, pf)
         pf_details = {}
         pf_details['vfs'] = {}
         pf_details['pf_device_type'] = None
@@ -42,12 +45,27 @@ class DeviceDB(object):
             return self.device_db[fabric][pf]
 
     def set_fabric_devices(self, fabric, pf, vfs):
+        self._remove_pf_vfs(fabric, pf)
         self.device_db[fabric][pf]['vfs'] = vfs
+        for dev, vf in six.iteritems(vfs):
+            self.vf_index[dev] = (fabric, pf, vf)
         vf = six.next(six.itervalues(vfs))
-        self.device_db[fabric][pf]['pf_device_type'] = vf['vf_device_type']
+        self.device_db[fabric][pf]['pf_device_type'] = vf.vf_device_type
+
+    def _remove_pf_vfs(self, fabric, pf):
+        pf_details = self.device_db.get(fabric, {}).get(pf)
+        if pf_details is None:
+            return
+        for dev in pf_details['vfs']:
+            dev_details = self.vf_index.get(dev)
+            if dev_details and dev_details[:2] == (fabric, pf):
+                del self.vf_index[dev]
+
+    def get_dev_details(self, dev):
+        """Return the (fabric, pf, vf details) of a VF, None if unknown."""
+        return self.vf_index.get(dev)
 
     def get_dev_fabric(self, dev):
-        for fabric in self.device_db:
-            for pf in self.device_db[fabric]:
-                if dev in self.device_db[fabric][pf]['vfs']:
-                    return fabric
+        dev_details = self.vf_index.get(dev)
+        if dev_details:
+            return dev_details[0]
@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import threading
+
 from networking_mlnx._i18n import _LI
 from oslo_log import log as logging
 
@@ -20,48 +23,165 @@ from networking_mlnx.eswitchd.common import constants
 
 LOG = logging.getLogger(__name__)
 
+# Number of vNIC changes kept per eswitch for get_vnics_delta
+MAX_VNIC_CHANGES = 1024
+
+
+class GenerationCounter(object):
+    """Generation number shared by the eswitch tables of a daemon.
+
+    The lock must be held while allocating a generation and recording the
+    change it stands for, so a reader holding the lock never sees a
+    generation whose change is not recorded yet.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def next(self):
+        self.value += 1
+        return self.value
+
+
+class PortEntry(object):
+    """Port table record of a VF."""
+
+    __slots__ = ('type', 'vnic', 'state', 'alias', 'device_id')
+
+    def __init__(self, port_type, vnic=None, state=None, alias=None,
+                 device_id=None):
+        self.type = port_type
+        self.vnic = vnic
+        self.state = state
+        self.alias = alias
+        self.device_id = device_id
+
+
+class VnicPolicy(object):
+    """Port policy record of a vNIC MAC."""
+
+    __slots__ = ('vlan', 'dev', 'device_id', 'port_id')
+
+    def __init__(self, vlan=None, dev=None, device_id=None, port_id=None):
+        self.vlan = vlan
+        self.dev = dev
+        self.device_id = device_id
+        self.port_id = port_id
+
 
 class eSwitchDB(object):
 
-    def __init__(self, pf, vfs):
+    def __init__(self, pf, vfs, generations=None, listener=None):
         self.port_table = {}
         self.port_policy = {}
         self.vfs = vfs
         self.pf = pf
+        self.generations = generations or GenerationCounter()
+        # Generation of the last attached vNIC change in this table
+        self.generation = 0
+        # Changes older than this generation were dropped from the log
+        self.oldest_generation = 0
+        self.vnic_changes = collections.deque(maxlen=MAX_VNIC_CHANGES)
+        # Called with (eswitch, vnic_mac, port_name, generation) once an
+        # attached vNIC change is recorded
+        self.listener = listener
+        # vNIC MAC to the port it is set on, and the attached vNIC MACs
+        self.vnic_ports = {}
+        self.attached_vnics = set()
 
     def create_port(self, port_name, port_type):
-        self.port_table.update({port_name: {'type': port_type,
-                                            'vnic': None,
-                                            'state': None,
-                                            'alias': None,
-                                            'device_id': None}})
+        self.port_table[port_name] = PortEntry(port_type)
 
     def plug_nic(self, port_name):
-        self.port_table[port_name]['state'] = constants.VPORT_STATE_ATTACHED
+        port = self.port_table[port_name]
+        port.state = constants.VPORT_STATE_ATTACHED
+        self._vnic_changed(port.vnic, port_name)
         LOG.info(_LI("port table:"), self.port_table)
 
+    def _set_port_vnic(self, port_name, vnic_mac):
+        port = self.port_table[port_name]
+        old_vnic_mac = port.vnic
+        port.vnic = vnic_mac
+        if old_vnic_mac != vnic_mac:
+            self._vnic_changed(old_vnic_mac, port_name)
+
+    def _index_vnic(self, vnic_mac, port_name):
+        port = self.port_table.get(port_name)
+        if port and port.vnic == vnic_mac:
+            self.vnic_ports[vnic_mac] = port_name
+            if port.state == constants.VPORT_STATE_ATTACHED:
+                self.attached_vnics.add(vnic_mac)
+            else:
+                self.attached_vnics.discard(vnic_mac)
+        elif self.vnic_ports.get(vnic_mac) == port_name:
+            del self.vnic_ports[vnic_mac]
+            self.attached_vnics.discard(vnic_mac)
+
+    def _vnic_changed(self, vnic_mac, port_name):
+        if not vnic_mac:
+            return
+        self._index_vnic(vnic_mac, port_name)
+        with self.generations.lock:
+            if len(self.vnic_changes) == self.vnic_changes.maxlen:
+                self.oldest_generation = self.vnic_changes[0][0]
+            generation = self.generations.next()
+            self.generation = generation
+            self.vnic_changes.append((generation, vnic_mac))
+        if self.listener:
+            self.listener(self, vnic_mac, port_name, generation)
+
+    def get_vnic_changes(self, since_generation):
+        """Return MACs whose attachment changed after since_generation.
+
+        Return None when the changes are no longer known and the caller
+        must fall back to the full attached vNICs table. The generations
+        lock must be held.
+        """
+        if since_generation < self.oldest_generation:
+            return None
+        vnics = set()
+        if self.generation > since_generation:
+            for generation, vnic_mac in reversed(self.vnic_changes):
+                if generation <= since_generation:
+                    break
+                vnics.add(vnic_mac)
+        return vnics
+
     def get_port_state(self, dev):
         state = None
-        dev = self.port_table.get(dev)
-        if dev:
-            state = dev.get('state')
+        port = self.port_table.get(dev)
+        if port:
+            state = port.state
         return state
 
     def get_attached_vnics(self):
         vnics = {}
-        for port in self.port_table.values():
-            vnic_mac = port['vnic']
-            state = port['state']
-            if vnic_mac and state == constants.VPORT_STATE_ATTACHED:
-                device_id = self.port_policy[vnic_mac]['device_id']
-                vnics[vnic_mac] = {'mac': vnic_mac, 'device_id': device_id}
+        for vnic_mac in list(self.attached_vnics):
+            vnic = self.get_attached_vnic(vnic_mac)
+            if vnic:
+                vnics[vnic_mac] = vnic
         return vnics
 
+    def get_attached_vnic(self, vnic_mac):
+        if vnic_mac not in self.attached_vnics:
+            return None
+        policy = self.port_policy.get(vnic_mac)
+        if policy is None:
+            return None
+        return {'mac': vnic_mac, 'device_id': policy.device_id}
+
+    def is_vnic_attached(self, vnic_mac):
+        return vnic_mac in self.attached_vnics
+
+    def get_port_for_vnic(self, vnic_mac):
+        return self.vnic_ports.get(vnic_mac)
+
     def get_port_policy_matrix(self):
         table_matrix = [['VNIC_MAC', 'VLAN', 'DEV', 'DEVICE_ID']]
-        for vnic_mac, port_policy in self.port_policy.items():
-            table_matrix.append([vnic_mac, port_policy['vlan'],
-                                 port_policy['dev'], port_policy['device_id']])
+        for vnic_mac, port_policy in list(self.port_policy.items()):
+            table_matrix.append([vnic_mac, port_policy.vlan,
+                                 port_policy.dev, port_policy.device_id])
         return table_matrix
 
     def get_port_table(self):
@@ -70,25 +190,22 @@ class eSwitchDB(object):
     def get_port_table_matrix(self):
         table_matrix = [['PORT_NAME', 'TYPE', 'VNIC', 'STATE', 'ALIAS',
                          'DEVICE_ID']]
-        for port_name, port_data in self.port_table.items():
-            table_matrix.append([port_name, port_data['type'],
-                                 port_data['vnic'],
-                                 port_data['state'], port_data['alias'],
-                                 port_data['device_id']])
+        for port_name, port_data in list(self.port_table.items()):
+            table_matrix.append([port_name, port_data.type,
+                                 port_data.vnic,
+                                 port_data.state, port_data.alias,
+                                 port_data.device_id])
         return table_matrix
 
     def create_vnic(self, vnic_mac):
         if not self.vnic_exists(vnic_mac):
-            self.port_policy.update({vnic_mac: {'vlan': None,
-                                                'dev': None,
-                                                'device_id': None,
-                                                'port_id': None}})
+            self.port_policy[vnic_mac] = VnicPolicy()
 
     def get_dev_for_vnic(self, vnic_mac):
         dev = None
-        if vnic_mac in self.port_policy:
-            if 'dev' in self.port_policy[vnic_mac]:
-                dev = self.port_policy[vnic_mac]['dev']
+        policy = self.port_policy.get(vnic_mac)
+        if policy:
+            dev = policy.dev
         return dev
 
     def vnic_exists(self, vnic_mac):
@@ -97,41 +214,48 @@ class eSwitchDB(object):
         else:
             return False
 
+    def set_vnic(self, port_name, device_id, vnic_mac):
+        self._set_port_vnic(port_name, vnic_mac)
+        self.port_policy[vnic_mac] = VnicPolicy(dev=port_name,
+                                                device_id=device_id)
+        self._vnic_changed(vnic_mac, port_name)
+
     def attach_vnic(self, port_name, device_id, vnic_mac, dev_name=None):
-        self.port_table[port_name]['vnic'] = vnic_mac
-        self.port_table[port_name]['alias'] = dev_name
-        self.port_table[port_name]['state'] = constants.VPORT_STATE_PENDING
-        self.port_table[port_name]['device_id'] = device_id
+        self._set_port_vnic(port_name, vnic_mac)
+        port = self.port_table[port_name]
+        port.alias = dev_name
+        port.state = constants.VPORT_STATE_PENDING
+        port.device_id = device_id
+        self._vnic_changed(vnic_mac, port_name)
         dev = self.get_dev_for_vnic(vnic_mac)
         if not dev and vnic_mac != constants.INVALID_MAC:
             if vnic_mac in self.port_policy:
                 vnic_mac_entry = self.port_policy[vnic_mac]
-                vnic_mac_entry['dev'] = port_name
-                vnic_mac_entry['device_id'] = device_id
-                vnic_mac_entry.setdefault('vlan', None)
+                vnic_mac_entry.dev = port_name
+                vnic_mac_entry.device_id = device_id
             else:
-                self.port_policy.update({vnic_mac: {'vlan': None,
-                                                    'dev': port_name,
-                                                    'device_id': device_id,
-                                                    }})
+                self.port_policy[vnic_mac] = VnicPolicy(dev=port_name,
+                                                        device_id=device_id)
             return True
         return False
 
     def detach_vnic(self, vnic_mac):
         dev = self.get_dev_for_vnic(vnic_mac)
         if dev:
-            self.port_table[dev]['vnic'] = None
-            self.port_table[dev]['alias'] = None
-            self.port_table[dev]['state'] = constants.VPORT_STATE_UNPLUGGED
-            self.port_table[dev]['device_id'] = None
+            port = self.port_table[dev]
+            port.vnic = None
+            port.alias = None
+            port.state = constants.VPORT_STATE_UNPLUGGED
+            port.device_id = None
+            self._vnic_changed(vnic_mac, dev)
         return dev
 
     def port_release(self, vnic_mac):
         try:
             dev = self.get_dev_for_vnic(vnic_mac)
             vnic = self.port_policy.pop(vnic_mac)
-            self.port_table[dev]['state'] = None
-            vnic['type'] = self.port_table[vnic['dev']]['type']
+            self.port_table[dev].state = None
+            self._vnic_changed(vnic_mac, dev)
             return vnic
         except KeyError:
             return
@@ -142,4 +266,4 @@ class eSwitchDB(object):
         if not self.vnic_exists(vnic_mac):
             self.create_vnic(vnic_mac)
 
-        self.port_policy[vnic_mac]['vlan'] = vlan
+        self.port_policy[vnic_mac].vlan = vlan
@@ -0,0 +1,89 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+
+from networking_mlnx.eswitchd.utils import helper_utils
+
+
+class GuidCache(object):
+    """Snapshot of the VF MACs of each PF, derived from the VF GUIDs.
+
+    The GUIDs of a PF are read from sysfs in one pass the first time they
+    are needed and after refresh(). In between, the snapshot is updated
+    with the GUIDs eswitchd writes itself. A read done while a GUID of
+    the PF was written, or while the cache was refreshed, may miss the
+    change and is not kept.
+    """
+
+    def __init__(self, pci_utils):
+        self.pci_utils = pci_utils
+        self._lock = threading.Lock()
+        # (pf_mlx_dev, hca_port) to {vf index: mac}
+        self._macs = {}
+        # (pf_mlx_dev, hca_port) to its count of GUID writes
+        self._writes = collections.Counter()
+        self._refreshes = 0
+
+    @staticmethod
+    def _get_key(pf_fabric_details):
+        return (pf_fabric_details['pf_mlx_dev'],
+                pf_fabric_details['hca_port'])
+
+    def get_vfs_macs(self, fabric_details):
+        """Return the VF MACs of all the PFs of a fabric by VF index."""
+        with self._lock:
+            missing = [pf_fabric_details
+                       for pf_fabric_details in fabric_details.values()
+                       if self._get_key(pf_fabric_details) not in self._macs]
+            versions = [self._get_version(self._get_key(pf_fabric_details))
+                        for pf_fabric_details in missing]
+        pfs_macs = helper_utils.parallel_map(
+            self.pci_utils.get_pf_vfs_macs_ib, missing, len(missing))
+        read_macs = {}
+        macs_map = {}
+        with self._lock:
+            for pf_fabric_details, version, macs in zip(missing, versions,
+                                                        pfs_macs):
+                key = self._get_key(pf_fabric_details)
+                read_macs[key] = macs
+                if self._get_version(key) == version:
+                    self._macs[key] = macs
+            for pf_fabric_details in fabric_details.values():
+                key = self._get_key(pf_fabric_details)
+                macs_map.update(self._macs.get(key, read_macs.get(key, {})))
+        return macs_map
+
+    def _get_version(self, key):
+        return self._refreshes, self._writes[key]
+
+    def set_vf_guid(self, pf_fabric_details, vf_index, guid):
+        """Record a GUID written to a VF."""
+        mac = self.pci_utils.get_mac_from_guid(
+            guid, pf_fabric_details['pf_device_type'])
+        key = self._get_key(pf_fabric_details)
+        with self._lock:
+            self._writes[key] += 1
+            macs = self._macs.get(key)
+            # A PF not read yet gets the GUID when it is read
+            if macs is not None:
+                macs[str(vf_index)] = mac
+
+    def refresh(self):
+        """Read the GUIDs of every PF from sysfs again when next needed."""
+        with self._lock:
+            self._refreshes += 1
+            self._macs.clear()
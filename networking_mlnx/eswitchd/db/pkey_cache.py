@@ -0,0 +1,85 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+
+from networking_mlnx._i18n import _LW
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.utils import helper_utils
+
+LOG = logging.getLogger(__name__)
+
+# The MSB of a pkey is the membership bit (0 - partial, 1 - full), the
+# other 15 bits are the pkey number
+PKEY_MASK = 0x7fff
+
+
+class PkeyCache(object):
+    """Pkey tables of the IB device ports, by pkey number.
+
+    A port table maps each pkey number to the lowest pkey index holding
+    it. It is loaded in one pass over the port pkeys directory and reloaded
+    once DAEMON.pkey_cache_ttl seconds old, when a lookup misses or when
+    refreshed explicitly. A TTL of 0 reloads it on every lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (pf_mlx_dev, hca_port) to (load time, {pkey number: index})
+        self._tables = {}
+
+    def get_pkey_idx(self, pkey, pf_mlx_dev, hca_port):
+        """Return the index of pkey in the port pkey table, or None."""
+        pkey = int(pkey) & PKEY_MASK
+        key = (pf_mlx_dev, hca_port)
+        with self._lock:
+            loaded_at, table = self._tables.get(key, (None, None))
+            ttl = cfg.CONF.DAEMON.pkey_cache_ttl
+            if (table is None or pkey not in table or
+                    time.time() - loaded_at >= ttl):
+                table = self._load(pf_mlx_dev, hca_port)
+                self._tables[key] = (time.time(), table)
+            return table.get(pkey)
+
+    def refresh(self, pf_mlx_dev=None, hca_port=None):
+        """Drop the cached tables of a port, or all of them."""
+        with self._lock:
+            if pf_mlx_dev is None:
+                self._tables.clear()
+            else:
+                self._tables.pop((pf_mlx_dev, hca_port), None)
+
+    def _load(self, pf_mlx_dev, hca_port):
+        table = {}
+        path = helper_utils.sysfs_path(
+            constants.MLNX4_PKEYS_PATH % (pf_mlx_dev, hca_port))
+        try:
+            indexes = sorted(os.listdir(path), key=int)
+        except (OSError, ValueError):
+            LOG.warning(_LW("Failed to list pkeys of %s"), path)
+            return table
+        for idx in indexes:
+            try:
+                with open(os.path.join(path, idx)) as fd:
+                    pkey = int(fd.readline(), 16) & PKEY_MASK
+            except (IOError, ValueError):
+                continue
+            table.setdefault(pkey, idx)
+        return table
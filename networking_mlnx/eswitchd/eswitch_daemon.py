@@ -15,12 +15,16 @@
 # limitations under the License.
 
 import sys
-import zmq
+import threading
+import time
 
 from networking_mlnx._i18n import _, _LE, _LI
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import encodeutils
+from six.moves import queue
+import zmq
 
 from networking_mlnx.eswitchd.common import config
 from networking_mlnx.eswitchd.common import constants
@@ -33,11 +37,22 @@ LOG = logging.getLogger(__name__)
 
 class MlxEswitchDaemon(object):
     def __init__(self):
-        self.max_polling_count = cfg.CONF.DAEMON.max_polling_count
         self.default_timeout = cfg.CONF.DAEMON.default_timeout
-        fabrics = self._parse_physical_mapping()
-        self.eswitch_handler = eSwitchHandler(fabrics)
-        self.dispatcher = message.MessageDispatch(self.eswitch_handler)
+        self.workers = cfg.CONF.DAEMON.workers
+        if cfg.CONF.DAEMON.domain_events:
+            self.full_sync_interval = cfg.CONF.DAEMON.full_sync_interval
+        else:
+            # Without domain events the devices are tracked by polling
+            self.full_sync_interval = (cfg.CONF.DAEMON.max_polling_count *
+                                       self.default_timeout / 1000.0)
+        self.requests = queue.Queue()
+        self.fabrics = self._parse_physical_mapping()
+        # The fabrics are added, and the devices synced, once the domain
+        # events are registered
+        self.eswitch_handler = eSwitchHandler()
+        self.last_full_sync = None
+        self.dispatcher = message.MessageDispatch(
+            self.eswitch_handler, cfg.CONF.DAEMON.batch_workers)
 
     def start(self):
         self._init_connections()
@@ -62,22 +77,125 @@ class MlxEswitchDaemon(object):
         return fabrics
 
     def _init_connections(self):
-        context = zmq.Context()
-        self.socket_os = context.socket(zmq.REP)
+        self.context = zmq.Context()
+        self.socket_os = self.context.socket(zmq.ROUTER)
         os_transport = constants.SOCKET_OS_TRANSPORT
         os_port = constants.SOCKET_OS_PORT
         os_addr = constants.SOCKET_OS_ADDR
         self.conn_os_url = set_conn_url(os_transport, os_addr, os_port)
 
         self.socket_os.bind(self.conn_os_url)
+        # Workers can't share the ROUTER socket, their replies are pushed
+        # back to the daemon loop which is the only one sending on it.
+        self.socket_replies = self.context.socket(zmq.PULL)
+        self.socket_replies.bind(constants.SOCKET_REPLIES_URL)
+        # Attached vNIC changes are published for event driven agents
+        self.socket_events = self.context.socket(zmq.PUB)
+        self.socket_events.bind(set_conn_url(
+            os_transport, os_addr, constants.SOCKET_EVENTS_PORT))
+        self.events_lock = threading.Lock()
+        self.eswitch_handler.set_vnic_listener(self._publish_event)
+        # Changed domains are pushed from the libvirt event thread, they
+        # are synced by the sync thread, off the requests and replies path
+        self.socket_domains = self.context.socket(zmq.PULL)
+        self.socket_domains.bind(constants.SOCKET_DOMAINS_URL)
+        self.domain_senders = threading.local()
+
         self.poller = zmq.Poller()
         self.poller.register(self.socket_os, zmq.POLLIN)
+        self.poller.register(self.socket_replies, zmq.POLLIN)
+        if cfg.CONF.DAEMON.domain_events:
+            # Domains changed during the startup sync are queued and
+            # synced again by the sync thread
+            self.eswitch_handler.start_domain_events(self._domain_changed)
+        self.eswitch_handler.add_fabrics(self.fabrics)
+        self.last_full_sync = time.time()
+        self._start_workers()
+        self._start_sync()
 
-    def _handle_msg(self):
-        data = None
+    def _start_workers(self):
+        for i in range(self.workers):
+            worker = threading.Thread(name='worker-%d' % i,
+                                      target=self._worker_loop)
+            worker.daemon = True
+            worker.start()
+
+    def _start_sync(self):
+        sync = threading.Thread(name='sync', target=self._sync_loop)
+        sync.daemon = True
+        sync.start()
+
+    def _sync_loop(self):
+        """Sync the changed domains and periodically all the devices."""
+        while True:
+            timeout = None
+            if self.full_sync_interval:
+                timeout = max(0, self.last_full_sync +
+                              self.full_sync_interval - time.time()) * 1000
+            if self.socket_domains.poll(timeout):
+                self._sync_domains()
+            if (self.full_sync_interval and time.time() -
+                    self.last_full_sync >= self.full_sync_interval):
+                self._full_sync()
 
-        msg = self.socket_os.recv()
-        sender = self.socket_os
+    def _worker_loop(self):
+        sender = self.context.socket(zmq.PUSH)
+        sender.connect(constants.SOCKET_REPLIES_URL)
+        while True:
+            envelope, msg = self.requests.get()
+            try:
+                reply = self._handle_msg(msg)
+            except Exception:
+                # Protect the worker, the request is dropped and the
+                # client will time out
+                LOG.exception(_LE("Failed to handle message %s"), msg)
+                continue
+            if reply is not None:
+                sender.send_multipart(envelope + [reply])
+
+    def _publish_event(self, event):
+        msg = encodeutils.safe_encode(jsonutils.dumps(event))
+        with self.events_lock:
+            self.socket_events.send(msg)
+
+    def _domain_changed(self, vm_id):
+        sender = getattr(self.domain_senders, 'socket', None)
+        if sender is None:
+            sender = self.context.socket(zmq.PUSH)
+            sender.connect(constants.SOCKET_DOMAINS_URL)
+            self.domain_senders.socket = sender
+        sender.send(encodeutils.safe_encode(vm_id or ''))
+
+    def _sync_domains(self):
+        vm_ids = set()
+        while True:
+            try:
+                vm_ids.add(encodeutils.safe_decode(
+                    self.socket_domains.recv(zmq.NOBLOCK)))
+            except zmq.Again:
+                break
+        if '' in vm_ids:
+            self._full_sync()
+            return
+        for vm_id in vm_ids:
+            try:
+                self.eswitch_handler.sync_domain(vm_id)
+            except Exception:
+                LOG.exception(_LE("Failed to sync domain %s, resyncing "
+                                  "all domains"), vm_id)
+                self._full_sync()
+                return
+
+    def _full_sync(self):
+        LOG.debug("Resync devices")
+        self.last_full_sync = time.time()
+        try:
+            self.eswitch_handler.sync_devices()
+        except Exception:
+            LOG.exception(_LE("Failed to resync devices"))
+
+    def _handle_msg(self, msg):
+        data = None
         if msg:
             data = jsonutils.loads(msg)
 
@@ -89,19 +207,35 @@ class MlxEswitchDaemon(object):
             except Exception as e:
                 LOG.exception(_LE("Exception during message handling - %s"), e)
                 msg = str(e)
-            sender.send(msg)
+            msg = encodeutils.safe_encode(msg)
+        return msg
+
+    def _receive_requests(self):
+        while True:
+            try:
+                frames = self.socket_os.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            # Everything up to the payload is the routing envelope, it is
+            # sent back untouched with the reply
+            self.requests.put((frames[:-1], frames[-1]))
+
+    def _send_replies(self):
+        while True:
+            try:
+                frames = self.socket_replies.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            self.socket_os.send_multipart(frames)
 
     def daemon_loop(self):
         LOG.info(_LI("Daemon Started!"))
-        polling_counter = 0
         while True:
-            self._handle_msg()
-            if polling_counter == self.max_polling_count:
-                LOG.debug("Resync devices")
-            # self.eswitch_handler.sync_devices()
-                polling_counter = 0
-            else:
-                polling_counter += 1
+            socks = dict(self.poller.poll(self.default_timeout))
+            if socks.get(self.socket_os) == zmq.POLLIN:
+                self._receive_requests()
+            if socks.get(self.socket_replies) == zmq.POLLIN:
+                self._send_replies()
 
 
 def main():
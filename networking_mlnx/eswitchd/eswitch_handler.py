@@ -13,17 +13,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import glob
+import errno
 import sys
 
 from networking_mlnx._i18n import _LE, _LI, _LW
+from oslo_concurrency import lockutils
 from oslo_log import log as logging
+from oslo_utils import uuidutils
 
+from networking_mlnx.common import ib_address
 from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.common import exceptions
 from networking_mlnx.eswitchd.db import eswitch_db
+from networking_mlnx.eswitchd.db import pkey_cache
 from networking_mlnx.eswitchd.resource_mngr import ResourceManager
 from networking_mlnx.eswitchd.utils import command_utils
+from networking_mlnx.eswitchd.utils import helper_utils
 from networking_mlnx.eswitchd.utils import pci_utils
+from networking_mlnx.eswitchd.utils import rebind_queue
+from networking_mlnx.eswitchd.utils import sysfs_writer
 
 
 LOG = logging.getLogger(__name__)
@@ -31,7 +39,6 @@ LOG = logging.getLogger(__name__)
 INVALID_PKEY = 'none'
 DEFAULT_PKEY_IDX = '0'
 PARTIAL_PKEY_IDX = '1'
-DEFAULT_MASK = 0x7fff
 DEFAULT_PKEY = '0xffff'
 
 
@@ -39,9 +46,23 @@ class eSwitchHandler(object):
 
     def __init__(self, fabrics=None):
         self.eswitches = {}
+        # Identifies this daemon run, generations restart with the daemon
+        self.epoch = uuidutils.generate_uuid()
+        self.generations = eswitch_db.GenerationCounter()
+        self.vnic_listener = None
+        # Attached vNIC MAC to the eswitch table it is attached on
+        self.vnic_eswitches = {}
         self.pci_utils = pci_utils.pciUtils()
+        self.sysfs_writer = sysfs_writer.SysfsWriter()
+        # The rebind workers have their own writers, a slow rebind does
+        # not delay the writes of port requests
+        self.rebind_writers = sysfs_writer.SysfsWriterPool()
+        self.rebind_queue = rebind_queue.RebindQueue(self._rebind_vf)
+        self.pkey_cache = pkey_cache.PkeyCache()
         self.rm = ResourceManager()
         self.devices = set()
+        # Domain UUID to the attached devices of the domain
+        self.domain_devices = {}
         if fabrics:
             self.add_fabrics(fabrics)
 
@@ -57,12 +78,18 @@ class eSwitchHandler(object):
                           "enabled. Terminating!") % pf)
                 sys.exit(1)
 
+        # Probe the VFs of all the PFs in parallel, once per PF
+        pfs = [pf for fabric, pf in fabrics]
+        pfs_vfs = helper_utils.parallel_map(self.pci_utils.get_vfs_info,
+                                            pfs, len(pfs))
+        for (fabric, pf), vfs in zip(fabrics, pfs_vfs):
             if self.eswitches.get(fabric) is None:
                 self.eswitches[fabric] = []
-            vfs = self.pci_utils.get_vfs_info(pf)
             self.eswitches[fabric].append(
-                eswitch_db.eSwitchDB(pf=pf, vfs=vfs))
-            self._add_fabric(fabric, pf)
+                eswitch_db.eSwitchDB(pf=pf, vfs=vfs,
+                                     generations=self.generations,
+                                     listener=self._vnic_changed))
+            self._add_fabric(fabric, pf, vfs)
 
         self.sync_devices()
 
@@ -75,9 +102,32 @@ class eSwitchHandler(object):
         self._treat_added_devices(added_devs, vm_ids)
         self._treat_removed_devices(removed_devs)
         self.devices = set(devices)
+        self.domain_devices = {}
+        for device in devices:
+            self.domain_devices.setdefault(
+                vm_ids[device[0]], set()).add(device)
+
+    def start_domain_events(self, listener):
+        """Call listener with the UUID of domains changed in libvirt."""
+        self.rm.start_domain_events(listener)
+
+    def sync_domain(self, vm_id):
+        """Apply the attached devices changes of a single domain."""
+        devices = set(self.rm.scan_domain(vm_id))
+        domain_devices = self.domain_devices.get(vm_id, set())
+        added_devs = devices - domain_devices
+        removed_devs = domain_devices - devices
+        self._treat_added_devices(
+            added_devs, dict((device[0], vm_id) for device in added_devs))
+        self._treat_removed_devices(removed_devs)
+        self.devices = (self.devices - removed_devs) | added_devs
+        if devices:
+            self.domain_devices[vm_id] = devices
+        else:
+            self.domain_devices.pop(vm_id, None)
 
-    def _add_fabric(self, fabric, pf):
-        self.rm.add_fabric(fabric, pf)
+    def _add_fabric(self, fabric, pf, vfs=None):
+        self.rm.add_fabric(fabric, pf, vfs)
         self._config_port_up(pf)
         pf_fabric_details = self.rm.get_fabric_details(fabric, pf)
         eswitches = self._get_eswitches_for_fabric(fabric)
@@ -93,22 +143,23 @@ class eSwitchHandler(object):
         for device in devices:
             dev, mac, fabric = device
             if fabric:
-                for eswitch in self.eswitches[fabric]:
-                    if dev in eswitch.vfs:
+                eswitch = self._get_eswitch_for_fabric_and_pci(fabric, dev)
+                if eswitch:
+                    with lockutils.lock(constants.LOCK_PREFIX + dev):
                         eswitch.attach_vnic(
                             port_name=dev, device_id=vm_ids[dev], vnic_mac=mac)
                         if eswitch.vnic_exists(mac):
                             eswitch.plug_nic(port_name=dev)
-                        break
             else:
                 LOG.info(_LI("No Fabric defined for device %s"), dev)
 
     def _treat_removed_devices(self, devices):
-        for dev, mac in devices:
+        for dev, mac, fabric in devices:
             fabric = self.rm.get_fabric_for_dev(dev)
             if fabric:
-                for eswitch in self.eswitches[fabric]:
-                    if dev in eswitch.vfs:
+                eswitch = self._get_eswitch_for_fabric_and_pci(fabric, dev)
+                if eswitch:
+                    with lockutils.lock(constants.LOCK_PREFIX + dev):
                         eswitch.detach_vnic(vnic_mac=mac)
             else:
                 LOG.info(_LI("No Fabric defined for device %s"), dev)
@@ -127,16 +178,83 @@ class eSwitchHandler(object):
         LOG.info(_LI("vnics are %s"), vnics)
         return vnics
 
+    def set_vnic_listener(self, listener):
+        """Set the callable notified with attached vNIC change events."""
+        self.vnic_listener = listener
+
+    def _vnic_changed(self, eswitch, vnic_mac, dev, generation):
+        if eswitch.is_vnic_attached(vnic_mac):
+            self.vnic_eswitches[vnic_mac] = eswitch
+        elif self.vnic_eswitches.get(vnic_mac) is eswitch:
+            self.vnic_eswitches.pop(vnic_mac, None)
+        if self.vnic_listener is None:
+            return
+        event = {'event': constants.VNIC_CHANGED_EVENT,
+                 'epoch': self.epoch,
+                 'generation': generation,
+                 'pf': eswitch.pf,
+                 'dev': dev,
+                 'mac': vnic_mac,
+                 'state': eswitch.get_port_state(dev)}
+        try:
+            self.vnic_listener(event)
+        except Exception:
+            LOG.exception(_LE("Failed to notify vNIC change %s"), event)
+
+    def get_vnics_delta(self, fabrics, since_generation, epoch=None):
+        """Return the attached vNICs changes after since_generation.
+
+        'added' holds the attached vNICs which changed, 'removed' the MACs
+        which are no longer attached. When the changes can't be computed
+        (first request, daemon restart or too old generation) 'full' is set
+        and 'added' holds all the attached vNICs.
+        """
+        eswitches = []
+        for fabric in fabrics:
+            eswitches.extend(self._get_eswitches_for_fabric(fabric) or [])
+
+        changed = set()
+        with self.generations.lock:
+            generation = self.generations.value
+            full = (epoch != self.epoch or since_generation > generation)
+            for eswitch in eswitches:
+                if full:
+                    break
+                vnic_changes = eswitch.get_vnic_changes(since_generation)
+                if vnic_changes is None:
+                    full = True
+                else:
+                    changed |= vnic_changes
+
+        delta = {'epoch': self.epoch, 'generation': generation,
+                 'full': full, 'added': {}, 'removed': []}
+        if full:
+            delta['added'] = self.get_vnics(fabrics)
+            return delta
+        for vnic_mac in changed:
+            eswitch = self.vnic_eswitches.get(vnic_mac)
+            vnic = None
+            if eswitch in eswitches:
+                vnic = eswitch.get_attached_vnic(vnic_mac)
+            if vnic:
+                delta['added'][vnic_mac] = vnic
+            else:
+                delta['removed'].append(vnic_mac)
+        return delta
+
+    def get_dev_for_vnic(self, fabric, vnic_mac):
+        eswitches = self._get_eswitches_for_fabric(fabric) or []
+        for eswitch in eswitches:
+            dev = eswitch.get_dev_for_vnic(vnic_mac)
+            if dev:
+                return dev
+
     def plug_nic(self, fabric, device_id, vnic_mac, pci_slot):
         eswitch = self._get_eswitch_for_fabric_and_pci(fabric, pci_slot)
         if eswitch:
-            eswitch.port_table[pci_slot]['vnic'] = vnic_mac
-            eswitch.port_policy.update(
-                {vnic_mac:
-                    {'vlan': None,
-                     'dev': pci_slot,
-                     'device_id': device_id}})
-
+            eswitch.set_vnic(pci_slot, device_id, vnic_mac)
+            # The VF must not be rebound once its GUID is set
+            self.rebind_queue.wait(pci_slot)
             self._config_vf_mac_address(fabric, pci_slot, vnic_mac)
             eswitch.plug_nic(pci_slot)
         else:
@@ -146,13 +264,11 @@ class eSwitchHandler(object):
 
     def delete_port(self, fabric, vnic_mac):
         dev = None
-        eswitches = self._get_eswitches_for_fabric(fabric)
-        for eswitch in eswitches:
-            if eswitch and vnic_mac in eswitch.get_attached_vnics():
-                dev = eswitch.detach_vnic(vnic_mac)
-                if dev:
-                    self._config_vf_mac_address(fabric, dev)
-                    break
+        eswitch = self._get_eswitch_for_vnic(fabric, vnic_mac)
+        if eswitch:
+            dev = eswitch.detach_vnic(vnic_mac)
+            if dev:
+                self._config_vf_mac_address(fabric, dev)
 
         if dev is None:
             LOG.warning(_LW("No eSwitch found for Fabric %s"), fabric)
@@ -161,11 +277,9 @@ class eSwitchHandler(object):
     def port_release(self, fabric, vnic_mac):
         ret = None
         dev = None
-        eswitches = self._get_eswitches_for_fabric(fabric)
-        for eswitch in eswitches:
-            if eswitch and vnic_mac in eswitch.get_attached_vnics():
-                dev = eswitch.get_dev_for_vnic(vnic_mac)
-                break
+        eswitch = self._get_eswitch_for_vnic(fabric, vnic_mac)
+        if eswitch:
+            dev = eswitch.get_dev_for_vnic(vnic_mac)
         if dev:
             if (eswitch.get_port_state(dev) ==
                     constants.VPORT_STATE_UNPLUGGED):
@@ -177,46 +291,63 @@ class eSwitchHandler(object):
 
     def port_up(self, fabric, vnic_mac):
         dev = None
-        eswitches = self._get_eswitches_for_fabric(fabric)
-        for eswitch in eswitches:
-            if eswitch and vnic_mac in eswitch.get_attached_vnics():
-                dev = eswitch.get_dev_for_vnic(vnic_mac)
-                break
+        eswitch = self._get_eswitch_for_vnic(fabric, vnic_mac)
+        if eswitch:
+            dev = eswitch.get_dev_for_vnic(vnic_mac)
         if not dev:
             LOG.info(_LI("No device for MAC %s"), vnic_mac)
 
     def port_down(self, fabric, vnic_mac):
         dev = None
-        eswitches = self._get_eswitches_for_fabric(fabric)
-        for eswitch in eswitches:
-            if eswitch and vnic_mac in eswitch.get_attached_vnics():
-                dev = eswitch.get_dev_for_vnic(vnic_mac)
-                if dev:
-                    LOG.info(_LI("IB port for MAC %s doen't support "
-                             "port down"), vnic_mac)
-                break
+        eswitch = self._get_eswitch_for_vnic(fabric, vnic_mac)
+        if eswitch:
+            dev = eswitch.get_dev_for_vnic(vnic_mac)
+            if dev:
+                LOG.info(_LI("IB port for MAC %s doen't support "
+                         "port down"), vnic_mac)
         if dev is None:
             LOG.info(_LI("No device for MAC %s"), vnic_mac)
 
     def set_vlan(self, fabric, vnic_mac, vlan):
-        eswitches = self._get_eswitches_for_fabric(fabric)
-        for eswitch in eswitches:
-            if eswitch and vnic_mac in eswitch.get_attached_vnics():
-                eswitch.set_vlan(vnic_mac, vlan)
-                dev = eswitch.get_dev_for_vnic(vnic_mac)
-                state = eswitch.get_port_state(dev)
-                if dev:
-                    if state in (constants.VPORT_STATE_ATTACHED,
-                                 constants.VPORT_STATE_UNPLUGGED):
-                        if eswitch.get_port_table()[dev]['alias']:
-                            dev = eswitch.get_port_table()[dev]['alias']
-                        try:
-                            self._config_vlan_ib(fabric, dev, vlan)
-                            return True
-                        except RuntimeError:
-                            LOG.error(_LE('Set VLAN operation failed'))
+        eswitch = self._get_eswitch_for_vnic(fabric, vnic_mac)
+        if eswitch:
+            eswitch.set_vlan(vnic_mac, vlan)
+            dev = eswitch.get_dev_for_vnic(vnic_mac)
+            state = eswitch.get_port_state(dev)
+            if dev:
+                if state in (constants.VPORT_STATE_ATTACHED,
+                             constants.VPORT_STATE_UNPLUGGED):
+                    alias = eswitch.get_port_table()[dev].alias
+                    if alias:
+                        dev = alias
+                    try:
+                        self._config_vlan_ib(fabric, dev, vlan)
+                        return True
+                    except RuntimeError:
+                        LOG.error(_LE('Set VLAN operation failed'))
         return False
 
+    def refresh_pkeys(self, fabrics):
+        for fabric in fabrics:
+            if fabric not in self.eswitches:
+                LOG.error(_LE("No eSwitch found for Fabric %s"), fabric)
+                continue
+            fabric_details = self.rm.get_fabric_details(fabric)
+            for pf_fabric_details in fabric_details.values():
+                self.pkey_cache.refresh(pf_fabric_details['pf_mlx_dev'],
+                                        pf_fabric_details['hca_port'])
+
+    def get_sysfs_stats(self):
+        stats = self.sysfs_writer.get_stats()
+        for name, count in self.rebind_writers.get_stats().items():
+            stats[name] += count
+        for name, count in self.rebind_queue.get_stats().items():
+            stats['rebinds_' + name] = count
+        return stats
+
+    def get_vf_rebinds(self):
+        return self.rebind_queue.get_states()
+
     def get_eswitch_tables(self, fabrics):
         tables = {}
         for fabric in fabrics:
@@ -237,6 +368,11 @@ class eSwitchHandler(object):
         else:
             return
 
+    def _get_eswitch_for_vnic(self, fabric, vnic_mac):
+        eswitch = self.vnic_eswitches.get(vnic_mac)
+        if eswitch and eswitch in self.eswitches.get(fabric, ()):
+            return eswitch
+
     def _get_eswitch_for_fabric_and_pci(self, fabric, pci_slot):
         eswitches = self._get_eswitches_for_fabric(fabric)
         for eswitch in eswitches:
@@ -245,13 +381,18 @@ class eSwitchHandler(object):
 
     def _config_vf_pkey(self, ppkey_idx, pkey_idx,
                         pf_mlx_dev, vf_pci_id, hca_port):
+        self.sysfs_writer.write_sys([self._get_vf_pkey_write(
+            ppkey_idx, pkey_idx, pf_mlx_dev, vf_pci_id, hca_port)])
+
+    def _get_vf_pkey_write(self, ppkey_idx, pkey_idx,
+                           pf_mlx_dev, vf_pci_id, hca_port):
         path = constants.MLNX4_PKEY_INDEX_PATH % (pf_mlx_dev, vf_pci_id,
                                                   hca_port, pkey_idx)
-        cmd = ['ebrctl', 'write-sys', path, ppkey_idx]
-        command_utils.execute(*cmd)
+        return (path, ppkey_idx)
 
     def _get_guid_idx(self, pf_mlx_dev, dev, hca_port):
-        path = constants.MLNX4_GUID_INDEX_PATH % (pf_mlx_dev, dev, hca_port)
+        path = helper_utils.sysfs_path(
+            constants.MLNX4_GUID_INDEX_PATH % (pf_mlx_dev, dev, hca_port))
         with open(path) as fd:
             idx = fd.readline().strip()
         return idx
@@ -262,22 +403,17 @@ class eSwitchHandler(object):
             if mac is None:
                 guid = constants.MLNX4_INVALID_GUID
             else:
-                mac = mac.replace(':', '')
-                prefix = mac[:6]
-                suffix = mac[6:]
-                guid = prefix + '0000' + suffix
+                guid = ib_address.mac_to_mlnx4_guid(mac)
         elif (device_type == constants.MLNX5_VF_DEVICE_TYPE):
             if mac is None:
                 guid = constants.MLNX5_INVALID_GUID
             else:
-                prefix = mac[:9]
-                suffix = mac[9:]
-                guid = prefix + '00:00:' + suffix
+                guid = ib_address.mac_to_mlnx5_guid(mac)
         return guid
 
     def _config_vf_mac_address(self, fabric, dev, vnic_mac=None):
         pf_fabric_details = self._get_pf_fabric(fabric, dev)
-        vf_device_type = pf_fabric_details['vfs'][dev]['vf_device_type']
+        vf_device_type = pf_fabric_details['vfs'][dev].vf_device_type
         vguid = self._get_guid_from_mac(vnic_mac, vf_device_type)
         if vf_device_type == constants.MLNX4_VF_DEVICE_TYPE:
             self._config_vf_mac_address_mlnx4(vguid, dev, pf_fabric_details)
@@ -290,25 +426,26 @@ class eSwitchHandler(object):
     def _config_vf_mac_address_mlnx4(self, vguid, dev, pf_fabric_details):
         hca_port = pf_fabric_details['hca_port']
         pf_mlx_dev = pf_fabric_details['pf_mlx_dev']
-        self._config_vf_pkey(
-            INVALID_PKEY, DEFAULT_PKEY_IDX, pf_mlx_dev, dev, hca_port)
+        writes = [self._get_vf_pkey_write(
+            INVALID_PKEY, DEFAULT_PKEY_IDX, pf_mlx_dev, dev, hca_port)]
 
         guid_idx = self._get_guid_idx(pf_mlx_dev, dev, hca_port)
         path = constants.MLNX4_ADMIN_GUID_PATH % (
             pf_mlx_dev, hca_port, guid_idx)
-        cmd = ['ebrctl', 'write-sys', path, vguid]
-        command_utils.execute(*cmd)
+        writes.append((path, vguid))
         ppkey_idx = self._get_pkey_idx(
             int(DEFAULT_PKEY, 16), pf_mlx_dev, hca_port)
-        if ppkey_idx >= 0:
-            self._config_vf_pkey(
-                ppkey_idx, PARTIAL_PKEY_IDX, pf_mlx_dev, dev, hca_port)
+        if ppkey_idx is not None:
+            writes.append(self._get_vf_pkey_write(
+                ppkey_idx, PARTIAL_PKEY_IDX, pf_mlx_dev, dev, hca_port))
         else:
             LOG.error(_LE("Can't find partial management pkey for"
                           "%(pf)s:%(dev)s"), {'pf': pf_mlx_dev, 'dev': dev})
+        self.sysfs_writer.write_sys(writes)
+        self.rm.set_vf_guid(pf_fabric_details, int(guid_idx), vguid)
 
     def _config_vf_mac_address_mlnx5(self, vguid, dev, pf_fabric_details):
-        vf_num = pf_fabric_details['vfs'][dev]['vf_num']
+        vf_num = pf_fabric_details['vfs'][dev].vf_num
         pf_mlx_dev = pf_fabric_details['pf_mlx_dev']
         guid_node = constants.MLNX5_GUID_NODE_PATH % {'module': pf_mlx_dev,
                                                       'vf_num': vf_num}
@@ -316,26 +453,28 @@ class eSwitchHandler(object):
                                                       'vf_num': vf_num}
         guid_poliy = constants.MLNX5_GUID_POLICY_PATH % {'module': pf_mlx_dev,
                                                          'vf_num': vf_num}
-        for path in (guid_node, guid_port):
-            cmd = ['ebrctl', 'write-sys', path, vguid]
-            command_utils.execute(*cmd)
+        writes = [(guid_node, vguid), (guid_port, vguid)]
 
         if vguid == constants.MLNX5_INVALID_GUID:
-            cmd = ['ebrctl', 'write-sys', guid_poliy, 'Down\n']
-            command_utils.execute(*cmd)
-            cmd = ['ebrctl', 'write-sys', constants.UNBIND_PATH, dev]
-            command_utils.execute(*cmd)
-            cmd = ['ebrctl', 'write-sys', constants.BIND_PATH, dev]
-            command_utils.execute(*cmd)
+            writes.append((guid_poliy, 'Down\n'))
+            # The rebind runs in the background, it is skipped when the VF
+            # is already detached
+            if self.sysfs_writer.write_sys(writes):
+                self.rebind_queue.schedule(dev)
         else:
-            cmd = ['ebrctl', 'write-sys', guid_poliy, 'Up\n']
-            command_utils.execute(*cmd)
+            writes.append((guid_poliy, 'Up\n'))
+            self.sysfs_writer.write_sys(writes)
+        self.rm.set_vf_guid(pf_fabric_details, vf_num, vguid)
+
+    def _rebind_vf(self, dev):
+        self.rebind_writers.get().write_sys(
+            [], [(constants.UNBIND_PATH, dev), (constants.BIND_PATH, dev)])
 
     def _config_vlan_ib(self, fabric, dev, vlan):
         pf_fabric_details = self._get_pf_fabric(fabric, dev)
         hca_port = pf_fabric_details['hca_port']
         pf_mlx_dev = pf_fabric_details['pf_mlx_dev']
-        vf_device_type = pf_fabric_details['vfs'][dev]['vf_device_type']
+        vf_device_type = pf_fabric_details['vfs'][dev].vf_device_type
         if vf_device_type == constants.MLNX4_VF_DEVICE_TYPE:
             self._config_vlan_ib_mlnx4(vlan, pf_mlx_dev, dev, hca_port)
         elif vf_device_type == constants.MLNX5_VF_DEVICE_TYPE:
@@ -348,7 +487,7 @@ class eSwitchHandler(object):
         if vlan == 0:
             ppkey_idx = self._get_pkey_idx(
                 int(DEFAULT_PKEY, 16), pf_mlx_dev, hca_port)
-            if ppkey_idx >= 0:
+            if ppkey_idx is not None:
                 self._config_vf_pkey(
                     ppkey_idx, DEFAULT_PKEY_IDX, pf_mlx_dev, dev, hca_port)
         else:
@@ -358,27 +497,18 @@ class eSwitchHandler(object):
                     ppkey_idx, DEFAULT_PKEY_IDX, pf_mlx_dev, dev, hca_port)
 
     def _get_pkey_idx(self, vlan, pf_mlx_dev, hca_port):
-        PKEYS_PATH = "/sys/class/infiniband/%s/ports/%s/pkeys/*"
-        paths = PKEYS_PATH % (pf_mlx_dev, hca_port)
-        for path in glob.glob(paths):
-            fd = open(path)
-            pkey = fd.readline()
-            fd.close()
-            # the MSB in pkey is the membership bit ( 0 - partial, 1 - full)
-            # the other 15 bit are the number of the pkey
-            # so we want to remove the 16th bit when compare pkey file
-            # to the vlan (pkey) we are looking for
-            is_match = int(pkey, 16) & DEFAULT_MASK == int(vlan) & DEFAULT_MASK
-            if is_match:
-                return path.split('/')[-1]
-        return None
+        return self.pkey_cache.get_pkey_idx(vlan, pf_mlx_dev, hca_port)
 
     def _config_port_up(self, dev):
-        cmd = ['ip', 'link', 'set', dev, 'up']
-        command_utils.execute(*cmd)
+        try:
+            self.pci_utils.netlink.set_link_up(dev)
+        except exceptions.NetlinkError as e:
+            if e.errno != errno.EPERM:
+                raise
+            # Changing a link needs CAP_NET_ADMIN, the daemon may lack it
+            command_utils.execute('ip', 'link', 'set', dev, 'up')
 
     def _get_pf_fabric(self, fabric, dev):
-        fabric_details = self.rm.get_fabric_details(fabric)
-        for pf_fabric in fabric_details.values():
-            if dev in pf_fabric['vfs']:
-                return pf_fabric
+        dev_details = self.rm.get_dev_details(dev)
+        if dev_details and dev_details[0] == fabric:
+            return self.rm.get_fabric_details(fabric, dev_details[1])
@@ -14,9 +14,11 @@
 # limitations under the License.
 
 from networking_mlnx._i18n import _, _LE, _LI
+from oslo_concurrency import lockutils
 from oslo_log import log as logging
 
 from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.utils import helper_utils
 
 LOG = logging.getLogger(__name__)
 
@@ -45,6 +47,19 @@ class BasicMessageHandler(object):
             return True
         return False
 
+    def get_lock_name(self, eswitch_handler):
+        """Return the lock serializing this message, None for reads."""
+        return None
+
+    def get_dev_lock_name(self, dev):
+        return constants.LOCK_PREFIX + dev
+
+    def get_vnic_lock_name(self, eswitch_handler, fabric, vnic_mac):
+        dev = eswitch_handler.get_dev_for_vnic(fabric, vnic_mac)
+        if dev:
+            return self.get_dev_lock_name(dev)
+        return constants.LOCK_PREFIX + vnic_mac
+
     def build_response(self, status, reason=None, response=None):
         if status:
             msg = {'status': 'OK', 'response': response}
@@ -60,6 +75,9 @@ class PlugVnic(BasicMessageHandler):
     def __init__(self, msg):
         super(PlugVnic, self).__init__(msg)
 
+    def get_lock_name(self, eswitch_handler):
+        return self.get_dev_lock_name(self.msg['dev_name'])
+
     def execute(self, eswitch_handler):
         fabric = self.msg['fabric']
         device_id = self.msg['device_id']
@@ -79,6 +97,10 @@ class DetachVnic(BasicMessageHandler):
     def __init__(self, msg):
         super(DetachVnic, self).__init__(msg)
 
+    def get_lock_name(self, eswitch_handler):
+        return self.get_vnic_lock_name(eswitch_handler, self.msg['fabric'],
+                                       self.msg['vnic_mac'].lower())
+
     def execute(self, eswitch_handler):
         fabric = self.msg['fabric']
         vnic_mac = (self.msg['vnic_mac']).lower()
@@ -95,6 +117,10 @@ class SetVLAN(BasicMessageHandler):
     def __init__(self, msg):
         super(SetVLAN, self).__init__(msg)
 
+    def get_lock_name(self, eswitch_handler):
+        return self.get_vnic_lock_name(eswitch_handler, self.msg['fabric'],
+                                       self.msg['port_mac'].lower())
+
     def execute(self, eswitch_handler):
         fabric = self.msg['fabric']
         vnic_mac = (self.msg['port_mac']).lower()
@@ -125,12 +151,33 @@ class GetVnics(BasicMessageHandler):
         return self.build_response(True, response=vnics)
 
 
+class GetVnicsDelta(BasicMessageHandler):
+    MSG_ATTRS_MANDATORY_MAP = ('fabric', 'since_generation')
+
+    def __init__(self, msg):
+        super(GetVnicsDelta, self).__init__(msg)
+
+    def execute(self, eswitch_handler):
+        fabric = self.msg['fabric']
+        if fabric == '*':
+            fabrics = eswitch_handler.eswitches.keys()
+        else:
+            fabrics = [fabric]
+        delta = eswitch_handler.get_vnics_delta(
+            fabrics, self.msg['since_generation'], self.msg.get('epoch'))
+        return self.build_response(True, response=delta)
+
+
 class PortRelease(BasicMessageHandler):
     MSG_ATTRS_MANDATORY_MAP = ('fabric', 'ref_by', 'mac')
 
     def __init__(self, msg):
         super(PortRelease, self).__init__(msg)
 
+    def get_lock_name(self, eswitch_handler):
+        return self.get_vnic_lock_name(eswitch_handler, self.msg['fabric'],
+                                       self.msg['mac'].lower())
+
     def execute(self, eswitch_handler):
         ref_by_keys = ['mac_address']
         fabric = self.msg['fabric']
@@ -206,29 +253,73 @@ class GetEswitchTables(BasicMessageHandler):
         return self.build_response(True, response=response)
 
 
+class RefreshPkeys(BasicMessageHandler):
+    MSG_ATTRS_MANDATORY_MAP = ('fabric',)
+
+    def __init__(self, msg):
+        super(RefreshPkeys, self).__init__(msg)
+
+    def execute(self, eswitch_handler):
+        fabric = self.msg['fabric']
+        if fabric == '*':
+            fabrics = eswitch_handler.eswitches.keys()
+        else:
+            fabrics = [fabric]
+        eswitch_handler.refresh_pkeys(fabrics)
+        return self.build_response(True, response={})
+
+
+class GetSysfsStats(BasicMessageHandler):
+
+    def __init__(self, msg):
+        super(GetSysfsStats, self).__init__(msg)
+
+    def execute(self, eswitch_handler):
+        response = {'stats': eswitch_handler.get_sysfs_stats()}
+        return self.build_response(True, response=response)
+
+
+class GetVfRebinds(BasicMessageHandler):
+
+    def __init__(self, msg):
+        super(GetVfRebinds, self).__init__(msg)
+
+    def execute(self, eswitch_handler):
+        response = {'rebinds': eswitch_handler.get_vf_rebinds()}
+        return self.build_response(True, response=response)
+
+
 class MessageDispatch(object):
     MSG_MAP = {'delete_port': DetachVnic,
                'set_vlan': SetVLAN,
                'get_vnics': GetVnics,
+               'get_vnics_delta': GetVnicsDelta,
                'port_release': PortRelease,
                'port_up': PortUp,
                'port_down': PortDown,
                'define_fabric_mapping': SetFabricMapping,
                'plug_nic': PlugVnic,
-               'get_eswitch_tables': GetEswitchTables}
+               'get_eswitch_tables': GetEswitchTables,
+               'refresh_pkeys': RefreshPkeys,
+               'get_sysfs_stats': GetSysfsStats,
+               'get_vf_rebinds': GetVfRebinds}
 
-    def __init__(self, eswitch_handler):
+    def __init__(self, eswitch_handler, batch_workers=1):
         self.eswitch_handler = eswitch_handler
+        # Shared by all the batches, its threads are started once
+        self.batch_pool = helper_utils.WorkerPool(batch_workers, 'batch')
 
     def handle_msg(self, msg):
         LOG.info(_LI("Handling message - %s"), msg)
         result = {}
         action = msg.pop('action')
 
-        if action in MessageDispatch.MSG_MAP.keys():
+        if action == constants.BATCH_ACTION:
+            result = self.handle_batch(msg)
+        elif action in MessageDispatch.MSG_MAP.keys():
             msg_handler = MessageDispatch.MSG_MAP[action](msg)
             if msg_handler.validate():
-                result = msg_handler.execute(self.eswitch_handler)
+                result = self._execute(msg_handler)
             else:
                 LOG.error(_LE('Invalid message - cannot handle'))
                 result = {'status': 'FAIL', 'reason': 'validation failed'}
@@ -238,3 +329,98 @@ class MessageDispatch(object):
                       'reason': 'unknown action'}
         result['action'] = action
         return result
+
+    def _execute(self, msg_handler):
+        lock_name = msg_handler.get_lock_name(self.eswitch_handler)
+        while lock_name is not None:
+            with lockutils.lock(lock_name):
+                # The VF of a vNIC may have changed before the lock was
+                # taken, the lock of its current VF is taken instead
+                current_lock_name = msg_handler.get_lock_name(
+                    self.eswitch_handler)
+                if current_lock_name == lock_name:
+                    return msg_handler.execute(self.eswitch_handler)
+            LOG.debug("Lock of message changed from %(old)s to %(new)s",
+                      {'old': lock_name, 'new': current_lock_name})
+            lock_name = current_lock_name
+        return msg_handler.execute(self.eswitch_handler)
+
+    def handle_batch(self, msg):
+        """Handle a list of messages sent in a single request.
+
+        Messages touching the same VF or vNIC are handled in the order they
+        were sent, other messages are handled in parallel. The response
+        holds the result of every message in the order of the request.
+        """
+        messages = msg.get('messages')
+        if not isinstance(messages, list):
+            LOG.error(_LE('Invalid batch message - cannot handle'))
+            return {'status': 'FAIL', 'reason': 'validation failed'}
+
+        results = [None] * len(messages)
+
+        def handle_group(indexes):
+            for index in indexes:
+                results[index] = self._handle_batch_item(messages[index])
+
+        self.batch_pool.map(handle_group, self._get_batch_groups(messages))
+        return {'status': 'OK', 'response': {'results': results}}
+
+    def _handle_batch_item(self, msg):
+        if not isinstance(msg, dict) or 'action' not in msg:
+            return {'action': None, 'status': 'FAIL',
+                    'reason': 'validation failed'}
+        action = msg['action']
+        if action == constants.BATCH_ACTION:
+            return {'action': action, 'status': 'FAIL',
+                    'reason': 'nested batch is not supported'}
+        try:
+            return self.handle_msg(msg)
+        except Exception as e:
+            LOG.exception(_LE("Exception during message handling - %s"), e)
+            return {'action': action, 'status': 'FAIL', 'reason': str(e)}
+
+    def _get_batch_keys(self, msg):
+        msg_handler_cls = MessageDispatch.MSG_MAP.get(msg.get('action'))
+        if msg_handler_cls is None:
+            return set()
+        try:
+            lock_name = msg_handler_cls(msg).get_lock_name(
+                self.eswitch_handler)
+        except (AttributeError, KeyError):
+            return set()
+        if lock_name is None:
+            return set()
+        keys = set([lock_name])
+        for attr in ('vnic_mac', 'port_mac', 'mac'):
+            if msg.get(attr):
+                keys.add(constants.LOCK_PREFIX + msg[attr].lower())
+        return keys
+
+    def _get_batch_groups(self, messages):
+        """Split batch messages into groups of dependent messages.
+
+        Messages sharing a VF or a vNIC MAC end up in the same group, in
+        request order. Messages not changing anything get a group each.
+        """
+        groups = []
+        groups_by_key = {}
+        for index, msg in enumerate(messages):
+            keys = set()
+            if isinstance(msg, dict):
+                keys = self._get_batch_keys(msg)
+            group = {'indexes': [index], 'keys': set(keys)}
+            for key in keys:
+                other = groups_by_key.get(key)
+                if other is None or other is group:
+                    continue
+                group['indexes'] = sorted(group['indexes'] +
+                                          other['indexes'])
+                group['keys'] |= other['keys']
+                groups.remove(other)
+                for other_key in other['keys']:
+                    groups_by_key[other_key] = group
+            for key in group['keys']:
+                groups_by_key[key] = group
+            groups.append(group)
+        return [group['indexes'] for group in groups]
@@ -13,59 +13,223 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from lxml import etree
+import hashlib
+import threading
 
 import libvirt
 from networking_mlnx._i18n import _LE, _LI, _LW
+from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import encodeutils
 
 from networking_mlnx.eswitchd.common import constants
 from networking_mlnx.eswitchd.db import device_db
+from networking_mlnx.eswitchd.db import guid_cache
+from networking_mlnx.eswitchd.utils import domain_utils
+from networking_mlnx.eswitchd.utils import helper_utils
 from networking_mlnx.eswitchd.utils import pci_utils
 
 LOG = logging.getLogger(__name__)
 
+LIBVIRT_URI = 'qemu:///system'
+
 
 class ResourceManager(object):
 
     def __init__(self):
         self.pci_utils = pci_utils.pciUtils()
         self.device_db = device_db.DeviceDB()
+        self.guid_cache = guid_cache.GuidCache(self.pci_utils)
+        # Long-lived libvirt connection, reopened when it fails
+        self.conn = None
+        # Domain UUID to (cache key, hostdev PCI addresses), see
+        # _get_domain_hostdevs
+        self.domains_hostdevs = {}
+        # Called with a domain UUID when the domain changed, with None
+        # when the changes may have been missed
+        self.domain_listener = None
 
-    def add_fabric(self, fabric, pf):
+    def add_fabric(self, fabric, pf, vfs=None):
         hca_port, pf_mlx_dev = self._get_pf_details(pf)
         self.device_db.add_fabric(fabric, pf, hca_port, pf_mlx_dev)
-        vfs = self.discover_devices(pf)
+        if vfs is None:
+            vfs = self.discover_devices(pf)
         LOG.info(_LI("PF %(pf)s, vfs = %(vf)s"), {'pf': pf, 'vf': vfs})
         self.device_db.set_fabric_devices(fabric, pf, vfs)
 
     def scan_attached_devices(self):
         devices = []
         vm_ids = {}
-        conn = libvirt.openReadOnly('qemu:///system')
-        domains = []
+        # A full scan is the only time the VF GUIDs are read again
+        self.guid_cache.refresh()
+        self.macs_map = self._get_vfs_macs()
+        domains = self._get_domains()
+
+        domains_hostdevs = {}
+        # Domain XMLs are fetched in parallel, each fetch is a libvirt RPC
+        for result in helper_utils.parallel_map(
+                self._inspect_domain, domains,
+                cfg.CONF.DAEMON.libvirt_workers):
+            if result is None:
+                continue
+            vm_id, key, hostdevs = result
+            domains_hostdevs[vm_id] = (key, hostdevs)
+            for dev in self._get_attached_hostdevs(hostdevs):
+                devices.append(dev)
+                vm_ids[dev[0]] = vm_id
+        # Forget the domains which no longer exist
+        self.domains_hostdevs = domains_hostdevs
+        return devices, vm_ids
+
+    def _inspect_domain(self, domain):
+        try:
+            return self._get_domain_hostdevs(domain)
+        except libvirt.libvirtError:
+            LOG.warning(_LW("Failed to get domain XML, domain may be "
+                            "gone"), exc_info=True)
+
+    def scan_domain(self, vm_id):
+        """Return the attached devices of a single domain."""
+        try:
+            domain = self._get_conn().lookupByUUIDString(vm_id)
+            vm_id, key, hostdevs = self._get_domain_hostdevs(domain,
+                                                             refresh=True)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+            self.domains_hostdevs.pop(vm_id, None)
+            return []
+        self.domains_hostdevs[vm_id] = (key, hostdevs)
         self.macs_map = self._get_vfs_macs()
+        return self._get_attached_hostdevs(hostdevs)
+
+    def start_domain_events(self, listener):
+        """Notify listener of domain changes from a libvirt event thread.
+
+        Lifecycle and device added/removed events call listener with the
+        domain UUID. Losing the libvirt connection calls it with None, the
+        caller should then resync all the domains.
+        """
+        self.domain_listener = listener
+        libvirt.virEventRegisterDefaultImpl()
+        thread = threading.Thread(name='libvirt-events',
+                                  target=self._run_events)
+        thread.daemon = True
+        thread.start()
+        # Events are only delivered on connections opened once the event
+        # implementation is registered
+        self._close_conn()
+        self._get_conn()
+
+    def _run_events(self):
+        while True:
+            try:
+                libvirt.virEventRunDefaultImpl()
+            except Exception:
+                LOG.exception(_LE("libvirt event loop failed"))
+
+    def _register_domain_events(self, conn):
+        event_ids = [libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                     libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED]
+        # Device added events need libvirt 1.3.4
+        if hasattr(libvirt, 'VIR_DOMAIN_EVENT_ID_DEVICE_ADDED'):
+            event_ids.append(libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED)
+        for event_id in event_ids:
+            conn.domainEventRegisterAny(None, event_id,
+                                        self._domain_event, None)
+        conn.registerCloseCallback(self._conn_closed, None)
+
+    def _domain_event(self, conn, domain, *args):
+        self._notify_domain_listener(domain.UUIDString())
+
+    def _conn_closed(self, conn, reason, opaque):
+        LOG.warning(_LW("libvirt connection closed, reason %s"), reason)
+        # Domain events may have been missed, every domain is fetched again
+        self.domains_hostdevs = {}
+        self._notify_domain_listener(None)
+
+    def _notify_domain_listener(self, vm_id):
+        try:
+            self.domain_listener(vm_id)
+        except Exception:
+            LOG.exception(_LE("Failed to notify domain %s change"), vm_id)
+
+    def _get_conn(self):
+        if self.conn is not None and not self.conn.isAlive():
+            self._close_conn()
+        if self.conn is None:
+            self.conn = libvirt.openReadOnly(LIBVIRT_URI)
+            if self.domain_listener is not None:
+                self._register_domain_events(self.conn)
+        return self.conn
+
+    def _close_conn(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                if self.domain_listener is not None:
+                    conn.unregisterCloseCallback()
+                conn.close()
+            except libvirt.libvirtError:
+                pass
+
+    def _get_domains(self):
+        try:
+            return self._list_domains(self._get_conn())
+        except libvirt.libvirtError:
+            LOG.warning(_LW("libvirt connection failed, reconnecting"),
+                        exc_info=True)
+            self._close_conn()
+            return self._list_domains(self._get_conn())
+
+    def _list_domains(self, conn):
+        if hasattr(conn, 'listAllDomains'):
+            # Inactive domains are shut off, all the domains are returned
+            return conn.listAllDomains(0)
+
+        workers = cfg.CONF.DAEMON.libvirt_workers
+        domains = []
         domains_names = conn.listDefinedDomains()
-        defined_domains = map(conn.lookupByName, domains_names)
+        defined_domains = helper_utils.parallel_map(
+            conn.lookupByName, domains_names, workers)
         domains_ids = conn.listDomainsID()
-        running_domains = map(conn.lookupByID, domains_ids)
-        for domain in defined_domains:
-            [state, maxmem, mem, ncpu, cputime] = domain.info()
+        running_domains = helper_utils.parallel_map(
+            conn.lookupByID, domains_ids, workers)
+        states = helper_utils.parallel_map(
+            lambda domain: domain.info()[0], defined_domains, workers)
+        for domain, state in zip(defined_domains, states):
             if state in (libvirt.VIR_DOMAIN_PAUSED,
                          libvirt.VIR_DOMAIN_SHUTDOWN,
                          libvirt.VIR_DOMAIN_SHUTOFF):
                 domains.append(domain)
         domains += running_domains
+        return domains
 
-        for domain in domains:
+    def _get_domain_hostdevs(self, domain, refresh=False):
+        """Return the domain UUID, cache key and hostdev PCI addresses.
+
+        With domain events, the XML of a domain scanned before with the
+        same ID is not fetched again: the ID changes each time the domain
+        starts, and the hostdev changes of a domain are notified by events
+        which rescan it with refresh set. Without domain events the XML of
+        every domain is fetched, its hostdevs are parsed again only when it
+        changed.
+        """
+        vm_id = domain.UUIDString()
+        cached = self.domains_hostdevs.get(vm_id)
+        if self.domain_listener is not None:
+            key = domain.ID()
+            if cached and not refresh and cached[0] == key:
+                return vm_id, key, cached[1]
             raw_xml = domain.XMLDesc(0)
-            tree = etree.XML(raw_xml)
-            hostdevs = tree.xpath("devices/hostdev/source/address")
-            vm_id = tree.find('uuid').text
-            for dev in self._get_attached_hostdevs(hostdevs):
-                devices.append(dev)
-                vm_ids[dev[0]] = vm_id
-        return devices, vm_ids
+        else:
+            raw_xml = domain.XMLDesc(0)
+            key = hashlib.sha1(encodeutils.to_utf8(raw_xml)).hexdigest()
+            if cached and cached[0] == key:
+                return vm_id, key, cached[1]
+        hostdevs = [self.pci_utils.get_device_address(address) for address
+                    in domain_utils.get_pci_hostdev_addresses(raw_xml)]
+        return vm_id, key, hostdevs
 
     def get_fabric_details(self, fabric, pf=None):
         return self.device_db.get_fabric_details(fabric, pf)
@@ -73,17 +237,23 @@ class ResourceManager(object):
     def discover_devices(self, pf):
         return self.pci_utils.get_vfs_info(pf)
 
+    def set_vf_guid(self, pf_fabric_details, vf_index, guid):
+        self.guid_cache.set_vf_guid(pf_fabric_details, vf_index, guid)
+
     def get_fabric_for_dev(self, dev):
         return self.device_db.get_dev_fabric(dev)
 
+    def get_dev_details(self, dev):
+        return self.device_db.get_dev_details(dev)
+
     def _get_vfs_macs(self):
         macs_map = {}
         fabrics = self.device_db.device_db.keys()
         for fabric in fabrics:
             fabric_details = self.device_db.get_fabric_details(fabric)
             try:
-                macs_map[fabric] = \
-                    self.pci_utils.get_vfs_macs_ib(fabric_details)
+                macs_map[fabric] = self.guid_cache.get_vfs_macs(
+                    fabric_details)
             except Exception:
                 LOG.exception(_LE("Failed to get vfs macs for fabric %s "),
                               fabric)
@@ -92,32 +262,29 @@ class ResourceManager(object):
 
     def _get_attached_hostdevs(self, hostdevs):
         devs = []
-        for hostdev in hostdevs:
-            dev = self.pci_utils.get_device_address(hostdev)
-            fabric = self.get_fabric_for_dev(dev)
-            if fabric:
-                fabric_details = self.get_fabric_details(fabric)
-                for pf_fabric_details in fabric_details.values():
-                    if (pf_fabric_details['pf_device_type'] ==
-                        constants.MLNX4_VF_DEVICE_TYPE):
-                        hca_port = pf_fabric_details['hca_port']
-                        pf_mlx_dev = pf_fabric_details['pf_mlx_dev']
-                        vf_index = self.pci_utils.get_guid_index(
-                            pf_mlx_dev, dev, hca_port)
-                    elif (pf_fabric_details['pf_device_type'] ==
-                          constants.MLNX5_VF_DEVICE_TYPE):
-                        if dev in pf_fabric_details['vfs']:
-                            vf_index = pf_fabric_details['vfs'][dev]['vf_num']
-                        else:
-                            continue
-                    try:
-                        mac = self.macs_map[fabric][str(vf_index)]
-                        devs.append((dev, mac, fabric))
-                    except KeyError:
-                        LOG.warning(_LW("Failed to retrieve Hostdev MAC"
-                                        "for dev %s"), dev)
+        for dev in hostdevs:
+            dev_details = self.get_dev_details(dev)
+            if dev_details:
+                fabric, pf, vf = dev_details
+                pf_fabric_details = self.get_fabric_details(fabric, pf)
+                vf_index = None
+                if (pf_fabric_details['pf_device_type'] ==
+                    constants.MLNX4_VF_DEVICE_TYPE):
+                    hca_port = pf_fabric_details['hca_port']
+                    pf_mlx_dev = pf_fabric_details['pf_mlx_dev']
+                    vf_index = self.pci_utils.get_guid_index(
+                        pf_mlx_dev, dev, hca_port)
+                elif (pf_fabric_details['pf_device_type'] ==
+                      constants.MLNX5_VF_DEVICE_TYPE):
+                    vf_index = vf.vf_num
+                try:
+                    mac = self.macs_map[fabric][str(vf_index)]
+                    devs.append((dev, mac, fabric))
+                except KeyError:
+                    LOG.warning(_LW("Failed to retrieve Hostdev MAC"
+                                    "for dev %s"), dev)
             else:
-                LOG.info(_LI("No Fabric defined for device %s"), hostdev)
+                LOG.info(_LI("No Fabric defined for device %s"), dev)
         return devs
 
     def _get_pf_details(self, pf):
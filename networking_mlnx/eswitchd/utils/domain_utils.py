@@ -0,0 +1,26 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from lxml import etree
+from oslo_utils import encodeutils
+
+# Compiled once, evaluating it does not compile the expression again
+_HOSTDEV_ADDRESS_XPATH = etree.XPath(
+    "/domain/devices/hostdev[@type='pci']/source/address")
+
+
+def get_pci_hostdev_addresses(raw_xml):
+    """Return the source address elements of a domain PCI hostdevs."""
+    return _HOSTDEV_ADDRESS_XPATH(etree.XML(encodeutils.to_utf8(raw_xml)))
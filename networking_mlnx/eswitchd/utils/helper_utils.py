@@ -14,10 +14,126 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+import threading
+
+from oslo_config import cfg
+import six
+from six.moves import queue
+
 from networking_mlnx.eswitchd.common import constants
 
+SYSFS_ROOT = '/sys'
+
 
 def set_conn_url(transport, addr, port):
     """Return connection string for using in ZMQ connect """
     return constants.CONN_URL % {'transport': transport,
                                  'port': port, 'addr': addr}
+
+
+def sysfs_path(path):
+    """Return a /sys path under the sysfs_root directory."""
+    root = cfg.CONF.DAEMON.sysfs_root
+    if root != SYSFS_ROOT and path.startswith(SYSFS_ROOT + '/'):
+        return root + path[len(SYSFS_ROOT):]
+    return path
+
+
+def parallel_map(func, items, workers):
+    """Return [func(item) for item in items] computed by worker threads.
+
+    At most workers threads are started, results keep the order of items.
+    The first exception raised by func is raised with its traceback once
+    all threads are done.
+    """
+    items = list(items)
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    errors = []
+    pending = queue.Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception:
+                errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=worker) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        six.reraise(*errors[0])
+    return results
+
+
+class WorkerPool(object):
+    """Long-lived worker threads, started when first needed.
+
+    map() must not be called from the pool threads, a call waiting for
+    the pool it runs on could wait forever.
+    """
+
+    def __init__(self, workers, name='worker'):
+        self.workers = workers
+        self.name = name
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def map(self, func, items):
+        """Return [func(item) for item in items] computed by the workers.
+
+        Results keep the order of items. The first exception raised by
+        func is raised with its traceback once all the items are done.
+        """
+        items = list(items)
+        if self.workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        self._start()
+        results = [None] * len(items)
+        errors = []
+        done = threading.Semaphore(0)
+
+        def call(index, item):
+            try:
+                results[index] = func(item)
+            except Exception:
+                errors.append(sys.exc_info())
+            finally:
+                done.release()
+
+        for index, item in enumerate(items):
+            self._tasks.put((call, index, item))
+        for item in items:
+            done.acquire()
+        if errors:
+            six.reraise(*errors[0])
+        return results
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    name='%s-%d' % (self.name, len(self._threads)),
+                    target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            call, index, item = self._tasks.get()
+            call(index, item)
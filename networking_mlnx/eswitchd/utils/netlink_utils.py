@@ -0,0 +1,190 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import errno
+import os
+import socket
+import struct
+import threading
+
+from oslo_config import cfg
+from oslo_utils import encodeutils
+
+from networking_mlnx.eswitchd.common import exceptions
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+
+IFF_UP = 0x1
+
+ARPHRD_ETHER = 1
+ARPHRD_INFINIBAND = 32
+
+OPER_STATES = ('unknown', 'notpresent', 'down', 'lowerlayerdown',
+               'testing', 'dormant', 'up')
+
+# struct nlmsghdr, struct ifinfomsg, struct rtattr and struct nlmsgerr
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+RTATTR = struct.Struct('=HH')
+NLMSGERR = struct.Struct('=i')
+
+RECV_SIZE = 65536
+
+Link = collections.namedtuple('Link', ['index', 'name', 'type', 'flags',
+                                       'operstate'])
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def pack_attr(attr_type, data):
+    attr = RTATTR.pack(RTATTR.size + len(data), attr_type) + data
+    return attr + b'\0' * (_align(len(attr)) - len(attr))
+
+
+def unpack_attrs(data):
+    """Return a dict of the route attributes in data by type."""
+    attrs = {}
+    offset = 0
+    while offset + RTATTR.size <= len(data):
+        length, attr_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def pack_msg(msg_type, flags, seq, payload):
+    return NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, flags,
+                         seq, 0) + payload
+
+
+def unpack_msgs(data):
+    """Return the (type, flags, seq, payload) of the messages in data."""
+    msgs = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, pid = NLMSGHDR.unpack_from(
+            data, offset)
+        if length < NLMSGHDR.size:
+            break
+        msgs.append((msg_type, flags, seq,
+                     data[offset + NLMSGHDR.size:offset + length]))
+        offset += _align(length)
+    return msgs
+
+
+class NetlinkClient(object):
+    """rtnetlink link queries and changes over a long-lived socket.
+
+    Reading links needs no privileges, changing them needs CAP_NET_ADMIN
+    and fails with a NetlinkError of errno EPERM otherwise.
+    """
+
+    def __init__(self):
+        self._sock = None
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def get_link(self, ifname):
+        """Return the Link of the interface named ifname."""
+        payload = (IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) +
+                   pack_attr(IFLA_IFNAME,
+                             encodeutils.to_utf8(ifname) + b'\0'))
+        reply = self._request(RTM_GETLINK, NLM_F_REQUEST, payload)
+        family, link_type, index, flags, change = IFINFOMSG.unpack_from(
+            reply)
+        attrs = unpack_attrs(reply[IFINFOMSG.size:])
+        name = attrs.get(IFLA_IFNAME, b'').rstrip(b'\0')
+        operstate = bytearray(attrs.get(IFLA_OPERSTATE, b'\0'))[0]
+        if operstate < len(OPER_STATES):
+            operstate = OPER_STATES[operstate]
+        return Link(index, encodeutils.safe_decode(name), link_type, flags,
+                    operstate)
+
+    def is_link_up(self, ifname):
+        return bool(self.get_link(ifname).flags & IFF_UP)
+
+    def set_link_up(self, ifname):
+        """Set the interface up, unless it is up already."""
+        link = self.get_link(ifname)
+        if link.flags & IFF_UP:
+            return
+        payload = IFINFOMSG.pack(socket.AF_UNSPEC, 0, link.index, IFF_UP,
+                                 IFF_UP)
+        self._request(RTM_NEWLINK, NLM_F_REQUEST | NLM_F_ACK, payload)
+
+    def _request(self, msg_type, flags, payload):
+        """Send a request, return the payload of its reply.
+
+        The payload of an acknowledgment is empty.
+        """
+        with self._lock:
+            try:
+                sock = self._get_sock()
+                self._seq += 1
+                seq = self._seq
+                sock.send(pack_msg(msg_type, flags, seq, payload))
+                while True:
+                    for reply in unpack_msgs(sock.recv(RECV_SIZE)):
+                        # Replies of requests timed out before are dropped
+                        if reply[2] == seq:
+                            return self._get_payload(reply)
+            except (socket.error, socket.timeout) as e:
+                self.close()
+                raise exceptions.NetlinkError('netlink request failed: %s' %
+                                              e, getattr(e, 'errno', None))
+
+    def _get_payload(self, reply):
+        msg_type, flags, seq, payload = reply
+        if msg_type == NLMSG_ERROR:
+            error = -NLMSGERR.unpack_from(payload)[0]
+            if error:
+                raise exceptions.NetlinkError(os.strerror(error), error)
+            return b''
+        if msg_type == NLMSG_DONE:
+            raise exceptions.NetlinkError('no netlink reply', errno.ENODATA)
+        return payload
+
+    def _get_sock(self):
+        if self._sock is None:
+            self._sock = self._open()
+        return self._sock
+
+    def _open(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             NETLINK_ROUTE)
+        sock.settimeout(cfg.CONF.DAEMON.default_timeout / 1000.0)
+        sock.bind((0, 0))
+        return sock
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
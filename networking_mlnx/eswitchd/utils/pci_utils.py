@@ -12,20 +12,25 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import collections
 import glob
 import os
 import re
 
 import ethtool
-from oslo_concurrency import processutils
 from oslo_log import log as logging
 
-from networking_mlnx._i18n import _LE, _LW
+from networking_mlnx._i18n import _LE
+from networking_mlnx.common import ib_address
 from networking_mlnx.eswitchd.common import constants
-from networking_mlnx.eswitchd.utils import command_utils
+from networking_mlnx.eswitchd.utils import helper_utils
+from networking_mlnx.eswitchd.utils import netlink_utils
 
 LOG = logging.getLogger(__name__)
 
+# VF details discovered for each VF PCI address of a PF
+VfInfo = collections.namedtuple('VfInfo', ['vf_num', 'vf_device_type'])
+
 
 class pciUtils(object):
 
@@ -37,25 +42,45 @@ class pciUtils(object):
     DEVICE_TYPE_PATH = ETH_DEV + '/virtfn%(vf_num)s/device'
     _VIRTFN_RE = re.compile("virtfn(?P<vf_num>\d+)")
     VFS_PATH = ETH_DEV + "/virtfn*"
+    _PCI_ADDRESS_FORMAT = '%04x:%02x:%02x.%x'
+
+    def __init__(self):
+        self.netlink = netlink_utils.NetlinkClient()
 
     def get_vfs_info(self, pf):
         vfs_info = {}
         try:
-            dev_path = self.ETH_DEV % {'interface': pf}
-            dev_info = os.listdir(dev_path)
-            for dev_filename in dev_info:
+            dev_path = helper_utils.sysfs_path(
+                self.ETH_DEV % {'interface': pf})
+            # The VFs of a PF are of the same device type, it is read once
+            vf_device_type = None
+            for dev_filename, dev_file, is_link in self._list_links(dev_path):
+                if not is_link or not dev_filename.startswith('virtfn'):
+                    continue
                 result = self._VIRTFN_RE.match(dev_filename)
                 if result and result.group('vf_num'):
-                    dev_file = os.path.join(dev_path, dev_filename)
                     vf_pci = os.readlink(dev_file).strip("./")
                     vf_num = result.group('vf_num')
-                    vf_device_type = self.get_vf_device_type(pf, vf_num)
-                    vfs_info[vf_pci] = {'vf_num': vf_num,
-                                        'vf_device_type': vf_device_type}
+                    if vf_device_type is None:
+                        vf_device_type = self.get_vf_device_type(pf, vf_num)
+                    vfs_info[vf_pci] = VfInfo(vf_num, vf_device_type)
         except Exception:
             LOG.error(_LE("PCI device %s not found"), pf)
         return vfs_info
 
+    def _list_links(self, path):
+        """Return the (name, path, is symlink) of the entries of a directory.
+
+        With os.scandir the entry types come with the listing, they are
+        not looked up for each entry.
+        """
+        if hasattr(os, 'scandir'):
+            return [(entry.name, entry.path, entry.is_symlink())
+                    for entry in os.scandir(path)]
+        return [(name, os.path.join(path, name),
+                 os.path.islink(os.path.join(path, name)))
+                for name in os.listdir(path)]
+
     def get_dev_attr(self, attr_path):
         try:
             fd = open(attr_path)
@@ -64,7 +89,8 @@ class pciUtils(object):
             return
 
     def verify_vendor_pf(self, pf, vendor_id=constants.VENDOR):
-        vendor_path = pciUtils.VENDOR_PATH % {'interface': pf}
+        vendor_path = helper_utils.sysfs_path(
+            pciUtils.VENDOR_PATH % {'interface': pf})
         if self.get_dev_attr(vendor_path) == vendor_id:
             return True
         else:
@@ -72,8 +98,8 @@ class pciUtils(object):
 
     def get_vf_device_type(self, pf, vf_num):
         device_vf_type = None
-        device_type_file = pciUtils.DEVICE_TYPE_PATH % {'interface': pf,
-                                                        'vf_num': vf_num}
+        device_type_file = helper_utils.sysfs_path(
+            pciUtils.DEVICE_TYPE_PATH % {'interface': pf, 'vf_num': vf_num})
         try:
             with open(device_type_file, 'r') as fd:
                 device_type = fd.read()
@@ -90,7 +116,8 @@ class pciUtils(object):
         return device_vf_type
 
     def is_sriov_pf(self, pf):
-        vfs_path = pciUtils.VFS_PATH % {'interface': pf}
+        vfs_path = helper_utils.sysfs_path(
+            pciUtils.VFS_PATH % {'interface': pf})
         vfs = glob.glob(vfs_path)
         if vfs:
             return True
@@ -98,16 +125,10 @@ class pciUtils(object):
             return
 
     def get_interface_type(self, ifc):
-        cmd = ['ip', '-o', 'link', 'show', 'dev', ifc]
-        try:
-            out, err = command_utils.execute(*cmd)
-        except (processutils.ProcessExecutionError, OSError) as e:
-            LOG.warning(_LW("Failed to execute command %(cmd)s due to %(e)s"),
-                    {"cmd": cmd, "e": e})
-            raise
-        if out.find('link/ether') != -1:
+        link = self.netlink.get_link(ifc)
+        if link.type == netlink_utils.ARPHRD_ETHER:
             return 'eth'
-        elif out.find('link/infiniband') != -1:
+        elif link.type == netlink_utils.ARPHRD_INFINIBAND:
             return 'ib'
         else:
             return None
@@ -120,7 +141,7 @@ class pciUtils(object):
         return [ifc for ifc in ifcs if self.is_ifc_module(ifc)]
 
     def get_pf_mlx_dev(self, pf):
-        dev_path = (
+        dev_path = helper_utils.sysfs_path(
             os.path.join(pciUtils.ETH_PATH % {'interface': pf},
             pciUtils.INFINIBAND_PATH))
         dev_info = os.listdir(dev_path)
@@ -128,13 +149,15 @@ class pciUtils(object):
 
     def get_guid_index(self, pf_mlx_dev, dev, hca_port):
         guid_index = None
-        path = constants.MLNX4_GUID_INDEX_PATH % (pf_mlx_dev, dev, hca_port)
+        path = helper_utils.sysfs_path(
+            constants.MLNX4_GUID_INDEX_PATH % (pf_mlx_dev, dev, hca_port))
         with open(path) as fd:
             guid_index = fd.readline().strip()
         return guid_index
 
     def get_eth_port(self, dev):
-        port_path = pciUtils.ETH_PORT % {'interface': dev}
+        port_path = helper_utils.sysfs_path(
+            pciUtils.ETH_PORT % {'interface': dev})
         try:
             with open(port_path) as f:
                 dev_id = int(f.read(), 0)
@@ -145,55 +168,58 @@ class pciUtils(object):
     def get_vfs_macs_ib(self, fabric_details):
         macs_map = {}
         for pf_fabric_details in fabric_details.values():
-            if (pf_fabric_details['pf_device_type'] ==
-                constants.MLNX4_VF_DEVICE_TYPE):
-                macs_map.update(self.get_vfs_macs_ib_mlnx4(pf_fabric_details))
-            elif (pf_fabric_details['pf_device_type'] ==
-                  constants.MLNX5_VF_DEVICE_TYPE):
-                macs_map.update(self.get_vfs_macs_ib_mlnx5(pf_fabric_details))
+            macs_map.update(self.get_pf_vfs_macs_ib(pf_fabric_details))
         return macs_map
 
+    def get_pf_vfs_macs_ib(self, pf_fabric_details):
+        if (pf_fabric_details['pf_device_type'] ==
+                constants.MLNX4_VF_DEVICE_TYPE):
+            return self.get_vfs_macs_ib_mlnx4(pf_fabric_details)
+        elif (pf_fabric_details['pf_device_type'] ==
+                constants.MLNX5_VF_DEVICE_TYPE):
+            return self.get_vfs_macs_ib_mlnx5(pf_fabric_details)
+        return {}
+
+    def get_mac_from_guid(self, guid, device_type):
+        if device_type == constants.MLNX4_VF_DEVICE_TYPE:
+            return ib_address.mlnx4_guid_to_mac(guid)
+        elif device_type == constants.MLNX5_VF_DEVICE_TYPE:
+            return ib_address.mlnx5_guid_to_mac(guid)
+
     def get_vfs_macs_ib_mlnx4(self, fabric_details):
         hca_port = fabric_details['hca_port']
         pf_mlx_dev = fabric_details['pf_mlx_dev']
-        macs_map = {}
-        guids_path = constants.MLNX4_ADMIN_GUID_PATH % (pf_mlx_dev, hca_port,
-                                                  '[1-9]*')
+        guids_path = helper_utils.sysfs_path(
+            constants.MLNX4_ADMIN_GUID_PATH % (pf_mlx_dev, hca_port, '[1-9]*'))
         paths = glob.glob(guids_path)
+        vf_indexes = []
+        guids = []
         for path in paths:
-            vf_index = path.split('/')[-1]
+            vf_indexes.append(str(int(path.split('/')[-1])))
             with open(path) as f:
-                guid = f.readline().strip()
-                if guid == constants.MLNX4_INVALID_GUID:
-                    mac = constants.INVALID_MAC
-                else:
-                    head = guid[:6]
-                    tail = guid[-6:]
-                    mac = ":".join(re.findall('..?', head + tail))
-                macs_map[str(int(vf_index))] = mac
-        return macs_map
+                guids.append(f.readline().strip())
+        return dict(zip(vf_indexes, ib_address.mlnx4_guids_to_macs(
+            guids, invalid=constants.INVALID_MAC)))
 
     def get_vfs_macs_ib_mlnx5(self, fabric_details):
         vfs = fabric_details['vfs']
-        macs_map = {}
+        pf_mlx_dev = fabric_details['pf_mlx_dev']
+        vf_nums = []
+        guids = []
         for vf in vfs.values():
-            vf_num = vf['vf_num']
-            pf_mlx_dev = fabric_details['pf_mlx_dev']
-            guid_path = (
+            vf_num = vf.vf_num
+            guid_path = helper_utils.sysfs_path(
                 constants.MLNX5_GUID_NODE_PATH % {'module': pf_mlx_dev,
                                                   'vf_num': vf_num})
             with open(guid_path) as f:
-                guid = f.readline().strip()
-                head = guid[:8]
-                tail = guid[-9:]
-                mac = head + tail
-            macs_map[vf_num] = mac
-        return macs_map
+                guids.append(f.readline().strip())
+            vf_nums.append(vf_num)
+        return dict(zip(vf_nums, ib_address.mlnx5_guids_to_macs(
+            guids, invalid=constants.INVALID_MAC)))
 
     def get_device_address(self, hostdev):
-        domain = hostdev.attrib['domain'][2:]
-        bus = hostdev.attrib['bus'][2:]
-        slot = hostdev.attrib['slot'][2:]
-        function = hostdev.attrib['function'][2:]
-        dev = "%.4s:%.2s:%2s.%.1s" % (domain, bus, slot, function)
-        return dev
+        """Return the PCI address of a libvirt address element."""
+        return self._PCI_ADDRESS_FORMAT % (int(hostdev.get('domain'), 16),
+                                           int(hostdev.get('bus'), 16),
+                                           int(hostdev.get('slot'), 16),
+                                           int(hostdev.get('function'), 16))
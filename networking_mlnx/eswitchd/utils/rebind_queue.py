@@ -0,0 +1,110 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+from networking_mlnx._i18n import _LE
+from oslo_config import cfg
+from oslo_log import log as logging
+from six.moves import queue
+
+LOG = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FAILED = 'failed'
+
+
+class RebindQueue(object):
+    """Rebinds VF drivers in background threads.
+
+    Requests for a VF made before its rebind started are done by a single
+    rebind, a request made while the VF is rebound runs another rebind
+    once it is done. Different VFs are rebound in parallel by up to
+    rebind_workers threads.
+    """
+
+    def __init__(self, rebind):
+        self._rebind = rebind
+        self._pending = queue.Queue()
+        self._cond = threading.Condition()
+        # VF to its rebind state, VFs rebound successfully are dropped
+        self._states = {}
+        # Running VFs to rebind again once done
+        self._again = set()
+        self._threads = []
+        self._stats = {'requested': 0, 'coalesced': 0, 'done': 0,
+                       'failed': 0}
+
+    def schedule(self, dev):
+        with self._cond:
+            self._stats['requested'] += 1
+            state = self._states.get(dev)
+            if state == QUEUED or dev in self._again:
+                self._stats['coalesced'] += 1
+                return
+            if state == RUNNING:
+                self._again.add(dev)
+                return
+            self._states[dev] = QUEUED
+            self._start_workers()
+        self._pending.put(dev)
+
+    def wait(self, dev):
+        """Wait until the requested rebinds of dev are done."""
+        with self._cond:
+            while self._states.get(dev) in (QUEUED, RUNNING):
+                self._cond.wait()
+
+    def get_states(self):
+        """Return the state of the VFs queued, rebound or failed."""
+        with self._cond:
+            return dict(self._states)
+
+    def get_stats(self):
+        with self._cond:
+            return dict(self._stats)
+
+    def _start_workers(self):
+        workers = cfg.CONF.DAEMON.rebind_workers
+        while len(self._threads) < workers:
+            thread = threading.Thread(name='rebind-%d' % len(self._threads),
+                                      target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            dev = self._pending.get()
+            with self._cond:
+                self._states[dev] = RUNNING
+            try:
+                self._rebind(dev)
+                state = None
+            except Exception:
+                LOG.exception(_LE("Failed to rebind VF %s"), dev)
+                state = FAILED
+            with self._cond:
+                self._stats['failed' if state else 'done'] += 1
+                if dev in self._again:
+                    self._again.discard(dev)
+                    self._states[dev] = QUEUED
+                    self._pending.put(dev)
+                elif state:
+                    self._states[dev] = state
+                else:
+                    del self._states[dev]
+                self._cond.notify_all()
@@ -0,0 +1,193 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import threading
+
+from networking_mlnx._i18n import _LW
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import encodeutils
+import six
+
+from networking_mlnx.eswitchd.common import exceptions
+from networking_mlnx.eswitchd.utils import command_utils
+from networking_mlnx.eswitchd.utils import helper_utils
+
+LOG = logging.getLogger(__name__)
+
+WRITER_CMD = ['ebrctl', 'write-sys-server']
+
+
+class SysfsWriter(object):
+    """Writes sysfs files as root.
+
+    The writes are sent as one JSON line per batch to a long-lived
+    'ebrctl write-sys-server' process started through the root helper,
+    which answers with one JSON line holding an error per write. With
+    persistent_sysfs_writer disabled every write runs 'ebrctl write-sys'.
+    The values written are remembered so writing them again is skipped.
+    /sys paths are written under the sysfs_root directory.
+    """
+
+    def __init__(self):
+        self._process = None
+        self._lock = threading.Lock()
+        # Path to the value last written to it
+        self._applied = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {'written': 0, 'skipped': 0,
+                       'actions_written': 0, 'actions_skipped': 0}
+
+    def write_sys(self, writes, actions=()):
+        """Write the (path, value) pairs in order, then the actions.
+
+        A write of the value last written to the same path is skipped.
+        Actions, such as a VF driver unbind, are (path, value) pairs whose
+        effect is not kept in the file, they are written only when some of
+        the writes were not skipped.
+
+        Return whether some of the writes were not skipped. Raise
+        SysfsWriteError if any write failed, writes following a failed one
+        are not done.
+        """
+        writes = [(helper_utils.sysfs_path(path), six.text_type(value))
+                  for path, value in writes]
+        actions = [(helper_utils.sysfs_path(path), six.text_type(value))
+                   for path, value in actions]
+        changed = writes
+        if cfg.CONF.DAEMON.skip_unchanged_sysfs_writes:
+            changed = [(path, value) for path, value in writes
+                       if self._applied.get(path) != value]
+            if writes and not changed:
+                self._count('actions_skipped', len(actions))
+                actions = []
+        self._count('skipped', len(writes) - len(changed))
+        if not changed and not actions:
+            return False
+        try:
+            self._write_sys(changed + actions)
+        except Exception:
+            # The files of a failed batch may hold any of the values
+            for path, value in writes:
+                self._applied.pop(path, None)
+            raise
+        self._applied.update(changed)
+        self._count('written', len(changed))
+        self._count('actions_written', len(actions))
+        return bool(changed)
+
+    def _write_sys(self, writes):
+        if not cfg.CONF.DAEMON.persistent_sysfs_writer:
+            for path, value in writes:
+                command_utils.execute('ebrctl', 'write-sys', path, value)
+            return
+        errors = self.write(writes)
+        failed = ['%s: %s' % (path, error)
+                  for (path, value), error in zip(writes, errors) if error]
+        if failed:
+            raise exceptions.SysfsWriteError(', '.join(failed))
+
+    def _count(self, name, count):
+        with self._stats_lock:
+            self._stats[name] += count
+
+    def get_stats(self):
+        """Return the counts of written and skipped writes and actions."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def write(self, writes):
+        """Write the (path, value) pairs, return an error per write.
+
+        An error is None when the value was written.
+        """
+        request = jsonutils.dumps(
+            [[path, six.text_type(value)] for path, value in writes])
+        request = encodeutils.to_utf8(request) + b'\n'
+        with self._lock:
+            reply = self._send(request)
+        return jsonutils.loads(reply)
+
+    def _send(self, request):
+        if self._process is not None and self._process.poll() is not None:
+            LOG.warning(_LW("sysfs writer exited with %s, restarting"),
+                        self._process.returncode)
+            self._process = None
+        if self._process is None:
+            self._process = self._start()
+        try:
+            self._process.stdin.write(request)
+            self._process.stdin.flush()
+            reply = self._process.stdout.readline()
+        except (IOError, OSError) as e:
+            self.stop()
+            raise exceptions.SysfsWriteError(
+                'sysfs writer failed: %s' % e)
+        if not reply:
+            self.stop()
+            raise exceptions.SysfsWriteError('sysfs writer exited')
+        return reply
+
+    def _start(self):
+        cmd = command_utils.get_root_helper().split() + WRITER_CMD
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, close_fds=True)
+
+    def stop(self):
+        process, self._process = self._process, None
+        if process is not None and process.poll() is None:
+            process.stdin.close()
+            process.wait()
+
+
+class SysfsWriterPool(object):
+    """SysfsWriters of concurrent threads, one per thread.
+
+    Each thread writes through its own writer process, so a slow write,
+    such as a VF driver rebind, does not hold the writes of other threads.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writers = []
+
+    def get(self):
+        """Return the writer of the calling thread."""
+        writer = getattr(self._local, 'writer', None)
+        if writer is None:
+            writer = SysfsWriter()
+            self._local.writer = writer
+            with self._lock:
+                self._writers.append(writer)
+        return writer
+
+    def get_stats(self):
+        """Return the counts of the writes of all the writers."""
+        stats = SysfsWriter().get_stats()
+        with self._lock:
+            writers = list(self._writers)
+        for writer in writers:
+            for name, count in writer.get_stats().items():
+                stats[name] += count
+        return stats
+
+    def stop(self):
+        with self._lock:
+            writers = list(self._writers)
+        for writer in writers:
+            writer.stop()
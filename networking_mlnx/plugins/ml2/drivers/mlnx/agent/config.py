@@ -28,6 +28,12 @@ eswitch_opts = [
     cfg.StrOpt('daemon_endpoint',
                default='tcp://127.0.0.1:60001',
                help=_('eswitch daemon end point')),
+    cfg.StrOpt('daemon_events_endpoint',
+               default='tcp://127.0.0.1:60002',
+               help=_('eswitch daemon vNIC events end point. The agent '
+                      'handles attached vNIC changes as soon as they are '
+                      'published instead of waiting for the next polling. '
+                      'Leave empty to only rely on polling')),
     cfg.IntOpt('request_timeout', default=3000,
                help=_("The number of milliseconds the agent will wait for "
                       "response on request to daemon.")),
@@ -38,6 +44,12 @@ eswitch_opts = [
                help=_("backoff rate multiplier for waiting period between "
                       "retries for request to daemon, i.e. value of 2 will "
                       " double the request timeout each retry")),
+    cfg.FloatOpt('vnics_snapshot_ttl', default=1.0, min=0,
+                 help=_("The number of seconds the attached vNICs fetched "
+                        "from the daemon are reused for. The agent fetches "
+                        "them once per polling loop iteration, the ports "
+                        "handled and the state reports of the iteration "
+                        "read that snapshot")),
 ]
 
 agent_opts = [
@@ -14,6 +14,9 @@
 # limitations under the License.
 
 
+import collections
+import contextlib
+import itertools
 import socket
 import sys
 import time
@@ -32,7 +35,6 @@ from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging
 from oslo_service import loopingcall
-import six
 
 from networking_mlnx._i18n import _LE, _LI, _LW
 from networking_mlnx.plugins.ml2.drivers.mlnx.agent import config  # noqa
@@ -42,109 +44,247 @@ from networking_mlnx.plugins.ml2.drivers.mlnx import mech_mlnx
 
 LOG = logging.getLogger(__name__)
 
+# The network segment a port is bound to
+Segment = collections.namedtuple('Segment', ['network_type',
+                                             'physical_network',
+                                             'segmentation_id'])
+Port = collections.namedtuple('Port', ['port_id', 'network_id', 'segment'])
+# The eswitch configuration of a port, vnic is its attached vNIC details
+PortState = collections.namedtuple('PortState', ['fabric', 'vlan',
+                                                 'admin_state', 'vnic'])
+
+
+class PortRegistry(object):
+    """The ports of the agent, indexed by MAC and by network.
+
+    A MAC has a single port, adding it again replaces its port.
+    """
+
+    def __init__(self):
+        # MAC to Port
+        self._ports = {}
+        # Network ID to the MACs of its ports
+        self._networks = {}
+
+    def add(self, port_mac, port_id, network_id, segment):
+        old = self._ports.get(port_mac)
+        if old is not None and old.network_id != network_id:
+            self._discard_network_port(old.network_id, port_mac)
+        self._ports[port_mac] = Port(port_id, network_id, segment)
+        self._networks.setdefault(network_id, set()).add(port_mac)
+
+    def get(self, port_mac):
+        """Return the Port of a MAC, None if it is unknown."""
+        return self._ports.get(port_mac)
+
+    def remove(self, port_mac):
+        port = self._ports.pop(port_mac, None)
+        if port is not None:
+            self._discard_network_port(port.network_id, port_mac)
+        return port
+
+    def has_network(self, network_id):
+        return network_id in self._networks
+
+    def get_network_ports(self, network_id):
+        """Return the MACs of the ports of a network."""
+        return frozenset(self._networks.get(network_id, ()))
+
+    def remove_network(self, network_id):
+        """Remove a network and its ports, return whether it was known."""
+        port_macs = self._networks.pop(network_id, None)
+        if port_macs is None:
+            return False
+        for port_mac in port_macs:
+            del self._ports[port_mac]
+        return True
+
+    def _discard_network_port(self, network_id, port_mac):
+        port_macs = self._networks[network_id]
+        port_macs.discard(port_mac)
+        if not port_macs:
+            del self._networks[network_id]
+
+    def __len__(self):
+        return len(self._ports)
+
 
 class EswitchManager(object):
-    def __init__(self, interface_mappings, endpoint, timeout):
-        self.utils = utils.EswitchUtils(endpoint, timeout)
+    def __init__(self, interface_mappings, endpoint, timeout,
+                 events_endpoint=None):
+        self.utils = utils.EswitchUtils(endpoint, timeout, events_endpoint)
         self.interface_mappings = interface_mappings
-        self.network_map = {}
+        self.ports = PortRegistry()
+        # Attached vNICs as known from the last eSwitchD delta
+        self.vnics = {}
+        self.vnics_generation = 0
+        self.vnics_epoch = None
+        # When the vNICs were last fetched, None to fetch them again
+        self.vnics_time = None
+        # MAC to the PortState last applied on eSwitchD, forgotten when
+        # eSwitchD restarts
+        self.applied = {}
+        # MAC to the PortState sent in the current batch
+        self._batch_states = None
         self.utils.define_fabric_mappings(interface_mappings)
 
     def get_port_id_by_mac(self, port_mac):
-        for network_id, data in six.iteritems(self.network_map):
-            for port in data['ports']:
-                if port['port_mac'] == port_mac:
-                    return port['port_id']
+        port = self.ports.get(port_mac)
+        if port is not None:
+            return port.port_id
         LOG.error(_LE("Agent cache inconsistency - port id "
                       "is not stored for %s"), port_mac)
         raise exceptions.MlnxException(err_msg=("Agent cache inconsistency, "
                                                 "check logs"))
 
-    def get_vnics_mac(self):
-        return set(self.utils.get_attached_vnics().keys())
+    @contextlib.contextmanager
+    def batch(self):
+        """Send the eswitch changes made in the context in one request."""
+        if self._batch_states is not None:
+            yield
+            return
+        self._batch_states = {}
+        try:
+            with self.utils.batch():
+                yield
+            self.applied.update(self._batch_states)
+        finally:
+            self._batch_states = None
+
+    def _apply_state(self, port_mac, state, apply):
+        """Call apply to set the state of a port, unless it is set already.
+
+        The state is remembered once applied, when the batch it is sent in
+        succeeded.
+        """
+        if self.applied.get(port_mac) == state:
+            LOG.debug("Port %s is configured already", port_mac)
+            return
+        self.applied.pop(port_mac, None)
+        apply()
+        if self._batch_states is not None:
+            self._batch_states[port_mac] = state
+        else:
+            self.applied[port_mac] = state
+
+    def get_attached_vnics(self, refresh=False):
+        """Return the attached vNICs, fetching only changes from eSwitchD.
+
+        The vNICs fetched are reused for vnics_snapshot_ttl seconds, unless
+        refresh is set.
+        """
+        if (not refresh and self.vnics_time is not None and
+                time.time() - self.vnics_time <
+                cfg.CONF.ESWITCH.vnics_snapshot_ttl):
+            return self.vnics
+        delta = self.utils.get_attached_vnics_delta(self.vnics_generation,
+                                                    self.vnics_epoch)
+        self.vnics_time = time.time()
+        if (delta['epoch'] == self.vnics_epoch and
+                delta['generation'] < self.vnics_generation):
+            # A newer delta of a concurrent request was applied already
+            return self.vnics
+        if delta['epoch'] != self.vnics_epoch and self.applied:
+            LOG.info(_LI("eSwitchD restarted, ports will be configured "
+                         "again"))
+            self.applied = {}
+        # A VF plugged again has its eswitch configuration reset even when
+        # its vNIC details are unchanged, its ports are configured again
+        for vnic_mac in itertools.chain(delta['added'], delta['removed']):
+            self.applied.pop(vnic_mac, None)
+        if delta['full']:
+            LOG.debug("Full attached vNICs table received from eSwitchD")
+            self.vnics = delta['added']
+        else:
+            self.vnics.update(delta['added'])
+            for vnic_mac in delta['removed']:
+                self.vnics.pop(vnic_mac, None)
+        self.vnics_generation = delta['generation']
+        self.vnics_epoch = delta['epoch']
+        return self.vnics
+
+    def get_vnics_mac(self, refresh=False):
+        return set(self.get_attached_vnics(refresh).keys())
+
+    def wait_for_events(self, timeout):
+        return self.utils.wait_for_events(timeout)
 
     def vnic_port_exists(self, port_mac):
-        return port_mac in self.utils.get_attached_vnics()
+        return port_mac in self.get_attached_vnics()
 
     def remove_network(self, network_id):
-        if network_id in self.network_map:
-            del self.network_map[network_id]
-        else:
+        for port_mac in self.ports.get_network_ports(network_id):
+            self.applied.pop(port_mac, None)
+        if not self.ports.remove_network(network_id):
             LOG.debug("Network %s not defined on Agent.", network_id)
 
     def port_down(self, network_id, physical_network, port_mac):
         """Sets port to down.
 
-        Check internal network map for port data.
+        Check internal port registry for port data.
         If port exists set port to Down
         """
-        for network_id, data in six.iteritems(self.network_map):
-            for port in data['ports']:
-                if port['port_mac'] == port_mac:
-                    self.utils.port_down(physical_network, port_mac)
-                    return
+        if self.ports.get(port_mac) is not None:
+            applied = self.applied.get(port_mac)
+            state = PortState(physical_network,
+                              applied.vlan if applied else None, 'down',
+                              self.vnics.get(port_mac))
+            self._apply_state(
+                port_mac, state,
+                lambda: self.utils.port_down(physical_network, port_mac))
+            return
         LOG.info(_LI('Network %s is not available on this agent'), network_id)
 
     def port_up(self, network_id, network_type,
                 physical_network, seg_id, port_id, port_mac):
         """Sets port to up.
 
-        Update internal network map with port data.
+        Update internal port registry with port data.
         - Check if vnic defined
         - configure eswitch vport
         - set port to Up
         """
         LOG.debug("Connecting port %s", port_id)
 
-        if network_id not in self.network_map:
-            self.provision_network(port_id, port_mac,
-                                   network_id, network_type,
-                                   physical_network, seg_id)
-        net_map = self.network_map[network_id]
-        net_map['ports'].append({'port_id': port_id, 'port_mac': port_mac})
+        if not self.ports.has_network(network_id):
+            LOG.info(_LI("Provisioning network %s"), network_id)
+        self.ports.add(port_mac, port_id, network_id,
+                       Segment(network_type, physical_network, seg_id))
+
+        vlan = seg_id
+        if network_type == constants.TYPE_FLAT:
+            vlan = 0
+        state = PortState(physical_network, vlan, 'up',
+                          self.vnics.get(port_mac))
+        self._apply_state(port_mac, state, lambda: self._set_port_up(
+            network_type, physical_network, vlan, port_mac))
 
+    def _set_port_up(self, network_type, physical_network, vlan, port_mac):
         if network_type == constants.TYPE_VLAN:
             LOG.info(_LI('Binding Segmentation ID %(seg_id)s '
                          'to eSwitch for vNIC mac_address %(mac)s'),
-                     {'seg_id': seg_id,
+                     {'seg_id': vlan,
                       'mac': port_mac})
-            self.utils.set_port_vlan_id(physical_network,
-                                        seg_id,
-                                        port_mac)
-
         elif network_type == constants.TYPE_FLAT:
             LOG.info(_LI('Binding eSwitch for vNIC mac_address %(mac)s'
                          'to flat network'),
                      {'mac': port_mac})
-            seg_id = 0
 
         self.utils.set_port_vlan_id(physical_network,
-                                    seg_id,
+                                    vlan,
                                     port_mac)
 
         self.utils.port_up(physical_network, port_mac)
 
     def port_release(self, port_mac):
         """Clear port configuration from eSwitch."""
-        for network_id, net_data in six.iteritems(self.network_map):
-            for port in net_data['ports']:
-                if port['port_mac'] == port_mac:
-                    self.utils.port_release(net_data['physical_network'],
-                                            port['port_mac'])
-                    return
+        port = self.ports.remove(port_mac)
+        self.applied.pop(port_mac, None)
+        if port is not None:
+            self.utils.port_release(port.segment.physical_network, port_mac)
+            return
         LOG.info(_LI('Port_mac %s is not available on this agent'), port_mac)
 
-    def provision_network(self, port_id, port_mac,
-                          network_id, network_type,
-                          physical_network, segmentation_id):
-        LOG.info(_LI("Provisioning network %s"), network_id)
-        data = {
-            'physical_network': physical_network,
-            'network_type': network_type,
-            'ports': [],
-            'vlan_id': segmentation_id}
-        self.network_map[network_id] = data
-
 
 class MlnxEswitchRpcCallbacks(sg_rpc.SecurityGroupAgentRpcCallbackMixin):
 
@@ -194,6 +334,8 @@ class MlnxEswitchNeutronAgent(object):
             'start_flag': True}
         # Stores port update notifications for processing in main rpc loop
         self.updated_ports = set()
+        # Unset once the plugin is found not to support update_device_list
+        self.bulk_status_rpc = True
         self.context = context.get_admin_context_without_session()
         self.plugin_rpc = agent_rpc.PluginApi(topics.PLUGIN)
         self.sg_plugin_rpc = sg_rpc.SecurityGroupServerRpcApi(topics.PLUGIN)
@@ -204,7 +346,9 @@ class MlnxEswitchNeutronAgent(object):
     def _setup_eswitches(self, interface_mapping):
         daemon = cfg.CONF.ESWITCH.daemon_endpoint
         timeout = cfg.CONF.ESWITCH.request_timeout
-        self.eswitch = EswitchManager(interface_mapping, daemon, timeout)
+        events = cfg.CONF.ESWITCH.daemon_events_endpoint
+        self.eswitch = EswitchManager(interface_mapping, daemon, timeout,
+                                      events)
 
     def _report_state(self):
         try:
@@ -244,7 +388,8 @@ class MlnxEswitchNeutronAgent(object):
         self.updated_ports.add(port)
 
     def scan_ports(self, previous, sync):
-        cur_ports = self.eswitch.get_vnics_mac()
+        # The snapshot of this loop iteration, the ports handled read it
+        cur_ports = self.eswitch.get_vnics_mac(refresh=True)
         port_info = {'current': cur_ports}
         updated_ports = self.updated_ports
         self.updated_ports = set()
@@ -306,55 +451,116 @@ class MlnxEswitchNeutronAgent(object):
             # resync is needed
             return True
 
-        for dev_details in devs_details_list:
-            device = dev_details['device']
-            LOG.info(_LI("Adding or updating port with mac %s"), device)
-
-            if 'port_id' in dev_details:
-                LOG.info(_LI("Port %s updated"), device)
-                LOG.debug("Device details %s", str(dev_details))
-                self.treat_vif_port(dev_details['port_id'],
-                                    dev_details['device'],
-                                    dev_details['network_id'],
-                                    dev_details['network_type'],
-                                    dev_details['physical_network'],
-                                    dev_details['segmentation_id'],
-                                    dev_details['admin_state_up'])
-                if dev_details.get('admin_state_up'):
-                    LOG.debug("Setting status for %s to UP", device)
-                    self.plugin_rpc.update_device_up(
-                        self.context, device, self.agent_id)
-                else:
-                    LOG.debug("Setting status for %s to DOWN", device)
-                    self.plugin_rpc.update_device_down(
-                        self.context, device, self.agent_id)
-            else:
-                LOG.debug("Device with mac_address %s not defined "
-                          "on Neutron Plugin", device)
-        return False
+        devices_up = []
+        devices_down = []
+        with self.eswitch.batch():
+            for dev_details in devs_details_list:
+                device, admin_state_up = self._treat_device_details(
+                    dev_details)
+                if admin_state_up:
+                    devices_up.append(device)
+                elif admin_state_up is not None:
+                    devices_down.append(device)
+
+        # Report status only once the eswitch configuration is applied
+        return bool(self.update_devices_status(devices_up, devices_down))
+
+    def _treat_device_details(self, dev_details):
+        """Configure the port of a device.
+
+        Return the device and its admin state, None if the device is not
+        defined on the plugin.
+        """
+        device = dev_details['device']
+        LOG.info(_LI("Adding or updating port with mac %s"), device)
+
+        if 'port_id' not in dev_details:
+            LOG.debug("Device with mac_address %s not defined "
+                      "on Neutron Plugin", device)
+            return device, None
+        LOG.info(_LI("Port %s updated"), device)
+        LOG.debug("Device details %s", str(dev_details))
+        self.treat_vif_port(dev_details['port_id'],
+                            dev_details['device'],
+                            dev_details['network_id'],
+                            dev_details['network_type'],
+                            dev_details['physical_network'],
+                            dev_details['segmentation_id'],
+                            dev_details['admin_state_up'])
+        return device, bool(dev_details.get('admin_state_up'))
 
     def treat_devices_removed(self, devices):
         resync = False
+        ports = []
         for device in devices:
             LOG.info(_LI("Removing device with mac_address %s"), device)
             try:
-                port_id = self.eswitch.get_port_id_by_mac(device)
-                dev_details = self.plugin_rpc.update_device_down(self.context,
-                                                                 port_id,
-                                                                 self.agent_id,
-                                                                 cfg.CONF.host)
+                ports.append((device, self.eswitch.get_port_id_by_mac(device)))
             except Exception as e:
                 LOG.debug("Removing port failed for device %(device)s "
                           "due to %(exc)s", {'device': device, 'exc': e})
                 resync = True
-                continue
-            if dev_details['exists']:
+        failed = self.update_devices_status(
+            [], [port_id for device, port_id in ports])
+        with self.eswitch.batch():
+            for device, port_id in ports:
+                if port_id in failed:
+                    resync = True
+                    continue
                 LOG.info(_LI("Port %s updated."), device)
-            else:
-                LOG.debug("Device %s not defined on plugin", device)
-            self.eswitch.port_release(device)
+                self.eswitch.port_release(device)
         return resync
 
+    def update_devices_status(self, devices_up, devices_down):
+        """Report the status of devices to the plugin.
+
+        The devices are reported in one update_device_list RPC, or one RPC
+        per device if the plugin does not support it. Return the devices
+        whose status could not be updated.
+        """
+        if not devices_up and not devices_down:
+            return set()
+        LOG.debug("Setting status for %(up)s to UP and for %(down)s to "
+                  "DOWN", {'up': devices_up, 'down': devices_down})
+        if self.bulk_status_rpc:
+            try:
+                result = self.plugin_rpc.update_device_list(
+                    self.context, devices_up, devices_down, self.agent_id,
+                    cfg.CONF.host)
+                return (set(result.get('failed_devices_up', [])) |
+                        set(result.get('failed_devices_down', [])))
+            except oslo_messaging.UnsupportedVersion:
+                self._disable_bulk_status_rpc()
+            except oslo_messaging.RemoteError as e:
+                if e.exc_type not in ('NoSuchMethod', 'UnsupportedVersion'):
+                    LOG.warning(_LW("Failed to update devices status: %s"),
+                                e)
+                    return set(devices_up) | set(devices_down)
+                self._disable_bulk_status_rpc()
+            except Exception as e:
+                LOG.warning(_LW("Failed to update devices status: %s"), e)
+                return set(devices_up) | set(devices_down)
+
+        failed = set()
+        for devices, update in (
+                (devices_up, self.plugin_rpc.update_device_up),
+                (devices_down, self.plugin_rpc.update_device_down)):
+            for device in devices:
+                try:
+                    update(self.context, device, self.agent_id,
+                           cfg.CONF.host)
+                except Exception as e:
+                    LOG.debug("Failed to update status of device "
+                              "%(device)s due to %(exc)s",
+                              {'device': device, 'exc': e})
+                    failed.add(device)
+        return failed
+
+    def _disable_bulk_status_rpc(self):
+        LOG.warning(_LW("The plugin does not support update_device_list, "
+                        "reporting the status of devices one by one"))
+        self.bulk_status_rpc = False
+
     def _port_info_has_changes(self, port_info):
         return (port_info['added'] or
                 port_info['removed'] or
@@ -386,10 +592,13 @@ class MlnxEswitchNeutronAgent(object):
                 except Exception:
                     LOG.exception(_LE("Error in agent event loop"))
                     sync = True
-            # sleep till end of polling interval
+            # wait for eSwitchD events till end of polling interval
             elapsed = (time.time() - start)
             if (elapsed < self._polling_interval):
-                time.sleep(self._polling_interval - elapsed)
+                events = self.eswitch.wait_for_events(
+                    self._polling_interval - elapsed)
+                if events:
+                    LOG.debug("Woken up by %d eSwitchD events", len(events))
             else:
                 LOG.debug("Loop iteration exceeded interval "
                           "(%(polling_interval)s vs. %(elapsed)s)",
@@ -13,8 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import itertools
+import time
+
+import eventlet
+from eventlet import semaphore
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import encodeutils
 from oslo_utils import importutils
 import six
 
@@ -28,45 +35,99 @@ LOG = logging.getLogger(__name__)
 
 
 class EswitchUtils(object):
-    def __init__(self, daemon_endpoint, timeout):
+    def __init__(self, daemon_endpoint, timeout, events_endpoint=None):
         if not zmq:
             LOG.error(_LE("Failed to import eventlet.green.zmq. "
                           "Won't connect to eSwitchD - exiting..."))
             raise SystemExit(1)
         self.__conn = None
+        self.__events = None
         self.daemon = daemon_endpoint
+        self.events_endpoint = events_endpoint
         self.timeout = timeout
+        self._batch = None
+        self._request_ids = itertools.count(1)
+        # One request is outstanding at a time on the connection
+        self._lock = semaphore.Semaphore()
 
     @property
     def _conn(self):
         if self.__conn is None:
             context = zmq.Context()
-            socket = context.socket(zmq.REQ)
+            socket = context.socket(zmq.DEALER)
             socket.setsockopt(zmq.LINGER, 0)
             socket.connect(self.daemon)
             self.__conn = socket
-            self.poller = zmq.Poller()
-            self.poller.register(self._conn, zmq.POLLIN)
         return self.__conn
 
+    @property
+    def _events(self):
+        if self.__events is None and self.events_endpoint:
+            context = zmq.Context()
+            socket = context.socket(zmq.SUB)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.setsockopt(zmq.SUBSCRIBE, b'')
+            socket.connect(self.events_endpoint)
+            self.__events = socket
+        return self.__events
+
+    def wait_for_events(self, timeout):
+        """Wait up to timeout seconds for eSwitchD events.
+
+        Return the events received, an empty list if none was published
+        in time or no events end point is configured.
+        """
+        if self._events is None:
+            time.sleep(timeout)
+            return []
+        events = []
+        # The green socket recv() yields to other greenthreads while
+        # waiting, unlike poll() which blocks the hub
+        with eventlet.Timeout(timeout, False):
+            events.append(jsonutils.loads(self._events.recv()))
+        if not events:
+            return events
+        while True:
+            try:
+                msg = self._events.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            events.append(jsonutils.loads(msg))
+        return events
+
     @comm_utils.RetryDecorator(exceptions.RequestTimeout)
     def send_msg(self, msg):
-        self._conn.send(msg)
-
-        socks = dict(self.poller.poll(self.timeout))
-        if socks.get(self._conn) == zmq.POLLIN:
-            recv_msg = self._conn.recv()
-            response = self.parse_response_msg(recv_msg)
-            return response
-        else:
-            self._conn.setsockopt(zmq.LINGER, 0)
-            self._conn.close()
-            self.poller.unregister(self._conn)
-            self.__conn = None
-            raise exceptions.RequestTimeout()
+        """Send a request to eSwitchD and return its response.
+
+        Each request is tagged with an ID which eSwitchD sends back in the
+        reply envelope. Replies of requests which timed out are dropped
+        when they arrive late, so the connection is kept on timeouts.
+        """
+        with self._lock:
+            request_id = encodeutils.safe_encode(
+                six.text_type(next(self._request_ids)))
+            self._conn.send_multipart([request_id, b'',
+                                       encodeutils.safe_encode(msg)])
+            with eventlet.Timeout(self.timeout / 1000.0, False):
+                while True:
+                    frames = self._conn.recv_multipart()
+                    if frames[0] == request_id:
+                        return self.parse_response_msg(frames[-1])
+                    LOG.debug("Dropping reply of timed out request %s",
+                              frames[0])
+        raise exceptions.RequestTimeout()
+
+    def close(self):
+        """Close the connection to eSwitchD."""
+        conn, self.__conn = self.__conn, None
+        if conn is not None:
+            conn.close()
+            conn.context.term()
 
     def parse_response_msg(self, recv_msg):
-        msg = jsonutils.loads(recv_msg)
+        return self._parse_response(jsonutils.loads(recv_msg))
+
+    def _parse_response(self, msg):
         if msg['status'] == 'OK':
             if 'response' in msg:
                 return msg.get('response')
@@ -79,12 +140,64 @@ class EswitchUtils(object):
         LOG.error(error_msg)
         raise exceptions.OperationFailed(err_msg=error_msg)
 
+    def _send_request(self, request):
+        """Send a request changing the eswitch, or queue it in a batch."""
+        if self._batch is not None:
+            self._batch.append(request)
+            return
+        return self.send_msg(jsonutils.dumps(request))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Group the eswitch changes made in the context in one request.
+
+        Changes are sent to eSwitchD when the context exits, eSwitchD
+        applies changes of different VFs in parallel. Nested contexts
+        join the outer batch.
+        """
+        if self._batch is not None:
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+            requests = self._batch
+        finally:
+            self._batch = None
+        self.send_batch(requests)
+
+    def send_batch(self, requests):
+        if not requests:
+            return
+        LOG.debug("Sending batch of %d requests", len(requests))
+        msg = jsonutils.dumps({'action': 'batch', 'messages': requests})
+        response = self.send_msg(msg)
+        failed = 0
+        for result in response['results']:
+            try:
+                self._parse_response(result)
+            except exceptions.OperationFailed:
+                failed += 1
+        if failed:
+            error_msg = _LE("%(failed)s of %(total)s batched requests "
+                            "failed") % {'failed': failed,
+                                         'total': len(requests)}
+            raise exceptions.OperationFailed(err_msg=error_msg)
+
     def get_attached_vnics(self):
         LOG.debug("get_attached_vnics")
         msg = jsonutils.dumps({'action': 'get_vnics', 'fabric': '*'})
         vnics = self.send_msg(msg)
         return vnics
 
+    def get_attached_vnics_delta(self, since_generation, epoch):
+        LOG.debug("get_attached_vnics_delta since generation %s",
+                  since_generation)
+        msg = jsonutils.dumps({'action': 'get_vnics_delta', 'fabric': '*',
+                               'since_generation': since_generation,
+                               'epoch': epoch})
+        return self.send_msg(msg)
+
     def set_port_vlan_id(self, physical_network,
                          segmentation_id, port_mac):
         LOG.debug("Set Vlan  %(segmentation_id)s on Port %(port_mac)s "
@@ -92,11 +205,10 @@ class EswitchUtils(object):
                   {'port_mac': port_mac,
                    'segmentation_id': segmentation_id,
                    'physical_network': physical_network})
-        msg = jsonutils.dumps({'action': 'set_vlan',
-                               'fabric': physical_network,
-                               'port_mac': port_mac,
-                               'vlan': segmentation_id})
-        self.send_msg(msg)
+        self._send_request({'action': 'set_vlan',
+                            'fabric': physical_network,
+                            'port_mac': port_mac,
+                            'vlan': segmentation_id})
 
     def define_fabric_mappings(self, interface_mapping):
         for fabric, phy_interface in six.iteritems(interface_mapping):
@@ -111,29 +223,26 @@ class EswitchUtils(object):
     def port_up(self, fabric, port_mac):
         LOG.debug("Port Up for %(port_mac)s on fabric %(fabric)s",
                   {'port_mac': port_mac, 'fabric': fabric})
-        msg = jsonutils.dumps({'action': 'port_up',
-                               'fabric': fabric,
-                               'ref_by': 'mac_address',
-                               'mac': 'port_mac'})
-        self.send_msg(msg)
+        self._send_request({'action': 'port_up',
+                            'fabric': fabric,
+                            'ref_by': 'mac_address',
+                            'mac': port_mac})
 
     def port_down(self, fabric, port_mac):
         LOG.debug("Port Down for %(port_mac)s on fabric %(fabric)s",
                   {'port_mac': port_mac, 'fabric': fabric})
-        msg = jsonutils.dumps({'action': 'port_down',
-                               'fabric': fabric,
-                               'ref_by': 'mac_address',
-                               'mac': port_mac})
-        self.send_msg(msg)
+        self._send_request({'action': 'port_down',
+                            'fabric': fabric,
+                            'ref_by': 'mac_address',
+                            'mac': port_mac})
 
     def port_release(self, fabric, port_mac):
         LOG.debug("Port Release for %(port_mac)s on fabric %(fabric)s",
                   {'port_mac': port_mac, 'fabric': fabric})
-        msg = jsonutils.dumps({'action': 'port_release',
-                               'fabric': fabric,
-                               'ref_by': 'mac_address',
-                               'mac': port_mac})
-        self.send_msg(msg)
+        self._send_request({'action': 'port_release',
+                            'fabric': fabric,
+                            'ref_by': 'mac_address',
+                            'mac': port_mac})
 
     def get_eswitch_ports(self, fabric):
         # TODO(irena) - to implement for next phase
@@ -23,6 +23,7 @@ from neutron_lib.plugins import directory
 from neutron_lib.plugins.ml2 import api
 from oslo_config import cfg
 
+from networking_mlnx.common import ib_address
 from networking_mlnx.plugins.ml2.drivers.mlnx import config  # noqa
 
 AGENT_TYPE_MLNX = 'Mellanox plugin agent'
@@ -64,13 +65,7 @@ class MlnxMechanismDriver(mech_agent.SimpleAgentMechanismDriverBase):
                                 self.vif_details)
 
     def _gen_client_id(self, port):
-        _PREFIX = 'ff:00:00:00:00:00:02:00:00:02:c9:00:'
-        _MIDDLE = ':00:00:'
-        mac_address = port["mac_address"]
-        mac_first = mac_address[:8]
-        mac_last = mac_address[9:]
-        client_id = ''.join([_PREFIX, mac_first, _MIDDLE, mac_last])
-        return client_id
+        return ib_address.mac_to_client_id(port["mac_address"])
 
     def _gen_client_id_opt(self, port):
         client_id = self._gen_client_id(port)
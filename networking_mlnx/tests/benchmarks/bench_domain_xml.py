@@ -0,0 +1,92 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hostdev extraction time over a corpus of large domain XMLs.
+
+Compares evaluating an XPath expression compiled on each call, as the
+hostdev scan used to, with domain_utils.get_pci_hostdev_addresses:
+
+    python -m networking_mlnx.tests.benchmarks.bench_domain_xml \\
+        [num_domains] [disks_per_domain]
+"""
+
+import sys
+import time
+
+from lxml import etree
+import mock
+
+sys.modules.setdefault('ethtool', mock.Mock())
+
+from networking_mlnx.eswitchd.utils import domain_utils  # noqa
+from networking_mlnx.eswitchd.utils import pci_utils  # noqa
+
+DEFAULT_NUM_DOMAINS = 50
+DEFAULT_DISKS = 60
+VCPUS = 128
+
+DISK = ("<disk type='file' device='disk'>"
+        "<driver name='qemu' type='qcow2' cache='none'/>"
+        "<source file='/var/lib/nova/instances/%(uuid)s/disk.%(index)d'/>"
+        "<target dev='vd%(index)d' bus='virtio'/>"
+        "<address type='pci' domain='0x0000' bus='0x%(bus)02x' "
+        "slot='0x%(slot)02x' function='0x0'/></disk>")
+VCPUPIN = "<vcpupin vcpu='%(index)d' cpuset='%(index)d'/>"
+HOSTDEV = ("<hostdev mode='subsystem' type='pci' managed='yes'><source>"
+           "<address domain='0x0000' bus='0x03' slot='0x%(slot)02x' "
+           "function='0x%(function)x'/></source>"
+           "<address type='pci' domain='0x0000' bus='0x01' "
+           "slot='0x%(slot)02x' function='0x0'/></hostdev>")
+
+
+def make_domain_xml(index, num_disks):
+    uuid = 'vm-%d' % index
+    disks = ''.join(DISK % {'uuid': uuid, 'index': i, 'bus': i // 32,
+                            'slot': i % 32} for i in range(num_disks))
+    vcpupins = ''.join(VCPUPIN % {'index': i} for i in range(VCPUS))
+    hostdevs = ''.join(HOSTDEV % {'slot': index % 32, 'function': i}
+                       for i in range(index % 4))
+    return ("<domain type='kvm'><name>%s</name><uuid>%s</uuid>"
+            "<cputune>%s</cputune><devices>%s%s</devices></domain>" %
+            (uuid, uuid, vcpupins, disks, hostdevs))
+
+
+def parse_tree(raw_xml):
+    tree = etree.XML(raw_xml)
+    return tree.xpath("/domain/devices/hostdev[@type='pci']/source/address")
+
+
+def _timed(extract, corpus, utils):
+    start = time.time()
+    for raw_xml in corpus:
+        for address in extract(raw_xml):
+            utils.get_device_address(address)
+    return time.time() - start
+
+
+def main(argv):
+    num_domains = int(argv[1]) if len(argv) > 1 else DEFAULT_NUM_DOMAINS
+    num_disks = int(argv[2]) if len(argv) > 2 else DEFAULT_DISKS
+    corpus = [make_domain_xml(i, num_disks) for i in range(num_domains)]
+    utils = pci_utils.pciUtils()
+    uncompiled = _timed(parse_tree, corpus, utils)
+    compiled = _timed(domain_utils.get_pci_hostdev_addresses, corpus, utils)
+    print("%d domains, %d KiB XML each: xpath() %.1f ms, compiled XPath "
+          "%.1f ms" % (num_domains, len(corpus[0]) // 1024,
+                       uncompiled * 1000, compiled * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
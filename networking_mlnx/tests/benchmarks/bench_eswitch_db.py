@@ -0,0 +1,90 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory used by the eswitch tables of a PF with many VFs.
+
+Compares the port table and port policy records with the per VF dicts
+they replaced:
+
+    python -m networking_mlnx.tests.benchmarks.bench_eswitch_db [num_vfs]
+"""
+
+import sys
+import tracemalloc
+
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.db import eswitch_db
+
+DEFAULT_NUM_VFS = 1024
+
+
+def _vf(index):
+    return '0000:%02x:%02x.%x' % (index // 2048 + 3, index // 8 % 256,
+                                  index % 8)
+
+
+def _mac(index):
+    return '00:00:00:00:%02x:%02x' % (index // 256, index % 256)
+
+
+def build_records(num_vfs):
+    port_table = {}
+    port_policy = {}
+    for index in range(num_vfs):
+        vf = _vf(index)
+        port_table[vf] = eswitch_db.PortEntry(
+            constants.VIF_TYPE_HOSTDEV, vnic=_mac(index),
+            state=constants.VPORT_STATE_ATTACHED, device_id='vm')
+        port_policy[_mac(index)] = eswitch_db.VnicPolicy(
+            dev=vf, device_id='vm')
+    return port_table, port_policy
+
+
+def build_dicts(num_vfs):
+    port_table = {}
+    port_policy = {}
+    for index in range(num_vfs):
+        vf = _vf(index)
+        port_table[vf] = {'type': constants.VIF_TYPE_HOSTDEV,
+                          'vnic': _mac(index),
+                          'state': constants.VPORT_STATE_ATTACHED,
+                          'alias': None,
+                          'device_id': 'vm'}
+        port_policy[_mac(index)] = {'vlan': None,
+                                    'dev': vf,
+                                    'device_id': 'vm',
+                                    'port_id': None}
+    return port_table, port_policy
+
+
+def measure(build, num_vfs):
+    tracemalloc.start()
+    tables = build(num_vfs)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tables
+    return size
+
+
+def main(argv):
+    num_vfs = int(argv[1]) if len(argv) > 1 else DEFAULT_NUM_VFS
+    records = measure(build_records, num_vfs)
+    dicts = measure(build_dicts, num_vfs)
+    print("%d VFs: records %d KiB, dicts %d KiB (%.1fx)" % (
+        num_vfs, records // 1024, dicts // 1024, float(dicts) / records))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
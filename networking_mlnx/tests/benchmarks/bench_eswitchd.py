@@ -0,0 +1,124 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""eswitchd startup and port operations latency on a synthetic fabric.
+
+Runs the eswitchd handler on a generated sysfs tree and fake libvirt
+domains, half of the VFs being attached to domains at startup. Measures
+the handler startup, then plugs every free VF, sets its VLAN, lists the
+vNICs and deletes the ports:
+
+    python -m networking_mlnx.tests.benchmarks.bench_eswitchd \
+        [num_vfs,...] [mlnx4|mlnx5]
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+import mock
+
+sys.modules.setdefault('ethtool', mock.Mock())
+# The libvirt module used is replaced by fake_fabric.FakeLibvirt
+sys.modules.setdefault('libvirt', mock.Mock())
+
+from networking_mlnx.eswitchd.common import config  # noqa
+from networking_mlnx.eswitchd.common import constants  # noqa
+from networking_mlnx.eswitchd.eswitch_handler import eSwitchHandler  # noqa
+from networking_mlnx.tests import fake_fabric  # noqa
+
+DEFAULT_NUM_VFS = [8, 64, 512]
+DEVICE_TYPES = {'mlnx4': constants.MLNX4_VF_DEVICE_TYPE,
+                'mlnx5': constants.MLNX5_VF_DEVICE_TYPE}
+VFS_PER_DOMAIN = 4
+FABRIC = 'default'
+VLAN = 3
+
+
+def _mac(index):
+    return 'fa:16:3e:00:%02x:%02x' % (index // 256, index % 256)
+
+
+def _timed(operation, args_list):
+    """Return the latency of each call of operation, in seconds."""
+    latencies = []
+    for args in args_list:
+        start = time.time()
+        operation(*args)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def _report(name, latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return "%s %.2f/%.2f ms %d/s" % (
+        name, total * 1000 / len(latencies), p99 * 1000,
+        len(latencies) / total if total else 0)
+
+
+def run(num_vfs, device_type):
+    root = tempfile.mkdtemp()
+    fabric = fake_fabric.FakeFabric(root, num_vfs, device_type)
+    libvirt = fake_fabric.FakeLibvirt()
+    num_attached = num_vfs // 2
+    fabric.add_domains(libvirt, VFS_PER_DOMAIN,
+                       [_mac(i) for i in range(num_attached)])
+    stop = fake_fabric.patch_eswitchd(fabric, libvirt)
+    handler = None
+    try:
+        start = time.time()
+        handler = eSwitchHandler(fabric.get_fabrics())
+        startup = time.time() - start
+
+        free = [(vf, _mac(num_attached + i)) for i, vf in
+                enumerate(fabric.get_all_vfs()[num_attached:])]
+        plug = _timed(handler.plug_nic, [(FABRIC, 'device-id', mac, vf)
+                                         for vf, mac in free])
+        set_vlan = _timed(handler.set_vlan, [(FABRIC, mac, VLAN)
+                                             for vf, mac in free])
+        get_vnics = _timed(handler.get_vnics, [([FABRIC],)] * len(free))
+        delete = _timed(handler.delete_port, [(FABRIC, mac)
+                                              for vf, mac in free])
+        start = time.time()
+        for vf, mac in free:
+            handler.rebind_queue.wait(vf)
+        rebinds = time.time() - start
+    finally:
+        if handler is not None:
+            handler.sysfs_writer.stop()
+            handler.rebind_writers.stop()
+        stop()
+        shutil.rmtree(root)
+    print("%d VFs: startup %.1f ms, %s, %s, %s, %s, rebinds drained in "
+          "%.1f ms (mean/p99 latency, throughput)" % (
+              num_vfs, startup * 1000, _report('plug_nic', plug),
+              _report('set_vlan', set_vlan), _report('get_vnics', get_vnics),
+              _report('delete_port', delete), rebinds * 1000))
+
+
+def main(argv):
+    nums_vfs = DEFAULT_NUM_VFS
+    if len(argv) > 1:
+        nums_vfs = [int(num_vfs) for num_vfs in argv[1].split(',')]
+    device_type = DEVICE_TYPES[argv[2] if len(argv) > 2 else 'mlnx5']
+    for num_vfs in nums_vfs:
+        run(num_vfs, device_type)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
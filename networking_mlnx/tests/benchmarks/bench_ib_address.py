@@ -0,0 +1,77 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""MAC to GUID and client-id conversion throughput.
+
+Compares converting one MAC at a time with the ib_address bulk functions,
+with and without NumPy:
+
+    python -m networking_mlnx.tests.benchmarks.bench_ib_address [num_macs]
+"""
+
+import random
+import sys
+import time
+
+import mock
+
+from networking_mlnx.common import ib_address
+
+DEFAULT_NUM_MACS = 100000
+ROUNDS = 5
+
+
+def _timed(convert, macs):
+    best = None
+    for i in range(ROUNDS):
+        start = time.time()
+        convert(macs)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _one_by_one(convert):
+    return lambda macs: [convert(mac) for mac in macs]
+
+
+def main(argv):
+    num_macs = int(argv[1]) if len(argv) > 1 else DEFAULT_NUM_MACS
+    rand = random.Random(0)
+    macs = ['%02x:%02x:%02x:%02x:%02x:%02x' % tuple(
+        rand.randrange(256) for i in range(6)) for i in range(num_macs)]
+    guids = ib_address.macs_to_mlnx5_guids(macs)
+    conversions = [
+        ('mlnx4 GUID', ib_address.mac_to_mlnx4_guid,
+         ib_address.macs_to_mlnx4_guids, macs),
+        ('mlnx5 GUID', ib_address.mac_to_mlnx5_guid,
+         ib_address.macs_to_mlnx5_guids, macs),
+        ('client-id', ib_address.mac_to_client_id,
+         ib_address.macs_to_client_ids, macs),
+        ('mlnx5 MAC', ib_address.mlnx5_guid_to_mac,
+         ib_address.mlnx5_guids_to_macs, guids)]
+    for name, convert, bulk, items in conversions:
+        single = _timed(_one_by_one(convert), items)
+        with mock.patch.object(ib_address, 'numpy', None):
+            python = _timed(bulk, items)
+        line = ("%s, %d items: one by one %.1f ms, bulk %.1f ms" %
+                (name, num_macs, single * 1000, python * 1000))
+        if ib_address.numpy is not None:
+            line += ", bulk NumPy %.1f ms" % (_timed(bulk, items) * 1000)
+        print(line)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
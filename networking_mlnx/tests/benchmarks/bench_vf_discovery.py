@@ -0,0 +1,80 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""VF discovery time of eswitchd startup over a fake_fabric sysfs tree.
+
+Compares probing every PF twice in sequence, as startup used to, with
+probing every PF once in parallel:
+
+    python -m networking_mlnx.tests.benchmarks.bench_vf_discovery \\
+        [num_pfs] [vfs_per_pf]
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+import mock
+from oslo_config import cfg
+
+sys.modules.setdefault('ethtool', mock.Mock())
+sys.modules.setdefault('libvirt', mock.Mock())
+
+from networking_mlnx.eswitchd.common import config  # noqa
+from networking_mlnx.eswitchd.utils import helper_utils  # noqa
+from networking_mlnx.eswitchd.utils import pci_utils  # noqa
+from networking_mlnx.tests import fake_fabric  # noqa
+
+DEFAULT_NUM_PFS = 4
+DEFAULT_VFS_PER_PF = 127
+REPEAT = 5
+
+
+def _timed(func):
+    start = time.time()
+    for i in range(REPEAT):
+        func()
+    return (time.time() - start) / REPEAT
+
+
+def main(argv):
+    num_pfs = int(argv[1]) if len(argv) > 1 else DEFAULT_NUM_PFS
+    vfs_per_pf = int(argv[2]) if len(argv) > 2 else DEFAULT_VFS_PER_PF
+    root = tempfile.mkdtemp()
+    cfg.CONF.set_override('sysfs_root', root, 'DAEMON')
+    try:
+        fabric = fake_fabric.FakeFabric(root, vfs_per_pf, num_pfs=num_pfs)
+        pfs = fabric.pfs
+        utils = pci_utils.pciUtils()
+        # Fail rather than time the error path of a missing PF
+        for pf in pfs:
+            if len(utils.get_vfs_info(pf)) != vfs_per_pf:
+                raise Exception("VFs of %s not found under %s" % (pf, root))
+        sequential = _timed(
+            lambda: [utils.get_vfs_info(pf) for pf in pfs * 2])
+        parallel = _timed(
+            lambda: helper_utils.parallel_map(utils.get_vfs_info,
+                                              pfs, len(pfs)))
+    finally:
+        cfg.CONF.clear_override('sysfs_root', 'DAEMON')
+        shutil.rmtree(root)
+    print("%d PFs x %d VFs: sequential twice %.1f ms, parallel once "
+          "%.1f ms" % (num_pfs, vfs_per_pf, sequential * 1000,
+                       parallel * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
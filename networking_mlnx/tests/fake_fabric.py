@@ -0,0 +1,307 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A generated sysfs tree and libvirt domains for eswitchd.
+
+FakeFabric writes the sysfs files eswitchd reads and writes for Mellanox
+PFs and their VFs under a root directory, to be used as the DAEMON
+sysfs_root. FakeLibvirt stands in for the libvirt module with domains
+having VFs as PCI hostdevs. libvirt and ethtool must be importable, or
+mocked, before importing this module.
+"""
+
+import os
+import subprocess
+import sys
+
+import mock
+from oslo_config import cfg
+
+from networking_mlnx.common import ib_address
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd import resource_mngr
+from networking_mlnx.eswitchd.utils import netlink_utils
+from networking_mlnx.eswitchd.utils import pci_utils
+from networking_mlnx.eswitchd.utils import sysfs_writer
+
+MLNX4_DEVICE_ID = '0x1004'
+MLNX5_DEVICE_ID = '0x1016'
+HCA_PORT = 1
+# The pkey table of a port holds the default pkey, the partial management
+# pkey and a full membership pkey for each VLAN up to NUM_VLAN_PKEYS
+NUM_VLAN_PKEYS = 126
+
+HOSTDEV_XML = ("<hostdev mode='subsystem' type='pci' managed='yes'><source>"
+               "<address domain='0x%s' bus='0x%s' slot='0x%s' "
+               "function='0x%s'/></source></hostdev>")
+
+# The sysfs writer server, run without the root helper
+WRITER_CMD = [sys.executable, '-c',
+              'import sys; sys.argv = ["ebrctl", "write-sys-server"]; '
+              'from networking_mlnx.eswitchd.cli import ebrctl; '
+              'ebrctl.main()']
+
+
+def _pci_address(bus, index):
+    return '0000:%02x:%02x.%x' % (bus + index // 256, (index // 8) % 32,
+                                  index % 8)
+
+
+class FakeFabric(object):
+    """Mellanox PFs with num_vfs VFs each, under a sysfs root directory."""
+
+    def __init__(self, root, num_vfs,
+                 device_type=constants.MLNX5_VF_DEVICE_TYPE, num_pfs=1,
+                 fabric='default'):
+        self.root = root
+        self.device_type = device_type
+        self.fabric = fabric
+        self.pfs = ['ib%d' % i for i in range(num_pfs)]
+        # PF to its VF PCI addresses, in VF number order
+        self.vfs = {}
+        self.mlx_devs = {}
+        for index, pf in enumerate(self.pfs):
+            prefix = ('mlx4_%d' if device_type ==
+                      constants.MLNX4_VF_DEVICE_TYPE else 'mlx5_%d')
+            self.mlx_devs[pf] = prefix % index
+            self.vfs[pf] = [_pci_address(0x10 + 0x10 * index, vf_num)
+                            for vf_num in range(num_vfs)]
+        self._build()
+
+    def get_fabrics(self):
+        """Return the (fabric, PF) pairs given to eSwitchHandler."""
+        return [(self.fabric, pf) for pf in self.pfs]
+
+    def get_all_vfs(self):
+        return [vf for pf in self.pfs for vf in self.vfs[pf]]
+
+    def path(self, path):
+        """Return a /sys path in the fake tree."""
+        return self.root + path[len('/sys'):]
+
+    def read(self, path):
+        with open(self.path(path)) as fd:
+            return fd.read()
+
+    def _write(self, path, value):
+        path = self.path(path)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as fd:
+            fd.write(value)
+
+    def _build(self):
+        for pf in self.pfs:
+            self._build_pf(pf)
+        self._write(constants.UNBIND_PATH, '')
+        self._write(constants.BIND_PATH, '')
+
+    def _build_pf(self, pf):
+        mlx_dev = self.mlx_devs[pf]
+        interface = {'interface': pf}
+        eth_dev = pci_utils.pciUtils.ETH_DEV % interface
+        self._write(pci_utils.pciUtils.VENDOR_PATH % interface,
+                    constants.VENDOR + '\n')
+        self._write(pci_utils.pciUtils.ETH_PORT % interface,
+                    '0x%x\n' % (HCA_PORT - 1))
+        os.makedirs(self.path(os.path.join(
+            pci_utils.pciUtils.ETH_PATH % interface,
+            pci_utils.pciUtils.INFINIBAND_PATH, mlx_dev)))
+        if self.device_type == constants.MLNX4_VF_DEVICE_TYPE:
+            device_id = MLNX4_DEVICE_ID
+            self._build_mlnx4_pkeys(mlx_dev)
+        else:
+            device_id = MLNX5_DEVICE_ID
+        for vf_num, vf in enumerate(self.vfs[pf]):
+            # virtfn links are relative, their target name is the VF address
+            self._write(os.path.join(os.path.dirname(eth_dev), vf, 'device'),
+                        device_id + '\n')
+            os.symlink(os.path.join('..', vf),
+                       self.path(os.path.join(eth_dev, 'virtfn%d' % vf_num)))
+            if self.device_type == constants.MLNX4_VF_DEVICE_TYPE:
+                self._build_mlnx4_vf(mlx_dev, vf, vf_num)
+            else:
+                self._build_mlnx5_vf(mlx_dev, vf_num)
+
+    def _build_mlnx4_pkeys(self, mlx_dev):
+        pkeys = ['0xffff', '0x7fff'] + ['0x%04x' % (0x8000 | vlan) for vlan
+                                        in range(1, NUM_VLAN_PKEYS + 1)]
+        pkeys_path = constants.MLNX4_PKEYS_PATH % (mlx_dev, HCA_PORT)
+        for index, pkey in enumerate(pkeys):
+            self._write(os.path.join(pkeys_path, str(index)), pkey + '\n')
+        self._write(constants.MLNX4_ADMIN_GUID_PATH % (mlx_dev, HCA_PORT, 0),
+                    '0002c90300000001\n')
+
+    def _build_mlnx4_vf(self, mlx_dev, vf, vf_num):
+        # GUID index 0 is the PF one
+        guid_idx = vf_num + 1
+        self._write(constants.MLNX4_GUID_INDEX_PATH % (mlx_dev, vf, HCA_PORT),
+                    '%d\n' % guid_idx)
+        self._write(constants.MLNX4_ADMIN_GUID_PATH % (mlx_dev, HCA_PORT,
+                                                       guid_idx),
+                    constants.MLNX4_INVALID_GUID + '\n')
+        for pkey_idx in ('0', '1'):
+            self._write(constants.MLNX4_PKEY_INDEX_PATH % (
+                mlx_dev, vf, HCA_PORT, pkey_idx), 'none\n')
+
+    def _build_mlnx5_vf(self, mlx_dev, vf_num):
+        paths = {'module': mlx_dev, 'vf_num': vf_num}
+        self._write(constants.MLNX5_GUID_NODE_PATH % paths,
+                    constants.MLNX5_INVALID_GUID + '\n')
+        self._write(constants.MLNX5_GUID_PORT_PATH % paths,
+                    constants.MLNX5_INVALID_GUID + '\n')
+        self._write(constants.MLNX5_GUID_POLICY_PATH % paths, 'Down\n')
+
+    def set_vf_mac(self, pf, vf_num, mac):
+        """Set the GUID of a VF as if it had been plugged with mac."""
+        mlx_dev = self.mlx_devs[pf]
+        if self.device_type == constants.MLNX4_VF_DEVICE_TYPE:
+            self._write(constants.MLNX4_ADMIN_GUID_PATH % (
+                mlx_dev, HCA_PORT, vf_num + 1),
+                ib_address.mac_to_mlnx4_guid(mac) + '\n')
+        else:
+            paths = {'module': mlx_dev, 'vf_num': vf_num}
+            guid = ib_address.mac_to_mlnx5_guid(mac)
+            self._write(constants.MLNX5_GUID_NODE_PATH % paths, guid + '\n')
+            self._write(constants.MLNX5_GUID_PORT_PATH % paths, guid + '\n')
+            self._write(constants.MLNX5_GUID_POLICY_PATH % paths, 'Up\n')
+
+    def add_domains(self, libvirt, vfs_per_domain, macs):
+        """Attach VFs with the given MACs to domains of vfs_per_domain VFs.
+
+        The VFs are taken in order, the i-th gets macs[i]. Return the UUIDs
+        of the domains added.
+        """
+        vfs = [(pf, vf_num, vf) for pf in self.pfs
+               for vf_num, vf in enumerate(self.vfs[pf])][:len(macs)]
+        uuids = []
+        for start in range(0, len(vfs), vfs_per_domain):
+            uuid = '00000000-0000-0000-0000-%012x' % len(libvirt.domains)
+            domain_vfs = vfs[start:start + vfs_per_domain]
+            for offset, (pf, vf_num, vf) in enumerate(domain_vfs):
+                self.set_vf_mac(pf, vf_num, macs[start + offset])
+            libvirt.add_domain(uuid, [vf for pf, vf_num, vf in domain_vfs])
+            uuids.append(uuid)
+        return uuids
+
+    def get_vf_mac(self, pf, vf_num):
+        """Return the MAC of the GUID set on a VF."""
+        mlx_dev = self.mlx_devs[pf]
+        if self.device_type == constants.MLNX4_VF_DEVICE_TYPE:
+            guid = self.read(constants.MLNX4_ADMIN_GUID_PATH % (
+                mlx_dev, HCA_PORT, vf_num + 1))
+            return ib_address.mlnx4_guid_to_mac(guid.strip())
+        guid = self.read(constants.MLNX5_GUID_NODE_PATH % {
+            'module': mlx_dev, 'vf_num': vf_num})
+        return ib_address.mlnx5_guid_to_mac(guid.strip())
+
+
+class FakeLibvirtError(Exception):
+
+    def __init__(self, code=None):
+        super(FakeLibvirtError, self).__init__(code)
+        self.code = code
+
+    def get_error_code(self):
+        return self.code
+
+
+class FakeDomain(object):
+
+    def __init__(self, uuid, vfs):
+        self.uuid = uuid
+        self.vfs = list(vfs)
+
+    def UUIDString(self):
+        return self.uuid
+
+    def XMLDesc(self, flags):
+        hostdevs = []
+        for vf in self.vfs:
+            domain, bus, slot_function = vf.split(':')
+            slot, function = slot_function.split('.')
+            hostdevs.append(HOSTDEV_XML % (domain, bus, slot, function))
+        return ("<domain type='kvm'><uuid>%s</uuid><devices>%s</devices>"
+                "</domain>" % (self.uuid, ''.join(hostdevs)))
+
+
+class FakeConnection(object):
+
+    def __init__(self, libvirt):
+        self.libvirt = libvirt
+
+    def isAlive(self):
+        return True
+
+    def close(self):
+        pass
+
+    def listAllDomains(self, flags):
+        return list(self.libvirt.domains.values())
+
+    def lookupByUUIDString(self, uuid):
+        try:
+            return self.libvirt.domains[uuid]
+        except KeyError:
+            raise FakeLibvirtError(self.libvirt.VIR_ERR_NO_DOMAIN)
+
+
+class FakeLibvirt(object):
+    """Replaces the libvirt module, with domains using VFs as hostdevs."""
+
+    VIR_ERR_NO_DOMAIN = 42
+    libvirtError = FakeLibvirtError
+
+    def __init__(self):
+        # Domain UUID to FakeDomain
+        self.domains = {}
+
+    def openReadOnly(self, uri):
+        return FakeConnection(self)
+
+    def add_domain(self, uuid, vfs):
+        self.domains[uuid] = FakeDomain(uuid, vfs)
+
+    def remove_domain(self, uuid):
+        self.domains.pop(uuid, None)
+
+
+def patch_eswitchd(fabric, libvirt):
+    """Run eswitchd on a FakeFabric and FakeLibvirt.
+
+    Start the patches and return a function stopping them. The PFs are
+    IPoIB interfaces set up without netlink, the sysfs writes run in an
+    unprivileged write-sys-server.
+    """
+    cfg.CONF.set_override('sysfs_root', fabric.root, 'DAEMON')
+    patchers = [
+        mock.patch.object(resource_mngr, 'libvirt', libvirt),
+        mock.patch.object(pci_utils, 'ethtool',
+                          mock.Mock(**{'get_module.return_value':
+                                       'ib_ipoib'})),
+        mock.patch.object(netlink_utils.NetlinkClient, 'set_link_up'),
+        mock.patch.object(sysfs_writer.SysfsWriter, '_start',
+                          lambda self: subprocess.Popen(
+                              WRITER_CMD, stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE))]
+    for patcher in patchers:
+        patcher.start()
+
+    def stop():
+        for patcher in reversed(patchers):
+            patcher.stop()
+        cfg.CONF.clear_override('sysfs_root', 'DAEMON')
+    return stop
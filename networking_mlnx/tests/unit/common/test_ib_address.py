@@ -0,0 +1,176 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import mock
+import testtools
+
+from networking_mlnx.common import ib_address
+from networking_mlnx.tests import base
+
+CLIENT_ID_PREFIX = 'ff:00:00:00:00:00:02:00:00:02:c9:00:'
+
+
+# The string slicing the conversions replaced
+def sliced_mlnx4_guid(mac):
+    mac = mac.replace(':', '')
+    return mac[:6] + '0000' + mac[6:]
+
+
+def sliced_mlnx5_guid(mac):
+    return mac[:9] + '00:00:' + mac[9:]
+
+
+def sliced_client_id(mac):
+    return ''.join([CLIENT_ID_PREFIX, mac[:8], ':00:00:', mac[9:]])
+
+
+def sliced_mlnx4_mac(guid):
+    if guid == 'ffffffffffffffff':
+        return '00:00:00:00:00:00'
+    mac = guid[:6] + guid[-6:]
+    return ':'.join((mac[0:2], mac[2:4], mac[4:6],
+                     mac[6:8], mac[8:10], mac[10:12]))
+
+
+def sliced_mlnx5_mac(guid):
+    return guid[:8] + guid[-9:]
+
+
+def random_macs(count):
+    rand = random.Random(count)
+    return ['%02x:%02x:%02x:%02x:%02x:%02x' % tuple(
+        rand.randrange(256) for i in range(6)) for i in range(count)]
+
+
+class TestIbAddress(base.TestCase):
+
+    def test_mac_to_mlnx4_guid(self):
+        self.assertEqual('fa163e0000a1b2c3',
+                         ib_address.mac_to_mlnx4_guid('fa:16:3e:a1:b2:c3'))
+
+    def test_mac_to_mlnx5_guid(self):
+        self.assertEqual('fa:16:3e:00:00:a1:b2:c3',
+                         ib_address.mac_to_mlnx5_guid('fa:16:3e:a1:b2:c3'))
+
+    def test_mac_to_client_id(self):
+        self.assertEqual(CLIENT_ID_PREFIX + 'fa:16:3e:00:00:a1:b2:c3',
+                         ib_address.mac_to_client_id('fa:16:3e:a1:b2:c3'))
+
+    def test_mlnx4_guid_to_mac(self):
+        self.assertEqual('fa:16:3e:a1:b2:c3',
+                         ib_address.mlnx4_guid_to_mac('fa163e0000a1b2c3'))
+
+    def test_mlnx4_invalid_guid_to_mac(self):
+        self.assertEqual('00:00:00:00:00:00',
+                         ib_address.mlnx4_guid_to_mac('ffffffffffffffff'))
+
+    def test_mlnx5_guid_to_mac(self):
+        self.assertEqual('fa:16:3e:a1:b2:c3', ib_address.mlnx5_guid_to_mac(
+            'fa:16:3e:00:00:a1:b2:c3'))
+
+    def test_upper_case_mac(self):
+        self.assertEqual('FA163E0000A1B2C3',
+                         ib_address.mac_to_mlnx4_guid('FA:16:3E:A1:B2:C3'))
+        self.assertEqual(CLIENT_ID_PREFIX + 'FA:16:3E:00:00:A1:B2:C3',
+                         ib_address.mac_to_client_id('FA:16:3E:A1:B2:C3'))
+
+    def test_upper_case_guid(self):
+        self.assertEqual('FA:16:3E:A1:B2:C3', ib_address.mlnx5_guid_to_mac(
+            'FA:16:3E:00:00:A1:B2:C3'))
+
+    def test_invalid_mac(self):
+        self.assertRaises(ValueError, ib_address.mac_to_mlnx5_guid,
+                          'fa:16:3e:a1:b2:zz')
+
+    def test_too_long_guid(self):
+        self.assertRaises(ValueError, ib_address.mlnx4_guid_to_mac,
+                          'fa163e0000a1b2c3d4')
+
+
+class TestIbAddressBulk(base.TestCase):
+
+    def setUp(self):
+        super(TestIbAddressBulk, self).setUp()
+        self.macs = random_macs(300)
+        self.mlnx4_guids = [sliced_mlnx4_guid(mac) for mac in self.macs]
+        self.mlnx5_guids = [sliced_mlnx5_guid(mac) for mac in self.macs]
+
+    def _test_bulk_conversions(self):
+        self.assertEqual(self.mlnx4_guids,
+                         ib_address.macs_to_mlnx4_guids(self.macs))
+        self.assertEqual(self.mlnx5_guids,
+                         ib_address.macs_to_mlnx5_guids(self.macs))
+        self.assertEqual([sliced_client_id(mac) for mac in self.macs],
+                         ib_address.macs_to_client_ids(self.macs))
+        guids = self.mlnx4_guids + ['ffffffffffffffff']
+        self.assertEqual([sliced_mlnx4_mac(guid) for guid in guids],
+                         ib_address.mlnx4_guids_to_macs(guids))
+        self.assertEqual([sliced_mlnx5_mac(guid) for guid
+                          in self.mlnx5_guids],
+                         ib_address.mlnx5_guids_to_macs(self.mlnx5_guids))
+
+    def _test_invalid_item(self):
+        self.assertRaises(ValueError, ib_address.macs_to_mlnx4_guids,
+                          self.macs + ['fa:16:3e:a1:b2:zz'])
+        # Items of another form are converted one at a time
+        self.assertEqual('FA163E0000A1B2C3', ib_address.macs_to_mlnx4_guids(
+            self.macs + ['FA163EA1B2C3'])[-1])
+
+    def _test_malformed_guids(self):
+        bad = ['fa163e0000a1b2zz', 'fa163e0000a1b2c3d4', '']
+        guids = self.mlnx4_guids + bad
+        self.assertRaises(ValueError, ib_address.mlnx4_guids_to_macs, guids)
+        macs = ib_address.mlnx4_guids_to_macs(guids, invalid='invalid')
+        self.assertEqual(self.macs + ['invalid'] * len(bad), macs)
+        guids = self.mlnx5_guids[:-1] + ['fa:16:3e:00:00:a1:b2:zz']
+        macs = ib_address.mlnx5_guids_to_macs(guids, invalid='invalid')
+        self.assertEqual(self.macs[:-1] + ['invalid'], macs)
+
+    def test_bulk_conversions(self):
+        with mock.patch.object(ib_address, 'numpy', None):
+            self._test_bulk_conversions()
+
+    def test_invalid_item(self):
+        with mock.patch.object(ib_address, 'numpy', None):
+            self._test_invalid_item()
+
+    def test_malformed_guids(self):
+        with mock.patch.object(ib_address, 'numpy', None):
+            self._test_malformed_guids()
+
+    def test_empty(self):
+        self.assertEqual([], ib_address.macs_to_client_ids([]))
+
+    @testtools.skipIf(ib_address.numpy is None, 'numpy missing')
+    def test_bulk_conversions_numpy(self):
+        self._test_bulk_conversions()
+
+    @testtools.skipIf(ib_address.numpy is None, 'numpy missing')
+    def test_invalid_item_numpy(self):
+        self._test_invalid_item()
+
+    @testtools.skipIf(ib_address.numpy is None, 'numpy missing')
+    def test_malformed_guids_numpy(self):
+        self._test_malformed_guids()
+
+    @testtools.skipIf(ib_address.numpy is None, 'numpy missing')
+    def test_numpy_upper_case(self):
+        macs = [mac.upper() for mac in self.macs[:-1]] + self.macs[-1:]
+        self.assertEqual(
+            [guid.upper() for guid in self.mlnx5_guids[:-1]] +
+            self.mlnx5_guids[-1:],
+            ib_address.macs_to_mlnx5_guids(macs))
@@ -0,0 +1,59 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+import mock
+
+sys.modules['ethtool'] = mock.Mock()
+
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.db import device_db
+from networking_mlnx.eswitchd.utils import pci_utils
+from networking_mlnx.tests import base
+
+VF_1 = '0000:03:00.1'
+VF_2 = '0000:03:00.2'
+VF_3 = '0000:04:00.1'
+
+
+def _vf(vf_num):
+    return pci_utils.VfInfo(vf_num, constants.MLNX5_VF_DEVICE_TYPE)
+
+
+class TestDeviceDB(base.TestCase):
+
+    def setUp(self):
+        super(TestDeviceDB, self).setUp()
+        self.device_db = device_db.DeviceDB()
+        self.device_db.add_fabric('default', 'ib0', 1, 'mlx5_0')
+        self.device_db.set_fabric_devices('default', 'ib0',
+                                          {VF_1: _vf(0), VF_2: _vf(1)})
+        self.device_db.add_fabric('other', 'ib1', 1, 'mlx5_1')
+        self.device_db.set_fabric_devices('other', 'ib1', {VF_3: _vf(0)})
+
+    def test_get_dev_fabric(self):
+        self.assertEqual('default', self.device_db.get_dev_fabric(VF_2))
+        self.assertEqual('other', self.device_db.get_dev_fabric(VF_3))
+        self.assertIsNone(self.device_db.get_dev_fabric('0000:05:00.1'))
+
+    def test_get_dev_details(self):
+        self.assertEqual(('default', 'ib0', _vf(1)),
+                         self.device_db.get_dev_details(VF_2))
+
+    def test_set_fabric_devices_replaces_vfs(self):
+        self.device_db.set_fabric_devices('default', 'ib0', {VF_1: _vf(0)})
+        self.assertIsNone(self.device_db.get_dev_details(VF_2))
+        self.assertEqual('default', self.device_db.get_dev_fabric(VF_1))
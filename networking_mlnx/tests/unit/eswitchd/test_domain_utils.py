@@ -0,0 +1,68 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from networking_mlnx.eswitchd.utils import domain_utils
+from networking_mlnx.tests import base
+
+DOMAIN_XML = u"""<domain type='kvm' xmlns:nova="http://openstack.org/nova">
+  <uuid>vm-1</uuid>
+  <devices>
+    <disk type='file' device='disk'>
+      <source file='/var/lib/nova/instances/vm-1/disk'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x04'
+               function='0x0'/>
+    </disk>
+    <hostdev mode='subsystem' type='usb'>
+      <source>
+        <address bus='1' device='2'/>
+      </source>
+    </hostdev>
+    <hostdev mode='subsystem' type='pci' managed='yes'>
+      <source>
+        <address domain='0x0000' bus='0x03' slot='0x00' function='0x1'/>
+      </source>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x05'
+               function='0x0'/>
+    </hostdev>
+    %s
+  </devices>
+</domain>"""
+
+
+class TestDomainUtils(base.TestCase):
+
+    def _functions(self, raw_xml):
+        return [address.get('function') for address
+                in domain_utils.get_pci_hostdev_addresses(raw_xml)]
+
+    def test_get_pci_hostdev_addresses(self):
+        self.assertEqual(['0x1'], self._functions(DOMAIN_XML % ''))
+
+    def test_no_hostdevs(self):
+        self.assertEqual([], self._functions(
+            u"<domain><uuid>vm-1</uuid><devices/></domain>"))
+
+    def test_namespaced_hostdev(self):
+        hostdev = (u"<hostdev mode='subsystem' type='pci'><nova:port/>"
+                   u"<source><address domain='0x0000' bus='0x03' "
+                   u"slot='0x00' function='0x2'/></source></hostdev>")
+        self.assertEqual(['0x1', '0x2'],
+                         self._functions(DOMAIN_XML % hostdev))
+
+    def test_commented_out_hostdev(self):
+        hostdev = (u"<!-- <hostdev mode='subsystem' type='pci'><source>"
+                   u"<address domain='0x0000' bus='0x03' slot='0x00' "
+                   u"function='0x2'/></source></hostdev> -->")
+        self.assertEqual(['0x1'], self._functions(DOMAIN_XML % hostdev))
@@ -0,0 +1,104 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.db import eswitch_db
+from networking_mlnx.tests import base
+
+VF_1 = '0000:03:00.1'
+VF_2 = '0000:03:00.2'
+MAC_1 = '00:00:00:00:00:01'
+MAC_2 = '00:00:00:00:00:02'
+
+
+class TestESwitchDB(base.TestCase):
+
+    def setUp(self):
+        super(TestESwitchDB, self).setUp()
+        self.eswitch = eswitch_db.eSwitchDB(pf='ib0', vfs=[VF_1, VF_2])
+        for vf in (VF_1, VF_2):
+            self.eswitch.create_port(vf, constants.VIF_TYPE_HOSTDEV)
+
+    def _attach(self, vf, mac, device_id='vm-1'):
+        self.eswitch.attach_vnic(port_name=vf, device_id=device_id,
+                                 vnic_mac=mac)
+        self.eswitch.plug_nic(vf)
+
+    def test_attached_vnics(self):
+        self._attach(VF_1, MAC_1)
+        self.assertEqual({MAC_1: {'mac': MAC_1, 'device_id': 'vm-1'}},
+                         self.eswitch.get_attached_vnics())
+        self.eswitch.detach_vnic(MAC_1)
+        self.assertEqual({}, self.eswitch.get_attached_vnics())
+
+    def test_port_table_matrix(self):
+        self._attach(VF_1, MAC_1)
+        self.eswitch.set_vlan(MAC_1, 3)
+        self.assertIn([VF_1, constants.VIF_TYPE_HOSTDEV, MAC_1,
+                       constants.VPORT_STATE_ATTACHED, None, 'vm-1'],
+                      self.eswitch.get_port_table_matrix())
+        self.assertEqual([['VNIC_MAC', 'VLAN', 'DEV', 'DEVICE_ID'],
+                          [MAC_1, 3, VF_1, 'vm-1']],
+                         self.eswitch.get_port_policy_matrix())
+
+    def test_vnic_index(self):
+        self._attach(VF_1, MAC_1)
+        self.assertTrue(self.eswitch.is_vnic_attached(MAC_1))
+        self.assertEqual(VF_1, self.eswitch.get_port_for_vnic(MAC_1))
+        self.eswitch.detach_vnic(MAC_1)
+        self.assertFalse(self.eswitch.is_vnic_attached(MAC_1))
+        self.assertIsNone(self.eswitch.get_port_for_vnic(MAC_1))
+
+    def test_vnic_index_replaced_vnic(self):
+        self._attach(VF_1, MAC_1)
+        self._attach(VF_1, MAC_2)
+        self.assertFalse(self.eswitch.is_vnic_attached(MAC_1))
+        self.assertIsNone(self.eswitch.get_port_for_vnic(MAC_1))
+        self.assertEqual({MAC_2: {'mac': MAC_2, 'device_id': 'vm-1'}},
+                         self.eswitch.get_attached_vnics())
+
+    def test_generation_increases_on_changes(self):
+        self.assertEqual(0, self.eswitch.generation)
+        self._attach(VF_1, MAC_1)
+        generation = self.eswitch.generation
+        self.assertGreater(generation, 0)
+        self.eswitch.set_vlan(MAC_1, 3)
+        self.assertEqual(generation, self.eswitch.generation)
+        self.eswitch.detach_vnic(MAC_1)
+        self.assertGreater(self.eswitch.generation, generation)
+
+    def test_get_vnic_changes(self):
+        self._attach(VF_1, MAC_1)
+        generation = self.eswitch.generation
+        self._attach(VF_2, MAC_2)
+        self.assertEqual(set([MAC_1, MAC_2]),
+                         self.eswitch.get_vnic_changes(0))
+        self.assertEqual(set([MAC_2]),
+                         self.eswitch.get_vnic_changes(generation))
+        self.assertEqual(set(), self.eswitch.get_vnic_changes(
+            self.eswitch.generation))
+
+    def test_get_vnic_changes_too_old(self):
+        # Attaching a vNIC is recorded twice (attach and plug)
+        with mock.patch.object(eswitch_db, 'MAX_VNIC_CHANGES', 4):
+            self.eswitch = eswitch_db.eSwitchDB(pf='ib0', vfs=[VF_1])
+        self.eswitch.create_port(VF_1, constants.VIF_TYPE_HOSTDEV)
+        self._attach(VF_1, MAC_1)
+        self.eswitch.detach_vnic(MAC_1)
+        self.assertIsNotNone(self.eswitch.get_vnic_changes(0))
+        self._attach(VF_1, MAC_2)
+        self.assertIsNone(self.eswitch.get_vnic_changes(0))
@@ -0,0 +1,242 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import sys
+
+import mock
+
+sys.modules['ethtool'] = mock.Mock()
+sys.modules['libvirt'] = mock.Mock()
+
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.common import exceptions
+from networking_mlnx.eswitchd.db import eswitch_db
+from networking_mlnx.eswitchd import eswitch_handler
+from networking_mlnx.eswitchd.utils import pci_utils
+from networking_mlnx.tests import base
+
+VF_1 = '0000:03:00.1'
+VF_2 = '0000:03:00.2'
+MAC_1 = '00:00:00:00:00:01'
+MAC_2 = '00:00:00:00:00:02'
+
+
+class TestESwitchHandler(base.TestCase):
+
+    def setUp(self):
+        super(TestESwitchHandler, self).setUp()
+        self.handler = eswitch_handler.eSwitchHandler()
+        self.eswitch = eswitch_db.eSwitchDB(
+            pf='ib0', vfs=[VF_1, VF_2], generations=self.handler.generations,
+            listener=self.handler._vnic_changed)
+        for vf in (VF_1, VF_2):
+            self.eswitch.create_port(vf, constants.VIF_TYPE_HOSTDEV)
+        self.handler.eswitches['default'] = [self.eswitch]
+
+    def _attach(self, vf, mac):
+        self.eswitch.attach_vnic(port_name=vf, device_id='vm-1',
+                                 vnic_mac=mac)
+        self.eswitch.plug_nic(vf)
+
+    def _get_delta(self, since_generation, epoch):
+        return self.handler.get_vnics_delta(['default'], since_generation,
+                                            epoch)
+
+    def test_vnic_eswitch_index(self):
+        self._attach(VF_1, MAC_1)
+        self.assertIs(self.eswitch,
+                      self.handler._get_eswitch_for_vnic('default', MAC_1))
+        self.assertIsNone(
+            self.handler._get_eswitch_for_vnic('other', MAC_1))
+        self.eswitch.detach_vnic(MAC_1)
+        self.assertIsNone(
+            self.handler._get_eswitch_for_vnic('default', MAC_1))
+
+    def test_set_vlan_unknown_vnic(self):
+        self.assertFalse(self.handler.set_vlan('default', MAC_1, 3))
+        self.assertFalse(self.eswitch.vnic_exists(MAC_1))
+
+    def test_set_vlan(self):
+        self._attach(VF_1, MAC_1)
+        with mock.patch.object(self.handler, '_config_vlan_ib') as config:
+            self.assertTrue(self.handler.set_vlan('default', MAC_1, 3))
+            config.assert_called_once_with('default', VF_1, 3)
+
+    def test_config_vlan_ib_mlnx4_default_pkey(self):
+        self.handler.pkey_cache = mock.Mock()
+        self.handler.pkey_cache.get_pkey_idx.return_value = '0'
+        with mock.patch.object(self.handler, '_config_vf_pkey') as config:
+            self.handler._config_vlan_ib_mlnx4(0, 'mlx4_0', VF_1, 1)
+        self.handler.pkey_cache.get_pkey_idx.assert_called_once_with(
+            0xffff, 'mlx4_0', 1)
+        config.assert_called_once_with(
+            '0', eswitch_handler.DEFAULT_PKEY_IDX, 'mlx4_0', VF_1, 1)
+
+    def test_config_vlan_ib_mlnx4_missing_default_pkey(self):
+        self.handler.pkey_cache = mock.Mock()
+        self.handler.pkey_cache.get_pkey_idx.return_value = None
+        with mock.patch.object(self.handler, '_config_vf_pkey') as config:
+            self.handler._config_vlan_ib_mlnx4(0, 'mlx4_0', VF_1, 1)
+        self.assertFalse(config.called)
+
+    def test_add_fabrics_probes_pf_once(self):
+        handler = eswitch_handler.eSwitchHandler()
+        handler.pci_utils = mock.Mock()
+        handler.pci_utils.get_vfs_info.side_effect = (
+            lambda pf: {pf + '-vf': pci_utils.VfInfo(
+                '0', constants.MLNX5_VF_DEVICE_TYPE)})
+        handler.rm = mock.Mock()
+        handler.rm.scan_attached_devices.return_value = ([], {})
+        handler.rm.get_fabric_details.return_value = {'vfs': {}}
+        with mock.patch.object(handler, '_config_port_up'):
+            handler.add_fabrics([('default', 'ib0'), ('other', 'ib1')])
+        self.assertEqual(2, handler.pci_utils.get_vfs_info.call_count)
+        handler.rm.add_fabric.assert_has_calls(
+            [mock.call('default', 'ib0', {'ib0-vf': mock.ANY}),
+             mock.call('other', 'ib1', {'ib1-vf': mock.ANY})])
+        self.assertEqual(['ib1-vf'], list(handler.eswitches['other'][0].vfs))
+
+    def test_sync_domain(self):
+        self.handler.rm = mock.Mock()
+        self.handler.rm.get_fabric_for_dev.return_value = 'default'
+        self.handler.rm.scan_domain.return_value = [(VF_1, MAC_1, 'default')]
+        self.handler.sync_domain('vm-1')
+        self.assertTrue(self.eswitch.is_vnic_attached(MAC_1))
+        self.assertEqual({'vm-1': set([(VF_1, MAC_1, 'default')])},
+                         self.handler.domain_devices)
+
+        self.handler.rm.scan_domain.return_value = [(VF_2, MAC_2, 'default')]
+        self.handler.sync_domain('vm-1')
+        self.assertFalse(self.eswitch.is_vnic_attached(MAC_1))
+        self.assertTrue(self.eswitch.is_vnic_attached(MAC_2))
+        self.assertEqual(set([(VF_2, MAC_2, 'default')]),
+                         self.handler.devices)
+
+        self.handler.rm.scan_domain.return_value = []
+        self.handler.sync_domain('vm-1')
+        self.assertEqual({}, self.eswitch.get_attached_vnics())
+        self.assertEqual({}, self.handler.domain_devices)
+
+    def _mlnx5_fabric_details(self):
+        return {'pf_mlx_dev': 'mlx5_0',
+                'vfs': {VF_1: pci_utils.VfInfo(
+                    '1', constants.MLNX5_VF_DEVICE_TYPE)}}
+
+    def test_config_vf_mac_address_mlnx5_deferred_rebind(self):
+        self.handler.sysfs_writer = mock.Mock()
+        self.handler.sysfs_writer.write_sys.return_value = True
+        self.handler.rebind_queue = mock.Mock()
+        self.handler.rm = mock.Mock()
+        pf_fabric_details = self._mlnx5_fabric_details()
+        self.handler._config_vf_mac_address_mlnx5(
+            constants.MLNX5_INVALID_GUID, VF_1, pf_fabric_details)
+        self.handler.sysfs_writer.write_sys.assert_called_once_with(
+            mock.ANY)
+        writes = self.handler.sysfs_writer.write_sys.call_args[0][0]
+        self.assertEqual([constants.MLNX5_INVALID_GUID,
+                          constants.MLNX5_INVALID_GUID, 'Down\n'],
+                         [value for path, value in writes])
+        self.handler.rebind_queue.schedule.assert_called_once_with(VF_1)
+        self.handler.rm.set_vf_guid.assert_called_once_with(
+            pf_fabric_details, '1', constants.MLNX5_INVALID_GUID)
+
+    def test_config_vf_mac_address_mlnx5_detached(self):
+        self.handler.sysfs_writer = mock.Mock()
+        self.handler.sysfs_writer.write_sys.return_value = False
+        self.handler.rebind_queue = mock.Mock()
+        self.handler.rm = mock.Mock()
+        self.handler._config_vf_mac_address_mlnx5(
+            constants.MLNX5_INVALID_GUID, VF_1, self._mlnx5_fabric_details())
+        self.assertFalse(self.handler.rebind_queue.schedule.called)
+
+    def test_rebind_vf(self):
+        self.handler.sysfs_writer = mock.Mock()
+        self.handler.rebind_writers = mock.Mock()
+        self.handler._rebind_vf(VF_1)
+        self.assertFalse(self.handler.sysfs_writer.write_sys.called)
+        writer = self.handler.rebind_writers.get.return_value
+        writer.write_sys.assert_called_once_with(
+            [], [(constants.UNBIND_PATH, VF_1), (constants.BIND_PATH, VF_1)])
+
+    def test_config_port_up(self):
+        self.handler.pci_utils = mock.Mock()
+        with mock.patch.object(eswitch_handler.command_utils,
+                               'execute') as execute:
+            self.handler._config_port_up('ib0')
+        self.handler.pci_utils.netlink.set_link_up.assert_called_once_with(
+            'ib0')
+        self.assertFalse(execute.called)
+
+    def test_config_port_up_not_permitted(self):
+        self.handler.pci_utils = mock.Mock()
+        self.handler.pci_utils.netlink.set_link_up.side_effect = (
+            exceptions.NetlinkError('Operation not permitted', errno.EPERM))
+        with mock.patch.object(eswitch_handler.command_utils,
+                               'execute') as execute:
+            self.handler._config_port_up('ib0')
+        execute.assert_called_once_with('ip', 'link', 'set', 'ib0', 'up')
+
+    def test_plug_nic_waits_for_rebind(self):
+        calls = []
+        self.handler.rebind_queue = mock.Mock()
+        self.handler.rebind_queue.wait.side_effect = (
+            lambda dev: calls.append(('wait', dev)))
+        with mock.patch.object(
+                self.handler, '_config_vf_mac_address',
+                side_effect=lambda fabric, dev, mac: calls.append(
+                    ('config', dev))):
+            self.handler.plug_nic('default', 'vm-1', MAC_1, VF_1)
+        self.assertEqual([('wait', VF_1), ('config', VF_1)], calls)
+
+    def test_get_vnics_delta_full_for_unknown_epoch(self):
+        self._attach(VF_1, MAC_1)
+        delta = self._get_delta(0, None)
+        self.assertTrue(delta['full'])
+        self.assertEqual(self.handler.epoch, delta['epoch'])
+        self.assertEqual([MAC_1], list(delta['added']))
+
+    def test_get_vnics_delta(self):
+        self._attach(VF_1, MAC_1)
+        delta = self._get_delta(0, None)
+        self._attach(VF_2, MAC_2)
+        self.eswitch.detach_vnic(MAC_1)
+        delta = self._get_delta(delta['generation'], delta['epoch'])
+        self.assertFalse(delta['full'])
+        self.assertEqual([MAC_2], list(delta['added']))
+        self.assertEqual([MAC_1], delta['removed'])
+
+    def test_get_vnics_delta_no_changes(self):
+        self._attach(VF_1, MAC_1)
+        delta = self._get_delta(0, None)
+        delta = self._get_delta(delta['generation'], delta['epoch'])
+        self.assertFalse(delta['full'])
+        self.assertEqual({}, delta['added'])
+        self.assertEqual([], delta['removed'])
+
+    def test_get_vnics_delta_full_for_future_generation(self):
+        delta = self._get_delta(100, self.handler.epoch)
+        self.assertTrue(delta['full'])
+
+    def test_vnic_listener_notified(self):
+        listener = mock.Mock()
+        self.handler.set_vnic_listener(listener)
+        self._attach(VF_1, MAC_1)
+        event = listener.call_args[0][0]
+        self.assertEqual(constants.VNIC_CHANGED_EVENT, event['event'])
+        self.assertEqual(MAC_1, event['mac'])
+        self.assertEqual(VF_1, event['dev'])
+        self.assertEqual(constants.VPORT_STATE_ATTACHED, event['state'])
+        self.assertEqual(self.eswitch.generation, event['generation'])
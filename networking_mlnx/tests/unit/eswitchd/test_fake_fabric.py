@@ -0,0 +1,115 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import sys
+import tempfile
+
+import mock
+from oslo_config import cfg
+
+sys.modules['ethtool'] = mock.Mock()
+sys.modules['libvirt'] = mock.Mock()
+
+from networking_mlnx.eswitchd.common import config  # noqa
+from networking_mlnx.eswitchd.common import constants  # noqa
+from networking_mlnx.eswitchd.eswitch_handler import eSwitchHandler  # noqa
+from networking_mlnx.eswitchd.utils import helper_utils  # noqa
+from networking_mlnx.tests import base  # noqa
+from networking_mlnx.tests import fake_fabric  # noqa
+
+MAC = 'fa:16:3e:00:00:01'
+ATTACHED_MAC = 'fa:16:3e:00:00:02'
+
+
+class TestSysfsPath(base.TestCase):
+
+    def test_default_root(self):
+        self.assertEqual('/sys/class/net/ib0',
+                         helper_utils.sysfs_path('/sys/class/net/ib0'))
+
+    def test_root(self):
+        cfg.CONF.set_override('sysfs_root', '/tmp/fake', 'DAEMON')
+        self.addCleanup(cfg.CONF.clear_override, 'sysfs_root', 'DAEMON')
+        self.assertEqual('/tmp/fake/class/net/ib0',
+                         helper_utils.sysfs_path('/sys/class/net/ib0'))
+        self.assertEqual('/system', helper_utils.sysfs_path('/system'))
+
+
+class FakeFabricTestMixin(object):
+
+    device_type = None
+    # The MAC of the invalid GUID set on detached VFs
+    detached_mac = None
+
+    def setUp(self):
+        super(FakeFabricTestMixin, self).setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.fabric = fake_fabric.FakeFabric(root, 4, self.device_type)
+        self.libvirt = fake_fabric.FakeLibvirt()
+        self.fabric.add_domains(self.libvirt, 1, [ATTACHED_MAC])
+        self.addCleanup(fake_fabric.patch_eswitchd(self.fabric,
+                                                   self.libvirt))
+        self.handler = eSwitchHandler(self.fabric.get_fabrics())
+        self.addCleanup(self.handler.sysfs_writer.stop)
+        self.addCleanup(self.handler.rebind_writers.stop)
+        self.vfs = self.fabric.vfs['ib0']
+
+    def test_startup(self):
+        self.assertEqual(set(self.vfs),
+                         set(self.handler.eswitches['default'][0].port_table))
+        self.assertEqual(self.vfs[0], self.handler.get_dev_for_vnic(
+            'default', ATTACHED_MAC))
+
+    def test_plug_and_delete(self):
+        self.handler.plug_nic('default', 'device-id', MAC, self.vfs[1])
+        self.assertEqual(MAC, self.fabric.get_vf_mac('ib0', 1))
+        self.assertIn(MAC, self.handler.get_vnics(['default']))
+        self.assertEqual(self.vfs[1],
+                         self.handler.delete_port('default', MAC))
+        self.handler.rebind_queue.wait(self.vfs[1])
+        self.assertEqual(self.detached_mac, self.fabric.get_vf_mac('ib0', 1))
+        self.assertNotIn(MAC, self.handler.get_vnics(['default']))
+
+
+class TestFakeFabricMlnx4(FakeFabricTestMixin, base.TestCase):
+
+    device_type = constants.MLNX4_VF_DEVICE_TYPE
+    detached_mac = '00:00:00:00:00:00'
+
+    def test_set_vlan(self):
+        self.handler.plug_nic('default', 'device-id', MAC, self.vfs[1])
+        self.assertTrue(self.handler.set_vlan('default', MAC, 3))
+        pkey_path = constants.MLNX4_PKEY_INDEX_PATH % (
+            'mlx4_0', self.vfs[1], fake_fabric.HCA_PORT, '0')
+        # The VLAN 3 pkey follows the default and management pkeys
+        self.assertEqual('4', self.fabric.read(pkey_path).strip())
+
+
+class TestFakeFabricMlnx5(FakeFabricTestMixin, base.TestCase):
+
+    device_type = constants.MLNX5_VF_DEVICE_TYPE
+    detached_mac = 'ff:ff:ff:ff:ff:ff'
+
+    def test_delete_rebinds(self):
+        self.handler.plug_nic('default', 'device-id', MAC, self.vfs[1])
+        self.handler.delete_port('default', MAC)
+        self.handler.rebind_queue.wait(self.vfs[1])
+        self.assertEqual(self.vfs[1],
+                         self.fabric.read(constants.BIND_PATH).strip())
+        self.assertEqual('Down', self.fabric.read(
+            constants.MLNX5_GUID_POLICY_PATH % {
+                'module': 'mlx5_0', 'vf_num': 1}).strip())
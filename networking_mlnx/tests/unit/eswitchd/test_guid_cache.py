@@ -0,0 +1,85 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+import mock
+
+sys.modules['ethtool'] = mock.Mock()
+
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.db import guid_cache
+from networking_mlnx.eswitchd.utils import pci_utils
+from networking_mlnx.tests import base
+
+PF_DETAILS = {'pf_mlx_dev': 'mlx5_0', 'hca_port': 1,
+              'pf_device_type': constants.MLNX5_VF_DEVICE_TYPE}
+FABRIC_DETAILS = {'ib0': PF_DETAILS}
+
+
+class TestGuidCache(base.TestCase):
+
+    def setUp(self):
+        super(TestGuidCache, self).setUp()
+        self.pci_utils = pci_utils.pciUtils()
+        read_p = mock.patch.object(
+            self.pci_utils, 'get_pf_vfs_macs_ib',
+            return_value={'0': '00:00:00:00:00:01'})
+        self.read = read_p.start()
+        self.cache = guid_cache.GuidCache(self.pci_utils)
+
+    def test_read_once(self):
+        self.assertEqual({'0': '00:00:00:00:00:01'},
+                         self.cache.get_vfs_macs(FABRIC_DETAILS))
+        self.cache.get_vfs_macs(FABRIC_DETAILS)
+        self.read.assert_called_once_with(PF_DETAILS)
+
+    def test_updated_from_writes(self):
+        self.cache.get_vfs_macs(FABRIC_DETAILS)
+        self.cache.set_vf_guid(PF_DETAILS, '1', '00:00:00:00:00:00:00:02')
+        self.assertEqual({'0': '00:00:00:00:00:01',
+                          '1': '00:00:00:00:00:02'},
+                         self.cache.get_vfs_macs(FABRIC_DETAILS))
+        self.assertEqual(1, self.read.call_count)
+
+    def test_refresh(self):
+        self.cache.get_vfs_macs(FABRIC_DETAILS)
+        self.cache.refresh()
+        self.cache.get_vfs_macs(FABRIC_DETAILS)
+        self.assertEqual(2, self.read.call_count)
+
+    def test_read_racing_write_not_kept(self):
+        def read(pf_fabric_details):
+            # The GUID is written after the read got the old one
+            self.cache.set_vf_guid(PF_DETAILS, '0', '00:00:00:00:00:00:00:02')
+            return {'0': '00:00:00:00:00:01'}
+
+        self.read.side_effect = read
+        self.cache.get_vfs_macs(FABRIC_DETAILS)
+        self.read.side_effect = None
+        self.read.return_value = {'0': '00:00:00:00:00:02'}
+        self.assertEqual({'0': '00:00:00:00:00:02'},
+                         self.cache.get_vfs_macs(FABRIC_DETAILS))
+        self.assertEqual(2, self.read.call_count)
+
+    def test_mlnx4_mac_from_guid(self):
+        self.assertEqual('00:11:22:33:44:55',
+                         self.pci_utils.get_mac_from_guid(
+                             '0011220000334455',
+                             constants.MLNX4_VF_DEVICE_TYPE))
+        self.assertEqual(constants.INVALID_MAC,
+                         self.pci_utils.get_mac_from_guid(
+                             constants.MLNX4_INVALID_GUID,
+                             constants.MLNX4_VF_DEVICE_TYPE))
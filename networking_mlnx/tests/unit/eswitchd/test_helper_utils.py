@@ -0,0 +1,64 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+import traceback
+
+from networking_mlnx.eswitchd.utils import helper_utils
+from networking_mlnx.tests import base
+
+
+def _fail(item):
+    raise ValueError(item)
+
+
+class TestWorkerPool(base.TestCase):
+
+    def setUp(self):
+        super(TestWorkerPool, self).setUp()
+        self.pool = helper_utils.WorkerPool(4, 'test')
+
+    def test_map_keeps_order(self):
+        self.assertEqual([0, 2, 4, 6, 8],
+                         self.pool.map(lambda item: item * 2, range(5)))
+
+    def test_threads_reused(self):
+        names = set()
+
+        def record(item):
+            names.add(threading.current_thread().name)
+
+        for i in range(3):
+            self.pool.map(record, range(8))
+        self.assertEqual(4, len(self.pool._threads))
+        self.assertTrue(names <= set('test-%d' % i for i in range(4)))
+
+    def test_error_keeps_traceback(self):
+        try:
+            self.pool.map(_fail, ['a', 'b'])
+        except ValueError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+        self.assertEqual('_fail', frames[-1][2])
+
+
+class TestParallelMap(base.TestCase):
+
+    def test_error_keeps_traceback(self):
+        try:
+            helper_utils.parallel_map(_fail, ['a', 'b'], 2)
+        except ValueError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+        self.assertEqual('_fail', frames[-1][2])
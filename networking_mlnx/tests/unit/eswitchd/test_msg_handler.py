@@ -0,0 +1,156 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from networking_mlnx.eswitchd import msg_handler
+from networking_mlnx.tests import base
+
+
+class TestMessageDispatch(base.TestCase):
+
+    def setUp(self):
+        super(TestMessageDispatch, self).setUp()
+        self.eswitch_handler = mock.Mock()
+        self.eswitch_handler.eswitches = {'default': []}
+        self.eswitch_handler.get_vnics.return_value = {}
+        self.dispatcher = msg_handler.MessageDispatch(self.eswitch_handler)
+        lock_p = mock.patch.object(msg_handler.lockutils, 'lock')
+        self.lock = lock_p.start()
+
+    def test_get_vnics_not_locked(self):
+        result = self.dispatcher.handle_msg({'action': 'get_vnics',
+                                             'fabric': '*'})
+        self.assertEqual('OK', result['status'])
+        self.assertFalse(self.lock.called)
+
+    def test_plug_nic_locked_by_vf(self):
+        self.dispatcher.handle_msg({'action': 'plug_nic',
+                                    'fabric': 'default',
+                                    'device_id': 'vm-1',
+                                    'vnic_mac': '00:00:00:00:00:01',
+                                    'dev_name': '0000:03:00.1'})
+        self.lock.assert_called_once_with('eswitchd-0000:03:00.1')
+
+    def test_set_vlan_locked_by_vnic_vf(self):
+        self.eswitch_handler.get_dev_for_vnic.return_value = '0000:03:00.2'
+        self.dispatcher.handle_msg({'action': 'set_vlan',
+                                    'fabric': 'default',
+                                    'port_mac': '00:00:00:00:00:0A',
+                                    'vlan': 3})
+        self.eswitch_handler.get_dev_for_vnic.assert_called_with(
+            'default', '00:00:00:00:00:0a')
+        self.lock.assert_called_once_with('eswitchd-0000:03:00.2')
+
+    def test_lock_retaken_when_vnic_vf_changed(self):
+        # The vNIC is plugged on another VF before the lock is taken
+        self.eswitch_handler.get_dev_for_vnic.side_effect = [
+            '0000:03:00.2', '0000:03:00.3', '0000:03:00.3']
+        self.dispatcher.handle_msg({'action': 'set_vlan',
+                                    'fabric': 'default',
+                                    'port_mac': '00:00:00:00:00:0a',
+                                    'vlan': 3})
+        self.assertEqual([mock.call('eswitchd-0000:03:00.2'),
+                          mock.call('eswitchd-0000:03:00.3')],
+                         self.lock.call_args_list)
+        self.eswitch_handler.set_vlan.assert_called_once_with(
+            'default', '00:00:00:00:00:0a', 3)
+
+    def test_delete_port_unknown_vnic_locked_by_mac(self):
+        self.eswitch_handler.get_dev_for_vnic.return_value = None
+        self.eswitch_handler.delete_port.return_value = None
+        self.dispatcher.handle_msg({'action': 'delete_port',
+                                    'fabric': 'default',
+                                    'vnic_mac': '00:00:00:00:00:01'})
+        self.lock.assert_called_once_with('eswitchd-00:00:00:00:00:01')
+
+    def test_refresh_pkeys(self):
+        result = self.dispatcher.handle_msg({'action': 'refresh_pkeys',
+                                             'fabric': 'default'})
+        self.assertEqual('OK', result['status'])
+        self.eswitch_handler.refresh_pkeys.assert_called_once_with(
+            ['default'])
+        self.assertFalse(self.lock.called)
+
+    def test_get_sysfs_stats(self):
+        self.eswitch_handler.get_sysfs_stats.return_value = {'skipped': 3}
+        result = self.dispatcher.handle_msg({'action': 'get_sysfs_stats'})
+        self.assertEqual('OK', result['status'])
+        self.assertEqual({'stats': {'skipped': 3}}, result['response'])
+
+    def test_get_vf_rebinds(self):
+        self.eswitch_handler.get_vf_rebinds.return_value = {
+            '0000:03:00.1': 'queued'}
+        result = self.dispatcher.handle_msg({'action': 'get_vf_rebinds'})
+        self.assertEqual({'rebinds': {'0000:03:00.1': 'queued'}},
+                         result['response'])
+
+    def test_unknown_action(self):
+        result = self.dispatcher.handle_msg({'action': 'no_such_action'})
+        self.assertEqual('FAIL', result['status'])
+        self.assertFalse(self.lock.called)
+
+
+class TestBatchMessage(base.TestCase):
+
+    def setUp(self):
+        super(TestBatchMessage, self).setUp()
+        self.eswitch_handler = mock.Mock()
+        self.eswitch_handler.get_dev_for_vnic.return_value = None
+        self.eswitch_handler.set_vlan.return_value = True
+        self.dispatcher = msg_handler.MessageDispatch(self.eswitch_handler,
+                                                      batch_workers=4)
+
+    def _set_vlan(self, mac, vlan):
+        return {'action': 'set_vlan', 'fabric': 'default',
+                'port_mac': mac, 'vlan': vlan}
+
+    def test_batch_results_in_request_order(self):
+        messages = [self._set_vlan('00:00:00:00:00:01', 3),
+                    {'action': 'no_such_action'},
+                    self._set_vlan('00:00:00:00:00:02', 4)]
+        result = self.dispatcher.handle_msg({'action': 'batch',
+                                             'messages': messages})
+        self.assertEqual('OK', result['status'])
+        results = result['response']['results']
+        self.assertEqual(['OK', 'FAIL', 'OK'],
+                         [r['status'] for r in results])
+        self.assertEqual(['set_vlan', 'no_such_action', 'set_vlan'],
+                         [r['action'] for r in results])
+
+    def test_batch_invalid_messages(self):
+        result = self.dispatcher.handle_msg({'action': 'batch',
+                                             'messages': 'set_vlan'})
+        self.assertEqual('FAIL', result['status'])
+
+    def test_nested_batch_not_supported(self):
+        result = self.dispatcher.handle_msg(
+            {'action': 'batch',
+             'messages': [{'action': 'batch', 'messages': []}]})
+        self.assertEqual('FAIL', result['response']['results'][0]['status'])
+
+    def test_batch_groups_by_vnic_and_vf(self):
+        self.eswitch_handler.get_dev_for_vnic.side_effect = (
+            lambda fabric, mac: {'00:00:00:00:00:01': '0000:03:00.1'}.get(
+                mac))
+        messages = [
+            self._set_vlan('00:00:00:00:00:01', 3),
+            self._set_vlan('00:00:00:00:00:02', 3),
+            {'action': 'get_vnics', 'fabric': '*'},
+            {'action': 'plug_nic', 'fabric': 'default',
+             'device_id': 'vm-1', 'vnic_mac': '00:00:00:00:00:02',
+             'dev_name': '0000:03:00.1'}]
+        groups = self.dispatcher._get_batch_groups(messages)
+        self.assertEqual(sorted([[0, 1, 3], [2]]), sorted(groups))
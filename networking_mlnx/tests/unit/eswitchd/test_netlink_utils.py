@@ -0,0 +1,156 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import socket
+
+import mock
+import testtools
+
+from networking_mlnx.eswitchd.common import config  # noqa
+from networking_mlnx.eswitchd.common import exceptions
+from networking_mlnx.eswitchd.utils import netlink_utils as nl
+from networking_mlnx.tests import base
+
+
+def _netlink_available():
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             nl.NETLINK_ROUTE)
+    except (AttributeError, socket.error):
+        return False
+    sock.close()
+    return True
+
+
+class FakeNetlinkSocket(object):
+    """Answers rtnetlink link requests from a table of links."""
+
+    def __init__(self, links, set_errno=0):
+        # Interface name to [index, type, flags, operstate]
+        self.links = links
+        self.set_errno = set_errno
+        self.requests = []
+        self.replies = []
+        self.closed = False
+
+    def send(self, data):
+        for msg_type, flags, seq, payload in nl.unpack_msgs(data):
+            self.requests.append(msg_type)
+            self.replies.append(self._answer(msg_type, flags, seq, payload))
+        return len(data)
+
+    def recv(self, size):
+        return self.replies.pop(0)
+
+    def close(self):
+        self.closed = True
+
+    def _error(self, seq, error):
+        return nl.pack_msg(nl.NLMSG_ERROR, 0, seq,
+                           nl.NLMSGERR.pack(-error) + b'\0' * 16)
+
+    def _answer(self, msg_type, flags, seq, payload):
+        family, link_type, index, if_flags, change = (
+            nl.IFINFOMSG.unpack_from(payload))
+        attrs = nl.unpack_attrs(payload[nl.IFINFOMSG.size:])
+        if msg_type == nl.RTM_GETLINK:
+            name = attrs[nl.IFLA_IFNAME].rstrip(b'\0').decode('utf-8')
+            if name not in self.links:
+                return self._error(seq, errno.ENODEV)
+            index, link_type, if_flags, operstate = self.links[name]
+            reply = (nl.IFINFOMSG.pack(0, link_type, index, if_flags, 0) +
+                     nl.pack_attr(nl.IFLA_IFNAME,
+                                  name.encode('utf-8') + b'\0') +
+                     nl.pack_attr(nl.IFLA_OPERSTATE,
+                                  bytes(bytearray([operstate]))))
+            return nl.pack_msg(nl.RTM_NEWLINK, 0, seq, reply)
+        if msg_type == nl.RTM_NEWLINK:
+            if self.set_errno:
+                return self._error(seq, self.set_errno)
+            for link in self.links.values():
+                if link[0] == index:
+                    link[2] = (link[2] & ~change) | (if_flags & change)
+            return self._error(seq, 0)
+
+
+class TestNetlinkClient(base.TestCase):
+
+    def setUp(self):
+        super(TestNetlinkClient, self).setUp()
+        self.sock = FakeNetlinkSocket({
+            'ib0': [4, nl.ARPHRD_INFINIBAND, nl.IFF_UP, 6],
+            'eth1': [5, nl.ARPHRD_ETHER, 0, 2]})
+        self.client = nl.NetlinkClient()
+        self.open = mock.patch.object(self.client, '_open',
+                                      return_value=self.sock).start()
+
+    def test_get_link(self):
+        self.assertEqual(
+            nl.Link(4, 'ib0', nl.ARPHRD_INFINIBAND, nl.IFF_UP, 'up'),
+            self.client.get_link('ib0'))
+        self.assertTrue(self.client.is_link_up('ib0'))
+        self.assertFalse(self.client.is_link_up('eth1'))
+        self.assertEqual(1, self.open.call_count)
+
+    def test_get_unknown_link(self):
+        e = self.assertRaises(exceptions.NetlinkError,
+                              self.client.get_link, 'ib9')
+        self.assertEqual(errno.ENODEV, e.errno)
+        self.assertFalse(self.sock.closed)
+
+    def test_set_link_up(self):
+        self.client.set_link_up('eth1')
+        self.assertTrue(self.client.is_link_up('eth1'))
+        self.assertEqual([nl.RTM_GETLINK, nl.RTM_NEWLINK, nl.RTM_GETLINK],
+                         self.sock.requests)
+
+    def test_set_link_up_already_up(self):
+        self.client.set_link_up('ib0')
+        self.assertEqual([nl.RTM_GETLINK], self.sock.requests)
+
+    def test_set_link_up_not_permitted(self):
+        self.sock.set_errno = errno.EPERM
+        e = self.assertRaises(exceptions.NetlinkError,
+                              self.client.set_link_up, 'eth1')
+        self.assertEqual(errno.EPERM, e.errno)
+
+    def test_stale_reply_dropped(self):
+        stale = nl.pack_msg(nl.NLMSG_ERROR, 0, 0, nl.NLMSGERR.pack(
+            -errno.EBUSY) + b'\0' * 16)
+        self.sock.replies.append(stale)
+        self.sock.recv = lambda size: (self.sock.replies.pop(0) +
+                                       self.sock.replies.pop(0))
+        self.assertEqual('ib0', self.client.get_link('ib0').name)
+
+    def test_socket_error_reopens(self):
+        self.sock.recv = mock.Mock(side_effect=socket.timeout('timed out'))
+        self.assertRaises(exceptions.NetlinkError, self.client.get_link,
+                          'ib0')
+        self.assertTrue(self.sock.closed)
+        self.open.return_value = FakeNetlinkSocket(self.sock.links)
+        self.assertEqual(4, self.client.get_link('ib0').index)
+        self.assertEqual(2, self.open.call_count)
+
+
+@testtools.skipUnless(_netlink_available(), 'netlink is not available')
+class TestNetlinkClientKernel(base.TestCase):
+
+    def test_get_loopback(self):
+        client = nl.NetlinkClient()
+        self.addCleanup(client.close)
+        link = client.get_link('lo')
+        self.assertEqual('lo', link.name)
+        self.assertTrue(client.is_link_up('lo'))
@@ -16,13 +16,18 @@
 
 import contextlib
 import mock
+import os
+import shutil
 import six
 import subprocess
 import sys
+import tempfile
 
 sys.modules['ethtool'] = mock.Mock()
 
 from networking_mlnx._i18n import _LE
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.utils import netlink_utils
 from networking_mlnx.eswitchd.utils import pci_utils
 from networking_mlnx.tests import base
 
@@ -86,3 +91,102 @@ class TestPciUtils(base.TestCase):
 
         is_sriov = self.pci_utils.is_sriov_pf(pf)
         self.assertFalse(is_sriov)
+
+    def test_get_vfs_info(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        dev_path = os.path.join(tmpdir, 'ib0', 'device')
+        os.makedirs(dev_path)
+        open(os.path.join(dev_path, 'vendor'), 'w').close()
+        for vf_num in range(2):
+            vf_pci = '0000:03:00.%d' % (vf_num + 1)
+            os.makedirs(os.path.join(tmpdir, vf_pci))
+            with open(os.path.join(tmpdir, vf_pci, 'device'), 'w') as fd:
+                fd.write('0x1016\n')
+            os.symlink(os.path.join('..', '..', vf_pci),
+                       os.path.join(dev_path, 'virtfn%d' % vf_num))
+        eth_dev = os.path.join(tmpdir, '%(interface)s', 'device')
+        with nested(
+                mock.patch.object(pci_utils.pciUtils, 'ETH_DEV', eth_dev),
+                mock.patch.object(pci_utils.pciUtils, 'DEVICE_TYPE_PATH',
+                                  eth_dev + '/virtfn%(vf_num)s/device'),
+                mock.patch.object(
+                    self.pci_utils, 'get_vf_device_type',
+                    wraps=self.pci_utils.get_vf_device_type)) as (
+                        eth_dev_p, device_type_p, get_vf_device_type):
+            vfs = self.pci_utils.get_vfs_info('ib0')
+        # The device type is read once per PF
+        self.assertEqual(1, get_vf_device_type.call_count)
+        self.assertEqual(
+            {'0000:03:00.1': pci_utils.VfInfo(
+                '0', constants.MLNX5_VF_DEVICE_TYPE),
+             '0000:03:00.2': pci_utils.VfInfo(
+                 '1', constants.MLNX5_VF_DEVICE_TYPE)},
+            vfs)
+
+    def test_get_device_address(self):
+        hostdev = {'domain': '0x0000', 'bus': '0x83', 'slot': '0x1f',
+                   'function': '0x7'}
+        self.assertEqual('0000:83:1f.7',
+                         self.pci_utils.get_device_address(hostdev))
+
+    def test_get_vfs_macs_ib_mlnx4(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        guids = {'1': 'fa163e0000a1b2c3', '2': 'ffffffffffffffff',
+                 '3': 'fa163e0000a1b2zz'}
+        for vf_index, guid in guids.items():
+            with open(os.path.join(tmpdir, vf_index), 'w') as fd:
+                fd.write(guid + '\n')
+        with mock.patch.object(constants, 'MLNX4_ADMIN_GUID_PATH',
+                               tmpdir + '/%s%s%s'):
+            macs = self.pci_utils.get_vfs_macs_ib_mlnx4(
+                {'hca_port': '', 'pf_mlx_dev': ''})
+        # A malformed GUID does not fail the other VFs
+        self.assertEqual({'1': 'fa:16:3e:a1:b2:c3',
+                          '2': constants.INVALID_MAC,
+                          '3': constants.INVALID_MAC}, macs)
+
+    def test_get_vfs_macs_ib_mlnx5(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        for vf_num in ('0', '1'):
+            with open(os.path.join(tmpdir, vf_num), 'w') as fd:
+                fd.write('fa:16:3e:00:00:a1:b2:c%s\n' % vf_num)
+        vfs = {'0000:03:00.1': pci_utils.VfInfo(
+                   '0', constants.MLNX5_VF_DEVICE_TYPE),
+               '0000:03:00.2': pci_utils.VfInfo(
+                   '1', constants.MLNX5_VF_DEVICE_TYPE)}
+        with mock.patch.object(constants, 'MLNX5_GUID_NODE_PATH',
+                               tmpdir + '/%(module)s%(vf_num)s'):
+            macs = self.pci_utils.get_vfs_macs_ib_mlnx5(
+                {'vfs': vfs, 'pf_mlx_dev': ''})
+        self.assertEqual({'0': 'fa:16:3e:a1:b2:c0',
+                          '1': 'fa:16:3e:a1:b2:c1'}, macs)
+
+    def test_get_vfs_macs_ib_mlnx5_malformed_guid(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        for vf_num, guid in (('0', 'fa:16:3e:00:00:a1:b2:c0'),
+                             ('1', 'fa:16:3e:00:00:a1:b2:zz')):
+            with open(os.path.join(tmpdir, vf_num), 'w') as fd:
+                fd.write(guid + '\n')
+        vfs = {'0000:03:00.1': pci_utils.VfInfo(
+                   '0', constants.MLNX5_VF_DEVICE_TYPE),
+               '0000:03:00.2': pci_utils.VfInfo(
+                   '1', constants.MLNX5_VF_DEVICE_TYPE)}
+        with mock.patch.object(constants, 'MLNX5_GUID_NODE_PATH',
+                               tmpdir + '/%(module)s%(vf_num)s'):
+            macs = self.pci_utils.get_vfs_macs_ib_mlnx5(
+                {'vfs': vfs, 'pf_mlx_dev': ''})
+        self.assertEqual({'0': 'fa:16:3e:a1:b2:c0',
+                          '1': constants.INVALID_MAC}, macs)
+
+    def test_get_interface_type(self):
+        self.pci_utils.netlink = mock.Mock()
+        self.pci_utils.netlink.get_link.return_value = netlink_utils.Link(
+            4, 'ib0', netlink_utils.ARPHRD_INFINIBAND, 0, 'up')
+        self.assertEqual('ib', self.pci_utils.get_interface_type('ib0'))
+        self.pci_utils.netlink.get_link.return_value = netlink_utils.Link(
+            5, 'eth1', netlink_utils.ARPHRD_ETHER, 0, 'up')
+        self.assertEqual('eth', self.pci_utils.get_interface_type('eth1'))
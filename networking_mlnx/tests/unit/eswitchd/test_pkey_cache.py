@@ -0,0 +1,87 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+import mock
+from oslo_config import cfg
+
+from networking_mlnx.eswitchd.common import config  # noqa
+from networking_mlnx.eswitchd.common import constants
+from networking_mlnx.eswitchd.db import pkey_cache
+from networking_mlnx.tests import base
+
+
+class TestPkeyCache(base.TestCase):
+
+    def setUp(self):
+        super(TestPkeyCache, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.pkeys_dir = os.path.join(self.tmpdir, 'mlx4_0', '1')
+        os.makedirs(self.pkeys_dir)
+        self._set_pkeys(['0xffff', '0x8005', '0x0005', '0x0000'])
+        mock.patch.object(constants, 'MLNX4_PKEYS_PATH',
+                          os.path.join(self.tmpdir, '%s', '%s')).start()
+        self.cache = pkey_cache.PkeyCache()
+
+    def _set_pkeys(self, pkeys):
+        for idx, pkey in enumerate(pkeys):
+            with open(os.path.join(self.pkeys_dir, str(idx)), 'w') as fd:
+                fd.write(pkey + '\n')
+
+    def test_get_pkey_idx(self):
+        self.assertEqual('0', self.cache.get_pkey_idx(0xffff, 'mlx4_0', 1))
+        self.assertEqual('1', self.cache.get_pkey_idx('5', 'mlx4_0', 1))
+        self.assertIsNone(self.cache.get_pkey_idx('7', 'mlx4_0', 1))
+
+    def test_cached(self):
+        self.cache.get_pkey_idx('5', 'mlx4_0', 1)
+        with mock.patch('six.moves.builtins.open') as open_mock:
+            self.assertEqual('1', self.cache.get_pkey_idx('5', 'mlx4_0', 1))
+        self.assertFalse(open_mock.called)
+
+    def test_reload_on_miss(self):
+        self.assertIsNone(self.cache.get_pkey_idx('7', 'mlx4_0', 1))
+        self._set_pkeys(['0xffff', '0x8005', '0x0005', '0x8007'])
+        self.assertEqual('3', self.cache.get_pkey_idx('7', 'mlx4_0', 1))
+
+    def test_reload_after_ttl(self):
+        cfg.CONF.set_override('pkey_cache_ttl', 0, 'DAEMON')
+        self.addCleanup(cfg.CONF.clear_override, 'pkey_cache_ttl', 'DAEMON')
+        self.assertEqual('1', self.cache.get_pkey_idx('5', 'mlx4_0', 1))
+        self._set_pkeys(['0xffff', '0x8006', '0x8005'])
+        with mock.patch.object(pkey_cache.time, 'time', return_value=1e12):
+            self.assertEqual('2', self.cache.get_pkey_idx('5', 'mlx4_0', 1))
+
+    def test_zero_ttl_reloads_every_lookup(self):
+        cfg.CONF.set_override('pkey_cache_ttl', 0, 'DAEMON')
+        self.addCleanup(cfg.CONF.clear_override, 'pkey_cache_ttl', 'DAEMON')
+        with mock.patch.object(pkey_cache.time, 'time', return_value=1e9):
+            self.assertEqual('1', self.cache.get_pkey_idx('5', 'mlx4_0', 1))
+            self._set_pkeys(['0xffff', '0x8006', '0x8005'])
+            self.assertEqual('2', self.cache.get_pkey_idx('5', 'mlx4_0', 1))
+
+    def test_negative_ttl_rejected(self):
+        self.assertRaises(ValueError, cfg.CONF.set_override,
+                          'pkey_cache_ttl', -1, 'DAEMON')
+
+    def test_refresh(self):
+        self.cache.get_pkey_idx('5', 'mlx4_0', 1)
+        self._set_pkeys(['0xffff', '0x8006', '0x8005'])
+        self.cache.refresh('mlx4_0', 1)
+        self.assertEqual('2', self.cache.get_pkey_idx('5', 'mlx4_0', 1))
@@ -0,0 +1,104 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+from oslo_config import cfg
+
+from networking_mlnx.eswitchd.common import config  # noqa
+from networking_mlnx.eswitchd.utils import rebind_queue
+from networking_mlnx.tests import base
+
+VF_1 = '0000:03:00.1'
+VF_2 = '0000:03:00.2'
+
+
+class TestRebindQueue(base.TestCase):
+
+    def setUp(self):
+        super(TestRebindQueue, self).setUp()
+        self.rebound = []
+        self.started = threading.Event()
+        # Rebinds block until released
+        self.release = threading.Event()
+        self.queue = rebind_queue.RebindQueue(self._rebind)
+        self.addCleanup(self.release.set)
+
+    def _rebind(self, dev):
+        self.started.set()
+        self.assertTrue(self.release.wait(10))
+        if dev == 'bad':
+            raise IOError('no such device')
+        self.rebound.append(dev)
+
+    def test_rebind(self):
+        self.release.set()
+        self.queue.schedule(VF_1)
+        self.queue.wait(VF_1)
+        self.assertEqual([VF_1], self.rebound)
+        self.assertEqual({}, self.queue.get_states())
+        self.assertEqual(1, self.queue.get_stats()['done'])
+
+    def test_coalesce_queued(self):
+        cfg.CONF.set_override('rebind_workers', 1, 'DAEMON')
+        self.addCleanup(cfg.CONF.clear_override, 'rebind_workers', 'DAEMON')
+        self.queue.schedule(VF_2)
+        self.assertTrue(self.started.wait(10))
+        self.queue.schedule(VF_1)
+        self.queue.schedule(VF_1)
+        self.assertEqual({VF_1: rebind_queue.QUEUED,
+                          VF_2: rebind_queue.RUNNING},
+                         self.queue.get_states())
+        self.release.set()
+        self.queue.wait(VF_1)
+        self.queue.wait(VF_2)
+        self.assertEqual([VF_2, VF_1], self.rebound)
+        self.assertEqual(1, self.queue.get_stats()['coalesced'])
+
+    def test_schedule_while_running(self):
+        self.queue.schedule(VF_1)
+        self.assertTrue(self.started.wait(10))
+        self.queue.schedule(VF_1)
+        self.queue.schedule(VF_1)
+        self.release.set()
+        self.queue.wait(VF_1)
+        self.assertEqual([VF_1, VF_1], self.rebound)
+        self.assertEqual(1, self.queue.get_stats()['coalesced'])
+
+    def test_parallel_rebinds(self):
+        self.queue.schedule(VF_1)
+        self.queue.schedule(VF_2)
+        self.assertTrue(self.started.wait(10))
+        # Both VFs are rebound at once by different workers
+        for i in range(100):
+            if set(self.queue.get_states().values()) == set(
+                    [rebind_queue.RUNNING]):
+                break
+            threading.Event().wait(0.1)
+        self.assertEqual({VF_1: rebind_queue.RUNNING,
+                          VF_2: rebind_queue.RUNNING},
+                         self.queue.get_states())
+        self.release.set()
+        self.queue.wait(VF_1)
+        self.queue.wait(VF_2)
+        self.assertEqual(set([VF_1, VF_2]), set(self.rebound))
+
+    def test_failed_rebind(self):
+        self.release.set()
+        self.queue.schedule('bad')
+        self.queue.wait('bad')
+        self.assertEqual({'bad': rebind_queue.FAILED},
+                         self.queue.get_states())
+        self.assertEqual(1, self.queue.get_stats()['failed'])
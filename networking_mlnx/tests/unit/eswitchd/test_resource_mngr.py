@@ -0,0 +1,238 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+import sys
+import threading
+
+import mock
+import testtools
+
+
+def _import_libvirt():
+    # Other tests may have replaced libvirt with a mock
+    mocked = sys.modules.pop('libvirt', None)
+    try:
+        return importlib.import_module('libvirt')
+    except ImportError:
+        return None
+    finally:
+        if mocked is not None:
+            sys.modules['libvirt'] = mocked
+
+
+real_libvirt = _import_libvirt()
+
+sys.modules['ethtool'] = mock.Mock()
+sys.modules['libvirt'] = mock.Mock()
+
+from networking_mlnx.eswitchd.common import config  # noqa
+from networking_mlnx.eswitchd import resource_mngr
+from networking_mlnx.tests import base
+
+DOMAIN_XML = """<domain>
+  <uuid>%(uuid)s</uuid>
+  <devices>
+    <hostdev mode='subsystem' type='pci'>
+      <source>
+        <address domain='0x0000' bus='0x03' slot='0x00' function='0x%(fn)s'/>
+      </source>
+    </hostdev>
+  </devices>
+</domain>"""
+
+
+class LibvirtError(Exception):
+
+    def __init__(self, code=None):
+        super(LibvirtError, self).__init__()
+        self.code = code
+
+    def get_error_code(self):
+        return self.code
+
+
+class TestResourceManager(base.TestCase):
+
+    def setUp(self):
+        super(TestResourceManager, self).setUp()
+        self.libvirt = mock.patch.object(resource_mngr, 'libvirt').start()
+        self.libvirt.libvirtError = LibvirtError
+        self.conn = self.libvirt.openReadOnly.return_value
+        self.domain = self._domain('vm-1', '1')
+        self.conn.listAllDomains.return_value = [self.domain]
+        self.rm = resource_mngr.ResourceManager()
+        self.rm.pci_utils = mock.Mock()
+        self.rm.pci_utils.get_device_address.side_effect = (
+            lambda hostdev: '0000:03:00.%s' % hostdev.get('function')[2:])
+        mock.patch.object(self.rm, '_get_vfs_macs', return_value={}).start()
+        self.attached = mock.patch.object(
+            self.rm, '_get_attached_hostdevs',
+            side_effect=lambda devs: [(dev, None, 'default')
+                                      for dev in devs]).start()
+
+    def _domain(self, uuid, fn):
+        domain = mock.Mock()
+        domain.UUIDString.return_value = uuid
+        domain.XMLDesc.return_value = DOMAIN_XML % {'uuid': uuid, 'fn': fn}
+        return domain
+
+    def test_scan_attached_devices(self):
+        devices, vm_ids = self.rm.scan_attached_devices()
+        self.assertEqual([('0000:03:00.1', None, 'default')], devices)
+        self.assertEqual({'0000:03:00.1': 'vm-1'}, vm_ids)
+
+    def test_connection_reused(self):
+        self.rm.scan_attached_devices()
+        self.rm.scan_attached_devices()
+        self.assertEqual(1, self.libvirt.openReadOnly.call_count)
+
+    def test_reconnect_on_error(self):
+        self.rm.scan_attached_devices()
+        self.conn.listAllDomains.side_effect = [LibvirtError(),
+                                                [self.domain]]
+        devices, vm_ids = self.rm.scan_attached_devices()
+        self.assertEqual(2, self.libvirt.openReadOnly.call_count)
+        self.assertTrue(self.conn.close.called)
+        self.assertEqual({'0000:03:00.1': 'vm-1'}, vm_ids)
+
+    def test_scan_without_list_all_domains(self):
+        conn = mock.Mock(spec=['isAlive', 'close', 'listDefinedDomains',
+                               'lookupByName', 'listDomainsID',
+                               'lookupByID'])
+        self.libvirt.openReadOnly.return_value = conn
+        self.libvirt.VIR_DOMAIN_SHUTOFF = 5
+        shutoff = self._domain('vm-2', '2')
+        shutoff.info.return_value = [5, 0, 0, 1, 0]
+        conn.listDefinedDomains.return_value = ['vm-2']
+        conn.lookupByName.return_value = shutoff
+        conn.listDomainsID.return_value = [1]
+        conn.lookupByID.return_value = self.domain
+        devices, vm_ids = self.rm.scan_attached_devices()
+        self.assertEqual({'0000:03:00.1': 'vm-1', '0000:03:00.2': 'vm-2'},
+                         vm_ids)
+
+    def test_unchanged_domain_not_parsed(self):
+        self.rm.scan_attached_devices()
+        with mock.patch.object(resource_mngr.domain_utils,
+                               'get_pci_hostdev_addresses') as parse:
+            self.rm.scan_attached_devices()
+        self.assertFalse(parse.called)
+
+    def test_changed_domain_parsed(self):
+        self.rm.scan_attached_devices()
+        self.domain.XMLDesc.return_value = DOMAIN_XML % {'uuid': 'vm-1',
+                                                         'fn': '2'}
+        devices, vm_ids = self.rm.scan_attached_devices()
+        self.assertEqual({'0000:03:00.2': 'vm-1'}, vm_ids)
+
+    def test_unchanged_domain_not_fetched_with_events(self):
+        self.rm.domain_listener = mock.Mock()
+        self.domain.ID.return_value = 3
+        self.rm.scan_attached_devices()
+        with mock.patch.object(resource_mngr.domain_utils,
+                               'get_pci_hostdev_addresses') as parse:
+            devices, vm_ids = self.rm.scan_attached_devices()
+        self.assertFalse(parse.called)
+        self.assertEqual(1, self.domain.XMLDesc.call_count)
+        self.assertEqual({'0000:03:00.1': 'vm-1'}, vm_ids)
+
+    def test_restarted_domain_fetched_with_events(self):
+        self.rm.domain_listener = mock.Mock()
+        self.domain.ID.return_value = 3
+        self.rm.scan_attached_devices()
+        self.domain.ID.return_value = 4
+        self.domain.XMLDesc.return_value = DOMAIN_XML % {'uuid': 'vm-1',
+                                                         'fn': '2'}
+        devices, vm_ids = self.rm.scan_attached_devices()
+        self.assertEqual({'0000:03:00.2': 'vm-1'}, vm_ids)
+
+    def test_changed_domain_event_fetches_domain(self):
+        self.rm.domain_listener = mock.Mock()
+        self.domain.ID.return_value = 3
+        self.rm.scan_attached_devices()
+        self.conn.lookupByUUIDString.return_value = self.domain
+        self.domain.XMLDesc.return_value = DOMAIN_XML % {'uuid': 'vm-1',
+                                                         'fn': '2'}
+        self.assertEqual([('0000:03:00.2', None, 'default')],
+                         self.rm.scan_domain('vm-1'))
+        # The cache holds the hostdevs fetched for the event
+        devices, vm_ids = self.rm.scan_attached_devices()
+        self.assertEqual({'0000:03:00.2': 'vm-1'}, vm_ids)
+        self.assertEqual(2, self.domain.XMLDesc.call_count)
+
+    def test_connection_closed_forgets_domains(self):
+        self.rm.domain_listener = mock.Mock()
+        self.rm.scan_attached_devices()
+        self.rm._conn_closed(self.conn, 0, None)
+        self.assertEqual({}, self.rm.domains_hostdevs)
+        self.rm.domain_listener.assert_called_once_with(None)
+
+    def test_gone_domain_forgotten(self):
+        self.rm.scan_attached_devices()
+        self.conn.listAllDomains.return_value = []
+        devices, vm_ids = self.rm.scan_attached_devices()
+        self.assertEqual([], devices)
+        self.assertEqual({}, self.rm.domains_hostdevs)
+
+    def test_scan_domain(self):
+        self.conn.lookupByUUIDString.return_value = self.domain
+        self.assertEqual([('0000:03:00.1', None, 'default')],
+                         self.rm.scan_domain('vm-1'))
+        self.assertIn('vm-1', self.rm.domains_hostdevs)
+
+    def test_scan_undefined_domain(self):
+        self.rm.scan_attached_devices()
+        self.conn.lookupByUUIDString.side_effect = LibvirtError(
+            self.libvirt.VIR_ERR_NO_DOMAIN)
+        self.assertEqual([], self.rm.scan_domain('vm-1'))
+        self.assertNotIn('vm-1', self.rm.domains_hostdevs)
+
+    def test_scan_domain_connection_error(self):
+        self.conn.lookupByUUIDString.side_effect = LibvirtError()
+        self.assertRaises(LibvirtError, self.rm.scan_domain, 'vm-1')
+
+
+@testtools.skipIf(real_libvirt is None, 'libvirt python bindings missing')
+class TestResourceManagerDomainEvents(base.TestCase):
+    """Domain events delivered by the libvirt test driver."""
+
+    def setUp(self):
+        super(TestResourceManagerDomainEvents, self).setUp()
+        mock.patch.object(resource_mngr, 'libvirt', real_libvirt).start()
+        mock.patch.object(resource_mngr, 'LIBVIRT_URI',
+                          'test:///default').start()
+        self.rm = resource_mngr.ResourceManager()
+        self.rm.pci_utils = mock.Mock()
+        self.rm.device_db.device_db = {}
+        self.changed = []
+        self.event = threading.Event()
+        self.rm.start_domain_events(self._domain_changed)
+        self.conn = real_libvirt.open('test:///default')
+        self.addCleanup(self.conn.close)
+        self.domain = self.conn.lookupByName('test')
+
+    def _domain_changed(self, vm_id):
+        self.changed.append(vm_id)
+        self.event.set()
+
+    def test_lifecycle_event(self):
+        self.domain.suspend()
+        self.addCleanup(self.domain.resume)
+        self.assertTrue(self.event.wait(10))
+        self.assertIn(self.domain.UUIDString(), self.changed)
+
+    def test_scan_domain_without_hostdevs(self):
+        self.assertEqual([], self.rm.scan_domain(self.domain.UUIDString()))
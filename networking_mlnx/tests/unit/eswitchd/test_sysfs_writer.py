@@ -0,0 +1,194 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock
+from oslo_config import cfg
+
+from networking_mlnx.eswitchd.common import config  # noqa
+from networking_mlnx.eswitchd.common import exceptions
+from networking_mlnx.eswitchd.utils import sysfs_writer
+from networking_mlnx.tests import base
+
+SERVER_CMD = [sys.executable, '-c',
+              'import sys; sys.argv = ["ebrctl", "write-sys-server"]; '
+              'from networking_mlnx.eswitchd.cli import ebrctl; '
+              'ebrctl.main()']
+
+
+class TestSysfsWriter(base.TestCase):
+
+    def setUp(self):
+        super(TestSysfsWriter, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.writer = sysfs_writer.SysfsWriter()
+        self.addCleanup(self.writer.stop)
+        start_p = mock.patch.object(
+            self.writer, '_start',
+            side_effect=lambda: subprocess.Popen(
+                SERVER_CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE))
+        self.start = start_p.start()
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def _read(self, name):
+        with open(self._path(name)) as fd:
+            return fd.read()
+
+    def test_write_batch(self):
+        self.writer.write_sys([(self._path('a'), 'Up\n'),
+                               (self._path('b'), 3)])
+        self.writer.write_sys([(self._path('a'), 'Down\n')])
+        self.assertEqual('Down\n', self._read('a'))
+        self.assertEqual('3', self._read('b'))
+        self.assertEqual(1, self.start.call_count)
+
+    def test_write_errors(self):
+        errors = self.writer.write([(self._path('a'), '1'),
+                                    (self._path('no/such/file'), '2'),
+                                    (self._path('c'), '3')])
+        self.assertIsNone(errors[0])
+        self.assertIsNotNone(errors[1])
+        self.assertIsNotNone(errors[2])
+        self.assertFalse(os.path.exists(self._path('c')))
+        self.assertRaises(exceptions.SysfsWriteError,
+                          self.writer.write_sys,
+                          [(self._path('no/such/file'), '2')])
+
+    def test_restart_exited_writer(self):
+        self.writer.write_sys([(self._path('a'), '1')])
+        self.writer.stop()
+        self.writer.write_sys([(self._path('a'), '2')])
+        self.assertEqual('2', self._read('a'))
+        self.assertEqual(2, self.start.call_count)
+
+    def test_not_persistent(self):
+        cfg.CONF.set_override('persistent_sysfs_writer', False, 'DAEMON')
+        self.addCleanup(cfg.CONF.clear_override, 'persistent_sysfs_writer',
+                        'DAEMON')
+        with mock.patch.object(sysfs_writer.command_utils,
+                               'execute') as execute:
+            self.writer.write_sys([('/a', '1'), ('/b', '2')])
+        execute.assert_has_calls([mock.call('ebrctl', 'write-sys', '/a', '1'),
+                                  mock.call('ebrctl', 'write-sys', '/b', '2')])
+        self.assertFalse(self.start.called)
+
+    def test_skip_unchanged(self):
+        self.writer.write_sys([(self._path('a'), '1'),
+                               (self._path('b'), 2)])
+        os.remove(self._path('a'))
+        self.writer.write_sys([(self._path('a'), '1'),
+                               (self._path('b'), '3')])
+        self.assertFalse(os.path.exists(self._path('a')))
+        self.assertEqual('3', self._read('b'))
+        stats = self.writer.get_stats()
+        self.assertEqual(3, stats['written'])
+        self.assertEqual(1, stats['skipped'])
+
+    def test_skip_actions_of_unchanged(self):
+        writes = [(self._path('a'), 'Down\n')]
+        self.writer.write_sys(writes, [(self._path('unbind'), 'vf')])
+        os.remove(self._path('unbind'))
+        self.writer.write_sys(writes, [(self._path('unbind'), 'vf')])
+        self.assertFalse(os.path.exists(self._path('unbind')))
+        self.writer.write_sys([(self._path('a'), 'Up\n')])
+        self.writer.write_sys(writes, [(self._path('unbind'), 'vf')])
+        self.assertEqual('vf', self._read('unbind'))
+        stats = self.writer.get_stats()
+        self.assertEqual(2, stats['actions_written'])
+        self.assertEqual(1, stats['actions_skipped'])
+
+    def test_rewrite_after_failure(self):
+        self.writer.write_sys([(self._path('a'), '1')])
+        self.assertRaises(exceptions.SysfsWriteError,
+                          self.writer.write_sys,
+                          [(self._path('a'), '2'),
+                           (self._path('no/such/file'), '2')])
+        os.remove(self._path('a'))
+        self.writer.write_sys([(self._path('a'), '2')])
+        self.assertEqual('2', self._read('a'))
+
+    def test_skip_disabled(self):
+        cfg.CONF.set_override('skip_unchanged_sysfs_writes', False, 'DAEMON')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'skip_unchanged_sysfs_writes', 'DAEMON')
+        self.writer.write_sys([(self._path('a'), '1')])
+        os.remove(self._path('a'))
+        self.writer.write_sys([(self._path('a'), '1')])
+        self.assertEqual('1', self._read('a'))
+        self.assertEqual(0, self.writer.get_stats()['skipped'])
+
+
+class TestSysfsWriterPool(base.TestCase):
+
+    def setUp(self):
+        super(TestSysfsWriterPool, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.pool = sysfs_writer.SysfsWriterPool()
+        self.addCleanup(self.pool.stop)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def _in_thread(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_writer_per_thread(self):
+        writers = []
+        self._in_thread(lambda: writers.append(self.pool.get())).join()
+        self.assertIs(self.pool.get(), self.pool.get())
+        self.assertIsNot(writers[0], self.pool.get())
+
+    def test_blocked_rebind_does_not_delay_writes(self):
+        writer = sysfs_writer.SysfsWriter()
+        self.addCleanup(writer.stop)
+        mock.patch.object(writer, '_start', side_effect=lambda: (
+            subprocess.Popen(SERVER_CMD, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE))).start()
+        # The rebind writer reads the request and never replies
+        blocked_cmd = [sys.executable, '-c',
+                       'import sys; sys.stdin.readline(); '
+                       'open(%r, "w").close(); sys.stdin.readline()' %
+                       self._path('received')]
+
+        def rebind():
+            rebind_writer = self.pool.get()
+            rebind_writer._start = lambda: subprocess.Popen(
+                blocked_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            try:
+                rebind_writer.write_sys([], [(self._path('unbind'), 'vf')])
+            except Exception:
+                pass
+
+        rebind_thread = self._in_thread(rebind)
+        while not os.path.exists(self._path('received')):
+            time.sleep(0.01)
+        self.assertEqual([None], writer.write([(self._path('a'), '1')]))
+        self.assertTrue(rebind_thread.is_alive())
+        self.pool.stop()
+        rebind_thread.join()
@@ -0,0 +1,191 @@
+# Copyright 2018 Mellanox Technologies, Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import eventlet
+import mock
+from neutron.tests import base
+from oslo_serialization import jsonutils
+import testtools
+
+from networking_mlnx.plugins.ml2.drivers.mlnx.agent import exceptions
+from networking_mlnx.plugins.ml2.drivers.mlnx.agent import utils
+
+
+class TestEswitchUtils(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestEswitchUtils, self).setUp()
+        with mock.patch.object(utils, 'zmq'):
+            self.utils = utils.EswitchUtils('tcp://127.0.0.1:60001', 3000)
+        send_msg_p = mock.patch.object(self.utils, 'send_msg')
+        self.send_msg = send_msg_p.start()
+
+    def _sent_msgs(self):
+        return [jsonutils.loads(c[0][0]) for c in self.send_msg.call_args_list]
+
+    def test_send_without_batch(self):
+        self.utils.set_port_vlan_id('default', 3, '00:00:00:00:00:01')
+        self.utils.port_up('default', '00:00:00:00:00:01')
+        self.assertEqual(['set_vlan', 'port_up'],
+                         [m['action'] for m in self._sent_msgs()])
+
+    def test_batch_sends_one_request(self):
+        self.send_msg.return_value = {'results': [
+            {'action': 'set_vlan', 'status': 'OK', 'response': {}},
+            {'action': 'port_up', 'status': 'OK', 'response': {}}]}
+        with self.utils.batch():
+            self.utils.set_port_vlan_id('default', 3, '00:00:00:00:00:01')
+            with self.utils.batch():
+                self.utils.port_up('default', '00:00:00:00:00:01')
+            self.assertFalse(self.send_msg.called)
+        msgs = self._sent_msgs()
+        self.assertEqual(1, len(msgs))
+        self.assertEqual('batch', msgs[0]['action'])
+        self.assertEqual(['set_vlan', 'port_up'],
+                         [m['action'] for m in msgs[0]['messages']])
+        self.assertEqual('00:00:00:00:00:01', msgs[0]['messages'][1]['mac'])
+
+    def test_empty_batch_not_sent(self):
+        with self.utils.batch():
+            pass
+        self.assertFalse(self.send_msg.called)
+
+    def test_batch_failed_item_raises(self):
+        self.send_msg.return_value = {'results': [
+            {'action': 'set_vlan', 'status': 'FAIL', 'reason': 'failed'}]}
+        with testtools.ExpectedException(exceptions.OperationFailed):
+            with self.utils.batch():
+                self.utils.set_port_vlan_id('default', 3,
+                                            '00:00:00:00:00:01')
+
+
+class TestEswitchUtilsEvents(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestEswitchUtilsEvents, self).setUp()
+        zmq_p = mock.patch.object(utils, 'zmq')
+        self.zmq = zmq_p.start()
+        self.addCleanup(zmq_p.stop)
+        self.zmq.Again = type('Again', (Exception, ), {})
+
+    def test_wait_for_events_without_endpoint(self):
+        eswitch_utils = utils.EswitchUtils('tcp://127.0.0.1:60001', 3000)
+        with mock.patch.object(utils.time, 'sleep') as sleep:
+            self.assertEqual([], eswitch_utils.wait_for_events(2))
+        sleep.assert_called_once_with(2)
+
+    def test_wait_for_events(self):
+        eswitch_utils = utils.EswitchUtils('tcp://127.0.0.1:60001', 3000,
+                                           'tcp://127.0.0.1:60002')
+        socket = self.zmq.Context.return_value.socket.return_value
+        socket.recv.side_effect = [b'{"mac": "00:00:00:00:00:01"}',
+                                   self.zmq.Again()]
+        self.assertEqual([{'mac': '00:00:00:00:00:01'}],
+                         eswitch_utils.wait_for_events(2))
+        socket.recv.assert_has_calls([mock.call(),
+                                      mock.call(self.zmq.NOBLOCK)])
+
+
+@testtools.skipIf(utils.zmq is None, 'eventlet.green.zmq is not available')
+class TestEswitchUtilsEventsWait(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestEswitchUtilsEventsWait, self).setUp()
+        context = utils.zmq.Context()
+        self.addCleanup(context.term)
+        self.publisher = context.socket(utils.zmq.PUB)
+        self.publisher.setsockopt(utils.zmq.LINGER, 0)
+        self.addCleanup(self.publisher.close)
+        port = self.publisher.bind_to_random_port('tcp://127.0.0.1')
+        self.utils = utils.EswitchUtils('tcp://127.0.0.1:60001', 500,
+                                        'tcp://127.0.0.1:%d' % port)
+        self.addCleanup(self._close_events)
+
+    def _close_events(self):
+        events = self.utils._events
+        events.close()
+        events.context.term()
+
+    def _tick(self, ticks):
+        while True:
+            ticks.append(None)
+            eventlet.sleep(0.01)
+
+    def test_wait_yields_to_other_greenthreads(self):
+        ticks = []
+        ticker = eventlet.spawn(self._tick, ticks)
+        self.addCleanup(ticker.kill)
+        self.assertEqual([], self.utils.wait_for_events(0.5))
+        self.assertGreater(len(ticks), 10)
+
+    def test_wait_returns_published_events(self):
+        # Connect the subscriber before publishing
+        self.utils._events
+
+        def publish():
+            # Publish until the subscription is established
+            while True:
+                self.publisher.send(b'{"mac": "00:00:00:00:00:01"}')
+                eventlet.sleep(0.05)
+
+        publisher = eventlet.spawn(publish)
+        self.addCleanup(publisher.kill)
+        events = self.utils.wait_for_events(2)
+        self.assertIn({'mac': '00:00:00:00:00:01'}, events)
+
+
+@testtools.skipIf(utils.zmq is None, 'eventlet.green.zmq is not available')
+class TestEswitchUtilsDealer(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestEswitchUtilsDealer, self).setUp()
+        context = utils.zmq.Context()
+        self.addCleanup(context.term)
+        self.server = context.socket(utils.zmq.ROUTER)
+        self.server.setsockopt(utils.zmq.LINGER, 0)
+        self.addCleanup(self.server.close)
+        port = self.server.bind_to_random_port('tcp://127.0.0.1')
+        self.utils = utils.EswitchUtils('tcp://127.0.0.1:%d' % port, 500)
+        self.addCleanup(self.utils.close)
+
+    def _reply(self, frames, response):
+        self.server.send_multipart(frames[:-1] + [jsonutils.dump_as_bytes(
+            {'status': 'OK', 'action': 'get_vnics', 'response': response})])
+
+    def _send(self):
+        return self.utils.send_msg(jsonutils.dumps({'action': 'get_vnics'}))
+
+    def test_send_msg(self):
+        server = eventlet.spawn(
+            lambda: self._reply(self.server.recv_multipart(), 'vnics'))
+        self.assertEqual('vnics', self._send())
+        server.wait()
+
+    @mock.patch.object(utils.comm_utils.time, 'sleep')
+    def test_late_reply_dropped(self, sleep):
+        def serve():
+            lost = self.server.recv_multipart()
+            retried = self.server.recv_multipart()
+            self._reply(lost, 'late')
+            self._reply(retried, 'vnics')
+
+        server = eventlet.spawn(serve)
+        conn = self.utils._conn
+        # The first request times out and is retried on the same
+        # connection, its late reply is not taken for the retry's
+        self.assertEqual('vnics', self._send())
+        server.wait()
+        self.assertTrue(sleep.called)
+        self.assertIs(conn, self.utils._conn)
@@ -16,6 +16,7 @@
 import mock
 from neutron.tests import base
 from oslo_config import cfg
+import oslo_messaging
 import testtools
 
 from networking_mlnx.plugins.ml2.drivers.mlnx.agent import (
@@ -24,6 +25,49 @@ from networking_mlnx.plugins.ml2.drivers.mlnx.agent import exceptions
 from networking_mlnx.plugins.ml2.drivers.mlnx.agent import utils
 
 
+class TestPortRegistry(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPortRegistry, self).setUp()
+        self.ports = mlnx_eswitch_neutron_agent.PortRegistry()
+        self.segment = mlnx_eswitch_neutron_agent.Segment('vlan', 'default',
+                                                          3)
+
+    def test_add_is_idempotent(self):
+        for i in range(3):
+            self.ports.add('mac-1', 'port-1', 'net-1', self.segment)
+        self.assertEqual(1, len(self.ports))
+        self.assertEqual(mlnx_eswitch_neutron_agent.Port(
+            'port-1', 'net-1', self.segment), self.ports.get('mac-1'))
+        self.assertEqual(frozenset(['mac-1']),
+                         self.ports.get_network_ports('net-1'))
+
+    def test_add_moves_port_to_network(self):
+        self.ports.add('mac-1', 'port-1', 'net-1', self.segment)
+        self.ports.add('mac-1', 'port-1', 'net-2', self.segment)
+        self.assertFalse(self.ports.has_network('net-1'))
+        self.assertEqual(frozenset(['mac-1']),
+                         self.ports.get_network_ports('net-2'))
+
+    def test_remove(self):
+        self.ports.add('mac-1', 'port-1', 'net-1', self.segment)
+        self.ports.add('mac-2', 'port-2', 'net-1', self.segment)
+        self.assertEqual('port-1', self.ports.remove('mac-1').port_id)
+        self.assertIsNone(self.ports.remove('mac-1'))
+        self.assertEqual(frozenset(['mac-2']),
+                         self.ports.get_network_ports('net-1'))
+        self.ports.remove('mac-2')
+        self.assertFalse(self.ports.has_network('net-1'))
+
+    def test_remove_network(self):
+        self.ports.add('mac-1', 'port-1', 'net-1', self.segment)
+        self.ports.add('mac-2', 'port-2', 'net-2', self.segment)
+        self.assertTrue(self.ports.remove_network('net-1'))
+        self.assertFalse(self.ports.remove_network('net-1'))
+        self.assertIsNone(self.ports.get('mac-1'))
+        self.assertEqual(1, len(self.ports))
+
+
 class TestEswichManager(base.BaseTestCase):
 
     def setUp(self):
@@ -44,6 +88,140 @@ class TestEswichManager(base.BaseTestCase):
         with testtools.ExpectedException(exceptions.MlnxException):
             self.manager.get_port_id_by_mac('no-such-mac')
 
+    def test_port_up_and_release(self):
+        self.manager.utils = mock.Mock()
+        for i in range(2):
+            self.manager.port_up('net-1', 'vlan', 'default', 3, 'port-1',
+                                 'mac-1')
+        self.assertEqual(1, len(self.manager.ports))
+        self.assertEqual('port-1', self.manager.get_port_id_by_mac('mac-1'))
+        self.manager.port_release('mac-1')
+        self.manager.utils.port_release.assert_called_once_with('default',
+                                                                'mac-1')
+        self.assertEqual(0, len(self.manager.ports))
+        self.manager.port_release('mac-1')
+        self.assertEqual(1, self.manager.utils.port_release.call_count)
+
+    def test_port_up_sends_changes_only(self):
+        self.manager.utils = mock.Mock()
+        for vlan in (3, 3, 4):
+            self.manager.port_up('net-1', 'vlan', 'default', vlan, 'port-1',
+                                 'mac-1')
+        self.assertEqual(
+            [mock.call('default', 3, 'mac-1'),
+             mock.call('default', 4, 'mac-1')],
+            self.manager.utils.set_port_vlan_id.call_args_list)
+        self.assertEqual(2, self.manager.utils.port_up.call_count)
+        self.manager.port_down('net-1', 'default', 'mac-1')
+        self.manager.port_down('net-1', 'default', 'mac-1')
+        self.manager.port_up('net-1', 'vlan', 'default', 4, 'port-1',
+                             'mac-1')
+        self.assertEqual(1, self.manager.utils.port_down.call_count)
+        self.assertEqual(3, self.manager.utils.port_up.call_count)
+
+    def test_failed_batch_not_remembered(self):
+        self.manager.utils = mock.MagicMock()
+        self.manager.utils.batch.return_value.__exit__ = mock.Mock(
+            side_effect=exceptions.OperationFailed(err_msg='failed'))
+        with testtools.ExpectedException(exceptions.OperationFailed):
+            with self.manager.batch():
+                self.manager.port_up('net-1', 'flat', 'default', None,
+                                     'port-1', 'mac-1')
+        self.assertEqual({}, self.manager.applied)
+        self.manager.utils.batch.return_value.__exit__.side_effect = None
+        self.manager.utils.batch.return_value.__exit__.return_value = False
+        with self.manager.batch():
+            self.manager.port_up('net-1', 'flat', 'default', None,
+                                 'port-1', 'mac-1')
+        self.assertEqual(0, self.manager.applied['mac-1'].vlan)
+        self.assertEqual(2, self.manager.utils.port_up.call_count)
+
+    def test_eswitchd_restart_forgets_applied(self):
+        self.manager.utils = mock.Mock()
+        self.manager.vnics_epoch = 'epoch-1'
+        self.manager.port_up('net-1', 'vlan', 'default', 3, 'port-1',
+                             'mac-1')
+        get_delta = self.manager.utils.get_attached_vnics_delta
+        get_delta.return_value = {
+            'epoch': 'epoch-1', 'generation': 3, 'full': False,
+            'added': {}, 'removed': []}
+        self.manager.get_attached_vnics(refresh=True)
+        self.assertIn('mac-1', self.manager.applied)
+        get_delta.return_value = {
+            'epoch': 'epoch-2', 'generation': 1, 'full': True,
+            'added': {}, 'removed': []}
+        self.manager.get_attached_vnics(refresh=True)
+        self.assertEqual({}, self.manager.applied)
+
+    def test_replugged_vnic_configured_again(self):
+        vnic_1 = {'mac': 'mac-1', 'device_id': 'vm-1'}
+        self.manager.utils = mock.Mock()
+        self.manager.vnics = {'mac-1': vnic_1}
+        self.manager.vnics_epoch = 'epoch-1'
+        self.manager.port_up('net-1', 'vlan', 'default', 3, 'port-1',
+                             'mac-1')
+        # The VF is plugged again for the same device
+        self.manager.utils.get_attached_vnics_delta.return_value = {
+            'epoch': 'epoch-1', 'generation': 3, 'full': False,
+            'added': {'mac-1': vnic_1}, 'removed': []}
+        self.manager.get_attached_vnics(refresh=True)
+        self.assertNotIn('mac-1', self.manager.applied)
+        self.manager.port_up('net-1', 'vlan', 'default', 3, 'port-1',
+                             'mac-1')
+        self.assertEqual(2, self.manager.utils.set_port_vlan_id.call_count)
+
+    def test_remove_network_forgets_applied(self):
+        self.manager.utils = mock.Mock()
+        self.manager.port_up('net-1', 'vlan', 'default', 3, 'port-1',
+                             'mac-1')
+        self.manager.port_up('net-2', 'vlan', 'default', 4, 'port-2',
+                             'mac-2')
+        self.manager.remove_network('net-1')
+        self.assertEqual(['mac-2'], list(self.manager.applied))
+
+    def test_get_attached_vnics_applies_delta(self):
+        vnic_1 = {'mac': 'mac-1', 'device_id': 'vm-1'}
+        vnic_2 = {'mac': 'mac-2', 'device_id': 'vm-2'}
+        self.manager.utils = mock.Mock()
+        get_delta = self.manager.utils.get_attached_vnics_delta
+        get_delta.side_effect = [
+            {'epoch': 'epoch-1', 'generation': 3, 'full': True,
+             'added': {'mac-1': vnic_1}, 'removed': []},
+            {'epoch': 'epoch-1', 'generation': 5, 'full': False,
+             'added': {'mac-2': vnic_2}, 'removed': ['mac-1']}]
+        self.assertEqual({'mac-1': vnic_1}, self.manager.get_attached_vnics())
+        self.assertEqual(set(['mac-2']),
+                         self.manager.get_vnics_mac(refresh=True))
+        get_delta.assert_called_with(3, 'epoch-1')
+
+    def test_get_attached_vnics_reuses_snapshot(self):
+        vnic_1 = {'mac': 'mac-1', 'device_id': 'vm-1'}
+        self.manager.utils = mock.Mock()
+        get_delta = self.manager.utils.get_attached_vnics_delta
+        get_delta.return_value = {
+            'epoch': 'epoch-1', 'generation': 3, 'full': True,
+            'added': {'mac-1': vnic_1}, 'removed': []}
+        self.assertEqual(set(['mac-1']), self.manager.get_vnics_mac())
+        self.assertTrue(self.manager.vnic_port_exists('mac-1'))
+        self.assertFalse(self.manager.vnic_port_exists('mac-2'))
+        self.assertEqual(1, get_delta.call_count)
+        with mock.patch.object(mlnx_eswitch_neutron_agent.time, 'time',
+                               return_value=self.manager.vnics_time + 1.5):
+            self.manager.vnic_port_exists('mac-1')
+        self.assertEqual(2, get_delta.call_count)
+
+    def test_get_attached_vnics_ignores_stale_delta(self):
+        vnic_1 = {'mac': 'mac-1', 'device_id': 'vm-1'}
+        self.manager.utils = mock.Mock()
+        self.manager.vnics = {'mac-2': vnic_1}
+        self.manager.vnics_generation = 5
+        self.manager.vnics_epoch = 'epoch-1'
+        self.manager.utils.get_attached_vnics_delta.return_value = {
+            'epoch': 'epoch-1', 'generation': 4, 'full': False,
+            'added': {'mac-1': vnic_1}, 'removed': ['mac-2']}
+        self.assertEqual({'mac-2': vnic_1}, self.manager.get_attached_vnics())
+        self.assertEqual(5, self.manager.vnics_generation)
+
 
 class TestMlnxEswitchRpcCallbacks(base.BaseTestCase):
 
@@ -88,7 +266,7 @@ class TestEswitchAgent(base.BaseTestCase):
         self.agent.plugin_rpc = mock.Mock()
         self.agent.context = mock.Mock()
         self.agent.agent_id = mock.Mock()
-        self.agent.eswitch = mock.Mock()
+        self.agent.eswitch = mock.MagicMock()
         self.agent.eswitch.get_vnics_mac.return_value = []
 
     def test_treat_devices_added_returns_true_for_missing_device(self):
@@ -105,7 +283,8 @@ class TestEswitchAgent(base.BaseTestCase):
 
         :param details: the details to return for the device
         :param func_name: the function that should be called
-        :returns: whether the named function was called
+        :returns: whether the named function was called and whether the
+                  device was reported up
         """
 
         with mock.patch('networking_mlnx.plugins.ml2.drivers.mlnx.agent.'
@@ -115,10 +294,11 @@ class TestEswitchAgent(base.BaseTestCase):
             mock.patch.object(self.agent.plugin_rpc,
                               'get_devices_details_list',
                               return_value=[details]),\
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up') as upd_dev_up,\
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={}) as upd_dev_list,\
             mock.patch.object(self.agent, func_name) as func:
             self.assertFalse(self.agent.treat_devices_added_or_updated([{}]))
-        return (func.called, upd_dev_up.called)
+        return (func.called, bool(upd_dev_list.call_args[0][1]))
 
     def test_treat_devices_added_updates_known_port(self):
         details = mock.MagicMock()
@@ -141,15 +321,67 @@ class TestEswitchAgent(base.BaseTestCase):
         self.assertTrue(func)
         self.assertFalse(dev_up)
 
+    def test_treat_devices_added_configures_ports_in_one_batch(self):
+        devices = ['01:02:03:04:05:0%d' % i for i in range(4)]
+        self.agent.plugin_rpc.get_devices_details_list.return_value = [
+            {'port_id': 'port-%d' % i, 'device': device, 'network_id': 'net',
+             'network_type': 'vlan', 'physical_network': 'default',
+             'segmentation_id': 2, 'admin_state_up': i != 2}
+            for i, device in enumerate(devices)]
+        self.agent.plugin_rpc.update_device_list.return_value = {}
+        with mock.patch.object(self.agent, 'treat_vif_port') as treat:
+            self.assertFalse(self.agent.treat_devices_added_or_updated(
+                set(devices)))
+        self.assertEqual(4, treat.call_count)
+        self.assertEqual(1, self.agent.eswitch.batch.call_count)
+        self.agent.plugin_rpc.update_device_list.assert_called_once_with(
+            self.agent.context, [devices[0], devices[1], devices[3]],
+            [devices[2]], self.agent.agent_id, cfg.CONF.host)
+
+    def test_treat_devices_added_resyncs_failed_status(self):
+        self.agent.plugin_rpc.get_devices_details_list.return_value = [
+            {'device': 'mac-1', 'port_id': 'port-1', 'admin_state_up': True,
+             'network_id': 'net', 'network_type': 'flat',
+             'physical_network': 'default', 'segmentation_id': None}]
+        self.agent.plugin_rpc.update_device_list.return_value = {
+            'devices_up': [], 'failed_devices_up': ['mac-1'],
+            'devices_down': [], 'failed_devices_down': []}
+        with mock.patch.object(self.agent, 'treat_vif_port'):
+            self.assertTrue(self.agent.treat_devices_added_or_updated(
+                set(['mac-1'])))
+
+    def test_update_devices_status_falls_back_to_single_rpcs(self):
+        rpc = self.agent.plugin_rpc
+        rpc.update_device_list.side_effect = oslo_messaging.RemoteError(
+            'NoSuchMethod')
+        rpc.update_device_down.side_effect = [None, Exception()]
+        self.assertEqual(set(['mac-3']), self.agent.update_devices_status(
+            ['mac-1'], ['mac-2', 'mac-3']))
+        self.assertFalse(self.agent.bulk_status_rpc)
+        rpc.update_device_up.assert_called_once_with(
+            self.agent.context, 'mac-1', self.agent.agent_id, cfg.CONF.host)
+        self.assertEqual(2, rpc.update_device_down.call_count)
+        # The bulk RPC is not tried again
+        self.agent.update_devices_status(['mac-1'], [])
+        self.assertEqual(1, rpc.update_device_list.call_count)
+
+    def test_update_devices_status_bulk_failure(self):
+        self.agent.plugin_rpc.update_device_list.side_effect = (
+            oslo_messaging.MessagingTimeout())
+        self.assertEqual(set(['mac-1', 'mac-2']),
+                         self.agent.update_devices_status(['mac-1'],
+                                                          ['mac-2']))
+        self.assertTrue(self.agent.bulk_status_rpc)
+        self.assertFalse(self.agent.plugin_rpc.update_device_up.called)
+
     def test_treat_devices_removed_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
                                side_effect=Exception()):
             self.assertTrue(self.agent.treat_devices_removed([{}]))
 
     def test_treat_devices_removed_releases_port(self):
-        details = dict(exists=False)
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                               return_value=details):
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                               return_value={}):
             with mock.patch.object(self.agent.eswitch,
                                    'port_release') as port_release:
                 self.assertFalse(self.agent.treat_devices_removed([{}]))
@@ -180,6 +412,15 @@ class TestEswitchAgent(base.BaseTestCase):
              'added': set(['11:21:31:41:51:61']),
              'removed': set(['13:23:33:43:53:63'])})
 
+    def test_scan_ports_refreshes_snapshot(self):
+        self.agent.eswitch.get_vnics_mac.return_value = set(['mac-1'])
+        previous = {'current': set(), 'added': set(), 'removed': set(),
+                    'updated': set()}
+        port_info = self.agent.scan_ports(previous, sync=False)
+        self.assertEqual(set(['mac-1']), port_info['added'])
+        self.agent.eswitch.get_vnics_mac.assert_called_once_with(
+            refresh=True)
+
     def test_add_port_update(self):
         mac_addr = '10:20:30:40:50:60'
         self.agent.add_port_update(mac_addr)